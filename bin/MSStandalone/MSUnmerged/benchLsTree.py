@@ -0,0 +1,73 @@
+"""
+Benchmark the MSUnmerged tree traversal path against a local fake gfal2
+context, per protocol and per walker strategy. Example:
+
+    python benchLsTree.py --depth 3 --fanout 5 --files 20 --threads 10 \
+        --latency SRMv2=0.05,XRootD=0.005,WebDAV=0.02 --output bench.json
+"""
+
+import sys
+import logging
+
+from argparse import ArgumentParser
+
+from Utils.GfalBenchmark import FakeGfal2Context, STRATEGIES, benchmarkProtocols, dumpResults
+
+
+# Default emulated per call latencies (in seconds) for every protocol
+DEFAULT_LATENCY = 'SRMv2=0.05,XRootD=0.005,WebDAV=0.02'
+
+# Emulated Pfn prefixes for every protocol
+PFN_PREFIXES = {'SRMv2': 'srm://fake.site:8443/srm/managerv2?SFN=/pnfs/fake.site/data/cms',
+                'XRootD': 'root://fake.site:1094//cms',
+                'WebDAV': 'davs://fake.site:2880/cms'}
+
+
+def parseLatency(latencyStr):
+    """
+    Parse a string of the form: proto1=latency1,proto2=latency2
+    """
+    latency = {}
+    for item in latencyStr.split(','):
+        proto, value = item.split('=')
+        latency[proto.strip()] = float(value)
+    return latency
+
+
+if __name__ == '__main__':
+
+    FORMAT = "%(asctime)s:%(levelname)s:%(module)s:%(funcName)s(): %(message)s"
+    logging.basicConfig(stream=sys.stdout, format=FORMAT, level=logging.WARNING)
+    logger = logging.getLogger(__name__)
+
+    parser = ArgumentParser(description="Benchmark the MSUnmerged lsTree traversal against a fake gfal2 context")
+    parser.add_argument('--depth', type=int, default=3, help='Depth of the emulated tree. Default: 3')
+    parser.add_argument('--fanout', type=int, default=4, help='Subdirectories per directory. Default: 4')
+    parser.add_argument('--files', type=int, default=10, help='Files per directory. Default: 10')
+    parser.add_argument('--threads', type=int, default=10, help='Number of gfal2 contexts in the pool. Default: 10')
+    parser.add_argument('--latency', default=DEFAULT_LATENCY,
+                        help='Per call latency per protocol in seconds. Default: %s' % DEFAULT_LATENCY)
+    parser.add_argument('--jitter', type=float, default=0.0, help='Per call latency jitter in seconds. Default: 0')
+    parser.add_argument('--noReadpp', action='store_true', help='Emulate a storage without readpp support')
+    parser.add_argument('--strategies', default=','.join(sorted(STRATEGIES)),
+                        help='Comma separated list of walker strategies. Default: all')
+    parser.add_argument('--output', default='benchLsTree.json', help='Output JSON file. Default: benchLsTree.json')
+    args = parser.parse_args()
+
+    baseDirLfn = '/store/unmerged'
+    protoTargets = {}
+    for proto, latency in parseLatency(args.latency).items():
+        baseDirPfn = PFN_PREFIXES[proto] + baseDirLfn
+        ctxPool = [FakeGfal2Context(baseDirPfn, depth=args.depth, fanout=args.fanout,
+                                    filesPerDir=args.files, latency=latency, jitter=args.jitter,
+                                    supportsReadpp=not args.noReadpp)
+                   for _ in range(args.threads)]
+        protoTargets[proto] = (ctxPool, baseDirPfn)
+
+    results = benchmarkProtocols(protoTargets, strategies=args.strategies.split(','), logger=logger)
+    dumpResults(results, args.output)
+    for proto in results:
+        for strategy, result in results[proto].items():
+            print("%s %s: %s entries/s, p99 latency: %s sec, peak traced heap: %.2f MB" % (
+                proto, strategy, result['entriesPerSec'], result['latency']['all']['p99'], result['peakTracedMb']))
+    print("Results written to: %s" % args.output)
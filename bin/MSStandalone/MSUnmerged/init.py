@@ -3,15 +3,18 @@ import os
 import time
 import logging
 import resource
-import stat
 import errno
-import json
 import random
 import re
-import queue
 import threading
+import asyncio
+import itertools
+import ssl
+import urllib.request
 
 
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
 from pprint import pformat, pprint
 # from itertools import izip
 
@@ -31,7 +34,14 @@ from WMCore.Database.MongoDB import MongoDB
 from WMCore.WMException import WMException
 from Utils.Pipeline import Pipeline, Functor
 from Utils.TwPrint import twFormat
-from Utils.IteratorTools import grouper
+from Utils.GfalTreeWalker import GfalTreeWalker
+from Utils.GfalBenchmark import benchmarkProtocols, dumpResults
+from Utils.WorkScheduler import ChunkedWorkScheduler
+from Utils.AsyncGfal import AsyncGfal2
+from Utils.SiteStorageConfig import StorageConfigCache
+from Utils.LfnIndex import LfnIndex
+from Utils.StreamTools import iterLines, iterFileChunks
+from Utils.CertTools import getKeyCertFromEnv
 
 
 
@@ -72,123 +82,275 @@ def reset_logging():
                     handler.release()
                 logger.removeHandler(handler)
 
-def _lsTree(ctx, baseDirPfn, haltAtBottom=False, halt=False):
+def lsTree(ctx, baseDirPfn, haltAtBottom=False, asIterator=False):
     """
-    Rrecursively traverse the tree under baseDirPfn and return the resulted list of directories and files
-    param ctx:          Gfal Context manager object
+    Traverse the tree under baseDirPfn breadth-first with a GfalTreeWalker
+    param ctx:          Gfal Context manager object or a list of such to be used as a pool
     param baseDirPfn:   The Pfn of the baseDir starting point
-    param haltAtBottom: Flag, if True stop recursion at the moment the first the first fileEntry is found
-    param halt:         Flag to signal immediate recursion halt
-    return:             Tuple: (List of all directories and files found && The halt flag from the current run)
+    param haltAtBottom: Flag, if True stop the traversal at the moment the first fileEntry is found
+    param asIterator:   Flag, if True return a generator over (pfn, isDir, size, mtime) records
+                        instead of accumulating the whole tree in memory
+    return:             Just a list with the directory contents or a generator if asIterator is set
     """
-    dirList = []
-    if halt:
-        return dirList, halt
-
-    # First test if baseDirPfn is actually a directory entry:
-    try:
-        logger.info("Stat baseDirPfn: %s" % baseDirPfn)
-        entryStat = ctx.stat(baseDirPfn)
-        if not stat.S_ISDIR(entryStat.st_mode):
-            dirList.append(baseDirPfn)
-            logger.info("_lsTree called with a fileEntry: %s" % baseDirPfn)
-            return dirList, halt
-    except gfal2.GError as gfalExc:
-        if gfalExc.code == errno.ENOENT:
-            logger.warning("MISSING baseDir: %s", baseDirPfn)
-            return dirList, halt
-        else:
-            logger.error("FAILED to open baseDir: %s: gfalException: %s", baseDirPfn, str(gfalExc))
-            return dirList, halt
-
-    if baseDirPfn[-1] != '/':
-        baseDirPfn += '/'
+    walker = GfalTreeWalker(ctx, logger=logger)
+    treeGen = walker.walk(baseDirPfn, haltAtBottom=haltAtBottom)
+    if asIterator:
+        return treeGen
+    dirContent = [entry.pfn for entry in treeGen]
+    logger.info("lsTree listing stats: %s", pformat(walker.getListingStats()))
+    return dirContent
 
-    # Second recursively iterate down the tree:
-    try:
-        logger.info("Listing baseDirPfn: %s" % baseDirPfn)
-        dirEntryList = ctx.listdir(baseDirPfn)
-    except gfal2.GError as gfalExc:
-        logger.error("gfal Exception raised while listing %s. GError: %s" % (baseDirPfn, str(gfalExc)))
-        raise gfalExc
 
-    for dirEntry in dirEntryList:
-        if halt:
-            break
-        if dirEntry in ['.', '..']:
+def measureTime(ctx, rse, baseDirLfn='/store/unmerged/', strategies=None, outputFile=None):
+    """
+    Benchmark the tree traversal under baseDirLfn for every protocol known for the rse
+    param ctx:        Gfal Context manager object or a list of such to be used as a pool
+    param rse:        The MSUnmergedRSE object with the pfnPrefixes already resolved
+    param baseDirLfn: The Lfn of the baseDir starting point
+    param strategies: A list of walker strategies to measure. Default: ['concurrent-readpp']
+    param outputFile: An optional JSON file to write the results to
+    return:           A dictionary {proto: {strategy: measurements}}
+    """
+    strategies = strategies or ['concurrent-readpp']
+    ctxPool = ctx if isinstance(ctx, list) else [ctx]
+    protoTargets = {}
+    for proto in rse['pfnPrefixes']:
+        if not rse['pfnPrefixes'][proto]:
+            logger.warning("No pfnPrefix for protocol: %s at: %s. Skipping it." % (proto, rse['name']))
             continue
-        dirEntryPfn = baseDirPfn + dirEntry
-        # logger.info(dirEntryPfn)
-        try:
-            logger.info("Stat dirEntryPfn: %s" % dirEntryPfn)
-            entryStat = ctx.stat(dirEntryPfn)
-        except gfal2.GError as gfalExc:
-            if gfalExc.code == errno.ENOENT:
-                logger.warning("MISSING dirEntry: %s", dirEntryPfn)
-                continue
-            else:
-                logger.error("FAILED to open dirEntry: %s: gfalException: %s", dirEntryPfn, str(gfalExc))
-                continue
-
-        if not stat.S_ISDIR(entryStat.st_mode):
-            dirList.append(dirEntryPfn)
-            logger.info("Found file: %s" % dirEntry)
-            if haltAtBottom:
-                halt=True
-                return dirList, halt
+        protoTargets[proto] = (ctxPool, rse['pfnPrefixes'][proto] + baseDirLfn)
+    results = benchmarkProtocols(protoTargets, strategies=strategies, logger=logger)
+    for proto in results:
+        for strategy, result in results[proto].items():
+            print("Protocol: %s Strategy: %s" % (proto, strategy))
+            print("Elapsed Time Seconds = %s" % result['elapsed'])
+            print("Entries per Second = %s" % result['entriesPerSec'])
+            print("")
+    if outputFile:
+        dumpResults(results, outputFile)
+    return results
+
+
+async def statFilesAsync(asyncGfal, rse, proto='WebDAV', window=1000, method='stat'):
+    """
+    Stat (or unlink) all the files from rse['files']['toDelete'] through the asyncio gfal2 layer
+    param asyncGfal: An AsyncGfal2 instance
+    param rse:       The MSUnmergedRSE object with the files to be checked
+    param proto:     The protocol to be used
+    param window:    The maximum number of gfal2 calls scheduled at once
+    param method:    The gfal2 call to be made for every file: 'stat' or 'unlink'
+    return:          A dictionary with the number of files succeeded, missing and failed
+    """
+    pfnPrefix = rse['pfnPrefixes'][proto]
+    pfnGen = (pfnPrefix + lfn
+              for fileGen in rse['files']['toDelete']
+              for lfn in rse['files']['toDelete'][fileGen])
+    report = {'ok': 0, 'missing': 0, 'failed': 0}
+    async for pfn, result in asyncGfal.mapCalls(rse['name'], method, pfnGen, window=window):
+        if isinstance(result, gfal2.GError) and result.code == errno.ENOENT:
+            logger.warning("MISSING fileEntry: %s", pfn)
+            report['missing'] += 1
+        elif isinstance(result, Exception):
+            logger.error("Exception raised while calling %s on %s. Error: %s" % (method, pfn, str(result)))
+            report['failed'] += 1
         else:
-            dirList.append(dirEntryPfn)
-            dirListExtension, halt = _lsTree(ctx, dirEntryPfn, haltAtBottom=haltAtBottom, halt=halt)
-            dirList.extend(dirListExtension)
+            report['ok'] += 1
+    return report
 
-    return dirList, halt
 
+def newAsyncGfal2(msConfig):
+    """
+    Create an AsyncGfal2 instance configured from msConfig
+    """
+    return AsyncGfal2(lambda: createGfal2Context(msConfig['gfalLogLevel'], msConfig['emulateGfal2']),
+                      maxWorkers=msConfig.get('asyncMaxWorkers', 50),
+                      rseLimit=msConfig.get('asyncRSELimit', 20),
+                      protoLimit=msConfig.get('asyncProtoLimit', None),
+                      logger=logger)
 
-def lsTree(ctx, baseDirPfn, haltAtBottom=False):
+
+def buildRSE(msUnmerged, rseName, protoList):
     """
-    A _lsTree wrapper
-    return: Just a list with the directory contents
+    Create the MSUnmergedRSE object and resolve its Pfn prefixes for all protocols from protoList
     """
-    dirContent, _ = _lsTree(ctx, baseDirPfn, haltAtBottom=haltAtBottom)
-    return dirContent
+    rse = MSUnmergedRSE(rseName)
+    rse = msUnmerged.getRSEFromMongoDB(rse)
+    rse = msUnmerged.getPfn(rse)
+    rse['pfnPrefixes'] = {}
+    for proto in protoList:
+        rse['pfnPrefixes'][proto] = findPfnPrefix(rse['name'], proto)
+    return rse
 
 
+def newMSUnmerged(msConfig, protectedLFNs, rseConsStats):
+    """
+    Create an MSUnmerged instance sharing the (read only) protectedLFNs and RSE statistics
+    """
+    msUnmerged = MSUnmerged(msConfig)
+    msUnmerged.resetServiceCounters()
+    msUnmerged.protectedLFNs = protectedLFNs
+    msUnmerged.rseConsStats = rseConsStats
+    return msUnmerged
 
-def measureTime(ctx, rse, baseDirLfn='/store/unmerged/'):
-    startTime = {}
-    endTime = {}
-    for proto in rse['pfnPrefixes']:
-        baseDirPfn = rse['pfnPrefixes'][proto] + baseDirLfn
-        print("Start lsTree with protocol: %s" % proto)
-        print("Base dir pfn: %s" % baseDirPfn)
-        startTime[proto] = time.time()
-        dirContent = lsTree(ctx, baseDirPfn)
-        endTime[proto] = time.time()
-        print("Elapsed Time Seconds = %s" % (endTime[proto] - startTime[proto]))
-        print("")
-    return dirContent
+
+async def rsePipeline(threadMSUnmerged, asyncGfal, rseName, protoList, rseSemaphore, blockingExecutor,
+                      realMode=False):
+    """
+    Move a single RSE through all the pipeline stages: build the RSE object, fetch and
+    filter the unmerged files and finally stat (or delete in real mode) them.
+    The blocking MSUnmerged calls are run on blockingExecutor, the gfal2 calls go through
+    asyncGfal, which enforces the per RSE and the global limits of calls in flight.
+    param threadMSUnmerged: A callable returning the MSUnmerged instance of the calling thread
+    param rseSemaphore:     An asyncio semaphore limiting the number of RSEs processed at once
+    param realMode:         Flag, if True unlink the files instead of only stat-ing them
+    return:                 A dictionary with the per stage timing and the final gfal2 report
+    """
+    async with rseSemaphore:
+        loop = asyncio.get_running_loop()
+        report = {'stageTimes': {}}
+        # NOTE: Every stage runs on a blockingExecutor thread, with the MSUnmerged instance of that thread
+        stages = [('build', lambda rse: buildRSE(threadMSUnmerged(), rseName, protoList)),
+                  ('fetchUnmerged', lambda rse: threadMSUnmerged().getUnmergedFiles(rse)),
+                  ('filterUnmerged', lambda rse: threadMSUnmerged().filterUnmergedFiles(rse))]
+        rse = None
+        for stageName, stageFunc in stages:
+            startTime = time.time()
+            logger.info("RSE: %s: Starting stage: %s", rseName, stageName)
+            rse = await loop.run_in_executor(blockingExecutor, stageFunc, rse)
+            report['stageTimes'][stageName] = time.time() - startTime
+
+        proto = next((proto for proto in ['WebDAV', 'SRMv2', 'XRootD'] if rse['pfnPrefixes'].get(proto)), None)
+        if not proto:
+            logger.error("RSE: %s: No Pfn prefix found for any protocol. Skipping it.", rseName)
+            report['gfal'] = None
+            return report
+        method = 'unlink' if realMode else 'stat'
+        startTime = time.time()
+        logger.info("RSE: %s: Starting stage: %s with protocol: %s", rseName, method, proto)
+        report['gfal'] = await statFilesAsync(asyncGfal, rse, proto=proto, method=method)
+        report['stageTimes'][method] = time.time() - startTime
+        logger.info("RSE: %s: Pipeline finished: %s", rseName, report)
+        return report
+
+
+async def runPipeline(msUnmergedFactory, asyncGfal, rseNames, protoList, maxRSEs=10, blockingThreads=10,
+                      realMode=False):
+    """
+    Process all RSEs from rseNames concurrently, each one moving through its
+    pipeline stages independently, so a slow site does not hold up the rest.
+    MSUnmerged is not known to be thread safe, so every blocking thread gets
+    an instance of its own, created on first use.
+    param msUnmergedFactory: A callable with no arguments returning a new MSUnmerged instance
+    param maxRSEs:           The maximum number of RSEs being processed at once
+    param blockingThreads:   The number of threads for the blocking (non gfal2) stages
+    param realMode:          Flag, if True unlink the files instead of only stat-ing them
+    return:                  A dictionary {rseName: pipeline report or the exception raised}
+    """
+    threadData = threading.local()
+
+    def threadMSUnmerged():
+        if getattr(threadData, 'msUnmerged', None) is None:
+            threadData.msUnmerged = msUnmergedFactory()
+        return threadData.msUnmerged
+
+    rseSemaphore = asyncio.Semaphore(maxRSEs)
+    with ThreadPoolExecutor(max_workers=blockingThreads, thread_name_prefix='RSEPipeline') as blockingExecutor:
+        results = await asyncio.gather(*[rsePipeline(threadMSUnmerged, asyncGfal, rseName, protoList,
+                                                     rseSemaphore, blockingExecutor, realMode=realMode)
+                                         for rseName in rseNames],
+                                       return_exceptions=True)
+    reports = {}
+    for rseName, result in zip(rseNames, results):
+        if isinstance(result, Exception):
+            logger.error("RSE: %s: Pipeline failed with: %s", rseName, str(result))
+        reports[rseName] = result
+    return reports
 
 
 def findPfnPrefix(rseName, proto):
+    """
+    Resolve the Pfn prefix for a site and protocol through the storage.json cache
+    """
     logger.info("searching for Pfn Prefix for protocol: %s" % proto)
-    pfnPrefix = None
-    storageConfigPath = '/cvmfs/cms.cern.ch/SITECONF/' + rseName + '/storage.json'
+    return storageConfigCache.getPfnPrefix(rseName, proto)
+
+def openX509Stream(url):
+    """
+    Open an HTTPS url for streaming, authenticating with the X509 credentials from the environment
+    return: A file like response object
+    """
+    key, cert = getKeyCertFromEnv()
+    sslContext = ssl.create_default_context(capath=os.getenv('X509_CERT_DIR', '/etc/grid-security/certificates'))
+    sslContext.load_cert_chain(cert, keyfile=key)
+    request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'})
+    return urllib.request.urlopen(request, context=sslContext)
+
+
+def iterRSEUnmerged(msUnmerged, rseName, chunkSize=1024*1024):
+    """
+    Stream the list of unmerged files at an RSE from RucioConMon, parsing the
+    (possibly compressed) raw payload chunk by chunk instead of loading it at once.
+    If the stream cannot be opened, fall back to the RucioConMon service call.
+    param msUnmerged: The MSUnmerged instance
+    param rseName:    The RSE name
+    param chunkSize:  The size of the chunks read from the stream in bytes
+    return:           A generator of LFNs
+    """
+    url = msUnmerged.msConfig['rucioConMon'].rstrip('/') + '/files?rse=%s&format=raw' % rseName
+    try:
+        response = openX509Stream(url)
+    except Exception as ex:
+        logger.warning("Failed to open a stream from RucioConMon for site: %s. Error: %s. "
+                       "Falling back to the full list download.", rseName, str(ex))
+        yield from msUnmerged.rucioConMon.getRSEUnmerged(rseName)
+        return
+    with response:
+        yield from iterLines(iterFileChunks(response, chunkSize=chunkSize))
+
+
+def findUnprotectedConMonLfns(ctx, msUnmerged, rse, pfnPrefix, protectedIndex, count=1):
+    """
+    Find up to `count` unprotected files present at the RSE from the RucioConMon
+    file list. The list is consumed as a generator pipeline: stream, filter by
+    regStoreUnmergedLfn, filter out protected LFNs, stat at the site. The
+    stream is abandoned as soon as enough files are found.
+    param pfnPrefix:      The Pfn prefix to be used for the stat calls
+    param protectedIndex: An LfnIndex built from msUnmerged.protectedLFNs
+    param count:          The number of unprotected LFNs needed
+    return:               A generator of unprotected LFNs
+    """
+    def statFilter(lfnGen):
+        for fileLfn in lfnGen:
+            filePfn = pfnPrefix + fileLfn
+            try:
+                logger.info("Stat fileEtryPfn: %s" % filePfn)
+                ctx.stat(filePfn)
+            except gfal2.GError as gfalExc:
+                if gfalExc.code == errno.ENOENT:
+                    logger.warning("MISSING fileEntry: %s", filePfn)
+                else:
+                    logger.error("FAILED to open fileEntry: %s: gfalException: %s", filePfn, str(gfalExc))
+                continue
+            logger.info("Found an unprotected fileLfn %s with fileBaseLfn: %s" % (fileLfn, msUnmerged._cutPath(fileLfn)))
+            yield fileLfn
+
     try:
-        with open(storageConfigPath, 'r') as storageConfigFile:
-            storageConfig = json.load(storageConfigFile)
-            for protoConfig in storageConfig[0]['protocols']:
-                if protoConfig['protocol'] == proto:
-                    # pprint(protoConfig)
-                    if 'prefix' in protoConfig:
-                        pfnPrefix = protoConfig['prefix']
-        storageConfigFile.close()
+        # Intentionally not saving the file list in the RSE object
+        lfnGen = iterRSEUnmerged(msUnmerged, rse['name'])
+        # Check if what we start with is under /store/unmerged/* and is currently under one of the branches present at the site
+        lfnGen = (fileLfn for fileLfn in lfnGen if msUnmerged.regStoreUnmergedLfn.match(fileLfn))
+        # Skip all files for which the file itself or any of its parent directories is protected
+        lfnGen = protectedIndex.filterUnprotected(lfnGen)
+        yield from itertools.islice(statFilter(lfnGen), count)
     except Exception as ex:
-        logger.error('Could not open Storage Config File for site: %s' % rseName)
-    return pfnPrefix
+        logger.error("Failed to fetch Unmerged files lists from RucioConMon for site: %s. Error: %s" % (rse['name'], str(ex)))
 
-def findUnprotectdLfn(ctx, msUnmerged, rse):
+
+def findUnprotectdLfn(ctx, msUnmerged, rse, ctxPool=None, protectedIndex=None):
     """
     A simple function to find a random unprotected file suitable for deletion
+    param ctxPool:        An optional list of Gfal Contexts to be used for the tree traversal
+    param protectedIndex: An optional LfnIndex built from msUnmerged.protectedLFNs
     """
     unprotectedLfn = None
     # find the proper pfnPrefix for the site:
@@ -201,6 +363,8 @@ def findUnprotectdLfn(ctx, msUnmerged, rse):
     if not msUnmerged.protectedLFNs:
         logger.error( "The current MSUnmerged instance has an EMPTY protectedLFNs list. Please update it from the Production WMStatServer. ")
         return None
+    if protectedIndex is None:
+        protectedIndex = LfnIndex(msUnmerged.protectedLFNs)
 
     try:
         # dirEntryPfn = rse['pfnPrefixes']['WebDAV'] + '/store/unmerged/'
@@ -218,33 +382,9 @@ def findUnprotectdLfn(ctx, msUnmerged, rse):
 
     # First try to seek for a file through RucioConMon:
     logger.info("First: Trying to find a random Lfn from RucioConMon:")
-    rseAllUnmerged = []
-    try:
-        rseAllUnmerged = msUnmerged.rucioConMon.getRSEUnmerged(rse['name']) # Intentionally not saving this in the RSE object
-    except exception as ex:
-        logger.error("Failed to fetch Unmerged files lists from RucioConMon for site: %s" % rse['name'])
-
-    if rseAllUnmerged:
-        for fileLfn in rseAllUnmerged:
-            # Check if what we start with is under /store/unmerged/* and is currently under one of the branches present at the site
-            if msUnmerged.regStoreUnmergedLfn.match(fileLfn):
-                # Cut the path to the deepest level known to WMStats protected LFNs
-                fileBaseLfn = msUnmerged._cutPath(fileLfn)
-                if not fileBaseLfn in msUnmerged.protectedLFNs:
-                    filePfn = pfnPrefix + fileLfn
-                    try:
-                        logger.info("Stat fileEtryPfn: %s" % filePfn)
-                        entryStat = ctx.stat(filePfn)
-                    except gfal2.GError as gfalExc:
-                        if gfalExc.code == errno.ENOENT:
-                            logger.warning("MISSING fileEntry: %s", filePfn)
-                            continue
-                        else:
-                            logger.error("FAILED to open fileEntry: %s: gfalException: %s", dirEntryPfn, str(gfalExc))
-                            continue
-                    logger.info("Found an unprotected fileLfn %s with fileBaseLfn: %s"  % (fileLfn, fileBaseLfn))
-                    unprotectedLfn = fileLfn
-                    return unprotectedLfn
+    for fileLfn in findUnprotectedConMonLfns(ctx, msUnmerged, rse, pfnPrefix, protectedIndex, count=1):
+        unprotectedLfn = fileLfn
+        return unprotectedLfn
 
     logger.info("Second: Start recursive search for an unprotected Lfn at: %s " % rse['name'])
     while not unprotectedLfn:
@@ -259,16 +399,15 @@ def findUnprotectdLfn(ctx, msUnmerged, rse):
 
         logger.info("Start recursive search for an unprotected Lfn at: %s in: /store/unmerged/%s " % (rse['name'], dirEntry))
         dirEntryPfn = pfnPrefix + '/store/unmerged/' + dirEntry
+        filePfn = None
         try:
-            dirTreePfn = lsTree(ctx, dirEntryPfn, haltAtBottom=True)
+            for treeEntry in lsTree(ctxPool or ctx, dirEntryPfn, haltAtBottom=True, asIterator=True):
+                if not treeEntry.isDir and treeEntry.pfn.endswith(".root"):
+                    filePfn = treeEntry.pfn
         except gfal2.GError as gfalExc:
             logger.error("FAILED to recursively traverse through dirEntry: %s: gfalException: %s", dirEntryPfn, str(gfalExc))
             break
 
-        filePfn = None
-        for dirEntry in dirTreePfn:
-            if dirEntry.endswith(".root"):
-                filePfn = dirEntry
         if not filePfn:
             continue
         logger.info("filePfn: %s" % filePfn)
@@ -277,7 +416,7 @@ def findUnprotectdLfn(ctx, msUnmerged, rse):
             logger.warning("Badly constructed fileLfn: %s" % fileLfn)
             continue
         fileBaseLfn = msUnmerged._cutPath(fileLfn)
-        if not fileBaseLfn in msUnmerged.protectedLFNs:
+        if not protectedIndex.isProtected(fileLfn):
             logger.info("Found an unprotected fileLfn %s with fileBaseLfn: %s"  % (fileLfn, fileBaseLfn))
             unprotectedLfn = fileLfn
 
@@ -291,6 +430,17 @@ if __name__ == '__main__':
     logger = logging.getLogger(__name__)
     # reset_logging()
 
+    parser = ArgumentParser(description="MSUnmerged standalone run")
+    parser.add_argument('--asyncio', action='store_true',
+                        help='Use the asyncio gfal2 execution layer instead of the worker threads')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Process all RSEs concurrently, each one through its own pipeline of stages')
+    parser.add_argument('--rses', default=None,
+                        help='Comma separated list of RSEs for the pipeline mode. Default: all RSEs')
+    parser.add_argument('--maxRSEs', type=int, default=10,
+                        help='The maximum number of RSEs processed at once in pipeline mode. Default: 10')
+    args = parser.parse_args()
+
     logger.info("########### MSUnmerged Standalone run ###########")
     preConfigMarker = resCons("PreConfig", logger=logger)
 
@@ -337,7 +487,11 @@ if __name__ == '__main__':
     msUnmerged = MSUnmerged(msConfig)
     msUnmerged.resetServiceCounters()
     ctx = createGfal2Context(msConfig['gfalLogLevel'], msConfig['emulateGfal2'])
+    # A pool of contexts for the concurrent tree walker, one per walker thread:
+    ctxPool = [createGfal2Context(msConfig['gfalLogLevel'], msConfig['emulateGfal2'])
+               for _ in range(msConfig.get('walkerThreads', 10))]
     msUnmerged.protectedLFNs = set(msUnmerged.wmstatsSvc.getProtectedLFNs())
+    protectedIndex = LfnIndex(msUnmerged.protectedLFNs)
     msUnmerged.rseConsStats = msUnmerged.rucioConMon.getRSEStats()
 
     preExecMarker = resCons("PreExec", logger=logger)
@@ -372,6 +526,27 @@ if __name__ == '__main__':
     rseNames = msUnmerged.getRSEList()
     rseList = {}
     protoList = ['SRMv2', 'XRootD', 'WebDAV']
+
+    # Parse all the needed storage.json files once, in parallel:
+    storageConfigCache = StorageConfigCache(logger=logger)
+    storageConfigCache.preload(rseNames)
+
+    if args.pipeline:
+        if args.rses:
+            unknownRSEs = [rseName for rseName in args.rses.split(',') if rseName not in rseNames]
+            if unknownRSEs:
+                logger.error("Unknown RSEs given with --rses: %s", unknownRSEs)
+                sys.exit(1)
+            rseNames = args.rses.split(',')
+        asyncGfal = newAsyncGfal2(msConfig)
+        msUnmergedFactory = lambda: newMSUnmerged(msConfig, msUnmerged.protectedLFNs, msUnmerged.rseConsStats)
+        reports = asyncio.run(runPipeline(msUnmergedFactory, asyncGfal, rseNames, protoList,
+                                          maxRSEs=args.maxRSEs, realMode=msConfig['enableRealMode']))
+        asyncGfal.shutdown()
+        logger.info("Pipeline reports: \n%s", pformat(reports))
+        postExecMarker = resCons("PostExec", logger=logger)
+        sys.exit(0)
+
     for rseName in rseNames:
         rse = MSUnmergedRSE(rseName)
         rse = msUnmerged.getRSEFromMongoDB(rse)
@@ -384,7 +559,7 @@ if __name__ == '__main__':
 
     # for rseName in rseList:
     #     logger.info("Searching for an unprotected Lfn at: %s" % rseName)
-    #     unprotectedLfn = findUnprotectdLfn(ctx, msUnmerged, rseList[rseName])
+    #     unprotectedLfn = findUnprotectdLfn(ctx, msUnmerged, rseList[rseName], ctxPool=ctxPool, protectedIndex=protectedIndex)
     #     unprotectedBaseLfn = msUnmerged._cutPath(unprotectedLfn)
     #     rseList[rseName]['files']['toDelete'][unprotectedBaseLfn] = [unprotectedLfn]
 
@@ -394,54 +569,45 @@ if __name__ == '__main__':
     # rse['pfnPrefixSrm'] = 'srm://srm.ciemat.es:8443/srm/managerv2?SFN=/pnfs/ciemat.es/data/cms/prod'
     # rse['pfnPrefixDavs'] = rse['pfnPrefix']
     # lfn = '/store/unmerged/GenericNoSmearGEN/InclusiveDileptonMinBias_TuneCP5Plus_13p6TeV_pythia8/GEN/124X_mcRun3_2022_realistic_v12-v2'
-    # dirCont = _lsTree(ctx, rse['pfnPrefixDavs'] + lfn)
+    # dirCont = lsTree(ctxPool, rse['pfnPrefixDavs'] + lfn)
 
     rse = rseList['T2_IT_Legnaro']
     rse = msUnmerged.getUnmergedFiles(rse)
     rse = msUnmerged.filterUnmergedFiles(rse)
 
-    qList = {}
-    for qNum in range(1,11):
-        qList[qNum] = queue.Queue()
-
-    def worker(q, ctx, rse):
-        while True:
-            fileGen = q.get()
-            threadName = threading.current_thread().name
-            logger.info(f'{threadName}: Start    Working on: {fileGen}')
-            for lfn in rse['files']['toDelete'][fileGen]:
-                pfn = rse['pfnPrefixes']['WebDAV'] + lfn
-                # lsTree(ctx, pfn)
-                try:
-                    logger.info(f"{threadName}: Stat file: {lfn}")
-                    fileEntry = ctx.stat(pfn)
-                except gfal2.GError as gfalExc:
-                    logger.error("gfal Exception raised while opening %s. GError: %s" % (pfn, str(gfalExc)))
-                    # raise gfalExc
-                except Exception as ex:
-                    logger.error("A Non gfal Exception raised while opening %s. Error: %s" % (pfn, str(ex)))
-                    # raise ex
-            logger.info(f'{threadName}: Finished Working on: {fileGen}')
-            q.task_done()
-
-    ctxList = {}
-    for qNum in qList:
-        ctxList[qNum] = createGfal2Context(msConfig['gfalLogLevel'], msConfig['emulateGfal2'])
-
-    threadList = {}
-    for qNum in qList:
-        threadName = "Thread" + str(qNum)
-        threadList[qNum] = threading.Thread(name=threadName, target=worker, args=[qList[qNum], ctxList[qNum], rse], daemon=True)
-        threadList[qNum].start()
-
-    for group in grouper(rse['files']['toDelete'], len(qList)):
-        for qfill in zip(group, qList):
-            fileGen = qfill[0]
-            qNum = qfill[1]
-            # print(f'qNum: {qNum} - qFileGen:{fileGen}')
-            # qList[qNum].put(rse['files']['toDelete'][fileGen])
-            qList[qNum].put(fileGen)
-        logger.info("==========================")
-
-    for qNum in qList:
-        qList[qNum].join()
+    if args.asyncio:
+        asyncGfal = newAsyncGfal2(msConfig)
+        report = asyncio.run(statFilesAsync(asyncGfal, rse))
+        asyncGfal.shutdown()
+        logger.info("Async stat report for %s: %s", rse['name'], pformat(report))
+        sys.exit(0)
+
+    def worker(ctx, fileGen, lfnChunk):
+        threadName = threading.current_thread().name
+        logger.info(f'{threadName}: Start    Working on: {len(lfnChunk)} files from: {fileGen}')
+        for lfn in lfnChunk:
+            pfn = rse['pfnPrefixes']['WebDAV'] + lfn
+            # lsTree(ctx, pfn)
+            try:
+                logger.info(f"{threadName}: Stat file: {lfn}")
+                fileEntry = ctx.stat(pfn)
+            except gfal2.GError as gfalExc:
+                logger.error("gfal Exception raised while opening %s. GError: %s" % (pfn, str(gfalExc)))
+                # raise gfalExc
+            except Exception as ex:
+                logger.error("A Non gfal Exception raised while opening %s. Error: %s" % (pfn, str(ex)))
+                # raise ex
+        logger.info(f'{threadName}: Finished Working on: {len(lfnChunk)} files from: {fileGen}')
+
+    # A single shared queue for all worker threads, fed with chunks of the fileGen lists,
+    # so a single huge fileGen does not keep one thread busy while the rest sit idle:
+    scheduler = ChunkedWorkScheduler(worker,
+                                     nWorkers=msConfig.get('workerThreads', 10),
+                                     chunkSize=msConfig.get('workerChunkSize', 100),
+                                     resourceFactory=lambda: createGfal2Context(msConfig['gfalLogLevel'], msConfig['emulateGfal2']),
+                                     logger=logger)
+    scheduler.start()
+    for fileGen in rse['files']['toDelete']:
+        scheduler.submit(fileGen, rse['files']['toDelete'][fileGen])
+    scheduler.stop()
+    logger.info("Worker threads utilisation: \n%s", pformat(scheduler.getMetrics()))
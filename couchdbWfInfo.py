@@ -5,71 +5,29 @@ Script to retrieve and dump all the WorkFlow information from couchdb
 from __future__ import print_function, division
 
 import argparse
-import httplib
 import json
-import os
-import pwd
 import sys
-import urllib2
-from urllib2 import HTTPError, URLError
+import threading
 from textwrap import TextWrapper
 from collections import OrderedDict
 
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import httpsClient
+
 
 # ID for the User-Agent
 CLIENT_ID = 'workflowCompletion::python/%s.%s' % sys.version_info[:2]
 
 
-class HTTPSClientAuthHandler(urllib2.HTTPSHandler):
+def getContent(url, params=None):
     """
-    Basic HTTPS class
+    Fetch a url over the keep-alive connections shared by all requests
     """
-
-    def __init__(self, key, cert):
-        urllib2.HTTPSHandler.__init__(self)
-        self.key = key
-        self.cert = cert
-
-    def https_open(self, req):
-        # Rather than pass in a reference to a connection class, we pass in
-        # a reference to a function which, for all intents and purposes,
-        # will behave as a constructor
-        return self.do_open(self.getConnection, req)
-
-    def getConnection(self, host, timeout=290):
-        return httplib.HTTPSConnection(host, key_file=self.key, cert_file=self.cert)
-
-
-def getX509():
-    "Helper function to get x509 from env or tmp file"
-    proxy = os.environ.get('X509_USER_PROXY', '')
-    if not proxy:
-        proxy = '/tmp/x509up_u%s' % pwd.getpwuid(os.getuid()).pw_uid
-        if not os.path.isfile(proxy):
-            return ''
-    return proxy
-
-
-def getContent(url, params=None):
-    cert = getX509()
-    client = '%s (%s)' % (CLIENT_ID, os.environ.get('USER', ''))
-    handler = HTTPSClientAuthHandler(cert, cert)
-    opener = urllib2.build_opener(handler)
-    opener.addheaders = [("User-Agent", client),
-                         ("Accept", "application/json")]
-    try:
-        response = opener.open(url, params)
-        output = response.read()
-    except HTTPError as e:
-        print("The server couldn't fulfill the request at %s" % url)
-        print("Error code: ", e.code)
-        output = '{}'
-        # sys.exit(1)
-    except URLError as e:
-        print('Failed to reach server at %s' % url)
-        print('Reason: ', e.reason)
-        sys.exit(2)
-    return output
+    return httpsClient.getContent(url, params, clientId=CLIENT_ID)
 
 
 def handleReqMgr(reqName, reqmgrUrl):
@@ -106,6 +64,99 @@ def handleCoucdb(reqName, reqmgrUrl):
     return couchdbOut
 
 
+def fetchCouchdbBulk(listRequests, reqmgrUrl, batchSize=100):
+    """
+    Fetch the couchdb information of many workflows, with a single
+    _all_docs request per batch of workflows. The rows are streamed back
+    and parsed one at a time.
+    NOTE: The batches are POST requests, never served from the response cache.
+    :param listRequests: A list of request names
+    :param reqmgrUrl:    The Request Manager URL
+    :param batchSize:    The number of workflows fetched per request
+    :return:             A generator of tuples (reqName, couchdbOut), in input order.
+                         couchdbOut is an empty dictionary for the workflows not found.
+    """
+    urn = reqmgrUrl + "/couchdb/workloadsummary/_all_docs?include_docs=true"
+    session = httpsClient.getSession(CLIENT_ID)
+    for idx in range(0, len(listRequests), batchSize):
+        batch = listRequests[idx:idx + batchSize]
+        docs = {}
+        try:
+            lines = session.iterLines(urn, data=json.dumps({'keys': batch}),
+                                      headers={'Content-Type': 'application/json'})
+            for row in httpsClient.iterCouchRows(lines):
+                docs[row['key']] = row.get('doc') or {}
+        except httpsClient.HTTPError as e:
+            print("The server couldn't fulfill the request at %s" % urn)
+            print("Error code: ", e.code)
+        except httpsClient.URLError as e:
+            print('Failed to reach server at %s' % urn)
+            print('Reason: ', e.reason)
+            sys.exit(2)
+        except ValueError as e:
+            print("Failed to parse the reply of %s" % urn)
+            print('Reason: ', e)
+        for reqName in batch:
+            yield reqName, docs.get(reqName, {})
+
+
+def fetchCouchdb(listRequests, reqmgrUrl, nThreads=1, rate=None, ordered=True):
+    """
+    Fetch the couchdb information of many workflows in parallel
+    :param listRequests: A list of request names
+    :param reqmgrUrl:    The Request Manager URL
+    :param nThreads:     The number of concurrent fetches
+    :param rate:         The maximum number of requests per second and host (None for no limit)
+    :param ordered:      Yield the results in input order. If False they are yielded as they complete.
+    :return:             A generator of tuples (reqName, couchdbOut). couchdbOut is the
+                         exception raised if the fetch failed.
+    """
+    rateLimiter = httpsClient.HostRateLimiter(rate)
+    inQueue = Queue()
+    outQueue = Queue()
+    stop = threading.Event()
+    for idx, reqName in enumerate(listRequests):
+        inQueue.put((idx, reqName))
+
+    def worker():
+        while True:
+            idx, reqName = inQueue.get()
+            if reqName is None or stop.is_set():
+                break
+            rateLimiter.wait(reqmgrUrl)
+            try:
+                result = handleCoucdb(reqName, reqmgrUrl)
+            except (Exception, SystemExit) as ex:
+                # NOTE: getContent calls sys.exit if the server cannot be reached
+                result = ex
+            outQueue.put((idx, reqName, result))
+
+    nThreads = max(1, min(nThreads, len(listRequests)))
+    for _ in range(nThreads):
+        inQueue.put((None, None))
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    pending = {}
+    nextIdx = 0
+    try:
+        for _ in range(len(listRequests)):
+            idx, reqName, result = outQueue.get()
+            if isinstance(result, SystemExit):
+                sys.exit(result.code)
+            if not ordered:
+                yield reqName, result
+                continue
+            pending[idx] = (reqName, result)
+            while nextIdx in pending:
+                yield pending.pop(nextIdx)
+                nextIdx += 1
+    finally:
+        # Do not start any new fetch if the consumer stops early
+        stop.set()
+
+
 def twClosure(replace_whitespace=False,
               break_long_words=False,
               width=120,
@@ -178,7 +229,27 @@ def main():
     group.add_argument('-i', '--inputFile', help='Plain text file containing request names (one per line)')
     parser.add_argument('-c', '--cms', help='CMSWEB url to talk to DBS/PhEDEx. E.g: cmsweb-testbed.cern.ch')
     parser.add_argument('-r', '--reqmgr', help='Request Manager URL. Example: cmsweb-testbed.cern.ch')
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help='The number of workflows fetched in parallel (not with --bulk). Default: 1')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='The maximum number of requests per second to a single host (not with --bulk). '
+                             'Default: no limit')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Print the workflows as they are fetched, instead of in input order')
+    parser.add_argument('-b', '--bulk', type=int, default=0,
+                        help='Fetch the workflows from couchdb in batches of this size. Default: 0 (one request per workflow)')
+    parser.add_argument('--cacheDir', help='A directory for caching the server responses between runs. '
+                                           'Bulk fetches (-b/--bulk) are not cached. Default: no cache')
+    parser.add_argument('--cacheSize', type=int, default=200, help='The maximum size of the response cache in MB. Default: 200')
     args = parser.parse_args()
+    if args.bulk > 0 and (args.threads != 1 or args.rate is not None):
+        parser.error("--threads and --rate do not apply to bulk fetches, which are sent one batch at a time")
+
+    if args.cacheDir:
+        if args.bulk > 0:
+            print("WARNING: --cacheDir has no effect on bulk fetches (-b/--bulk)", file=sys.stderr)
+        httpsClient.getSession(CLIENT_ID).cache = httpsClient.ResponseCache(args.cacheDir,
+                                                                            maxSize=args.cacheSize * 1024 * 1024)
 
     if args.workflow:
         listRequests = [args.workflow]
@@ -191,11 +262,21 @@ def main():
 
     cmswebUrl = "https://" + args.cms if args.cms else "https://cmsweb.cern.ch"
     reqmgrUrl = "https://" + args.reqmgr if args.reqmgr else "https://cmsweb.cern.ch"
+    # An explicit scheme is kept as it is, e.g. for a local http stand-in
+    if args.reqmgr and '://' in args.reqmgr:
+        reqmgrUrl = args.reqmgr
 
-    for reqName in listRequests:
-        couchdbOut = handleCoucdb(reqName, reqmgrUrl)
+    if args.bulk > 0:
+        results = fetchCouchdbBulk(listRequests, reqmgrUrl, batchSize=args.bulk)
+    else:
+        results = fetchCouchdb(listRequests, reqmgrUrl, nThreads=args.threads,
+                               rate=args.rate, ordered=not args.stream)
+    for reqName, couchdbOut in results:
         print("-----------------------------")
-        twPrint(couchdbOut)
+        if isinstance(couchdbOut, Exception):
+            print("Failed to fetch workflow %s: %s" % (reqName, couchdbOut))
+        else:
+            twPrint(couchdbOut)
         print("-----------------------------")
 
     sys.exit(0)
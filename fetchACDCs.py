@@ -2,21 +2,18 @@
 from __future__ import print_function
 
 import argparse
-import httplib
 import json
-import os
-import pwd
 import sys
 import urllib
-import urllib2
 import re
 import numpy as np
 
 from pprint import pprint
-from urllib2 import HTTPError, URLError
 from textwrap import TextWrapper
 from collections import OrderedDict
 
+import httpsClient
+
 # URL for ACDCs
 # https://cmsweb-testbed.cern.ch/reqmgr2/data/request?request_type=Resubmission&mask=TotalEstimatedJobs
 
@@ -31,56 +28,11 @@ CLIENT_ID = 'fetchACDC/0.1::python/%s.%s' % sys.version_info[:2]
 cachedDqmgui = None
 
 
-class HTTPSClientAuthHandler(urllib2.HTTPSHandler):
+def getContent(url, params=None):
     """
-    Basic HTTPS class
+    Fetch a url over the keep-alive connections shared by all requests
     """
-
-    def __init__(self, key, cert):
-        urllib2.HTTPSHandler.__init__(self)
-        self.key = key
-        self.cert = cert
-
-    def https_open(self, req):
-        # Rather than pass in a reference to a connection class, we pass in
-        # a reference to a function which, for all intents and purposes,
-        # will behave as a constructor
-        return self.do_open(self.getConnection, req)
-
-    def getConnection(self, host, timeout=290):
-        return httplib.HTTPSConnection(host, key_file=self.key, cert_file=self.cert)
-
-
-def getX509():
-    "Helper function to get x509 from env or tmp file"
-    proxy = os.environ.get('X509_USER_PROXY', '')
-    if not proxy:
-        proxy = '/tmp/x509up_u%s' % pwd.getpwuid(os.getuid()).pw_uid
-        if not os.path.isfile(proxy):
-            return ''
-    return proxy
-
-
-def getContent(url, params=None):
-    cert = getX509()
-    client = '%s (%s)' % (CLIENT_ID, os.environ.get('USER', ''))
-    handler = HTTPSClientAuthHandler(cert, cert)
-    opener = urllib2.build_opener(handler)
-    opener.addheaders = [("User-Agent", client),
-                         ("Accept", "application/json")]
-    try:
-        response = opener.open(url, params)
-        output = response.read()
-    except HTTPError as e:
-        print("The server couldn't fulfill the request at %s" % url)
-        print("Error code: ", e.code)
-        output = '{}'
-        # sys.exit(1)
-    except URLError as e:
-        print('Failed to reach server at %s' % url)
-        print('Reason: ', e.reason)
-        sys.exit(2)
-    return output
+    return httpsClient.getContent(url, params, clientId=CLIENT_ID)
 
 
 
@@ -143,17 +95,45 @@ def twPrint(obj):
     print(twPrinter(obj))
 
 
-def getACDC(baseUrl, reqName=None , api=None):
+def iterACDCs(baseUrl, api=None):
     """
-    gets information for ACDC Workflows from reqmgr2
+    Streams the information for ACDC Workflows from reqmgr2, one workflow at
+    a time, while the response is still being downloaded and parsed.
+    NOTE: With a response cache set on the session the response is read whole,
+          as the cache stores complete bodies only, and only parsed incrementally.
+    :return: A generator of tuples (reqName, information)
     """
     mask = '&mask=' + api
     urn = baseUrl +  '/reqmgr2/data/request?request_type=Resubmission' + mask
+    session = httpsClient.getSession(CLIENT_ID)
+    try:
+        if session.cache is not None:
+            # Conditional requests need the whole response
+            chunks = [session.request(urn).body]
+        else:
+            chunks = session.iterChunks(urn)
+        for reqName, value in httpsClient.iterResultItems(chunks):
+            yield reqName, value
+    except httpsClient.HTTPError as e:
+        print("The server couldn't fulfill the request at %s" % urn)
+        print("Error code: ", e.code)
+    except httpsClient.URLError as e:
+        print('Failed to reach server at %s' % urn)
+        print('Reason: ', e.reason)
+        sys.exit(2)
+
+
+def getACDC(baseUrl, reqName=None , api=None):
+    """
+    gets information for ACDC Workflows from reqmgr2
+    """
     if reqName:
-        reqmgrOutput = json.loads(getContent(urn))['result'][0][reqName]
-    else:
-        reqmgrOutput = json.loads(getContent(urn))['result'][0]
-    return reqmgrOutput
+        # Stop reading as soon as the workflow is found
+        for name, value in iterACDCs(baseUrl, api=api):
+            if name == reqName:
+                return value
+        raise KeyError(reqName)
+    return dict(iterACDCs(baseUrl, api=api))
 
 
 def main():
@@ -173,8 +153,16 @@ def main():
     parser.add_argument('-r', '--reqmgr', help='Request Manager URL. Default: cmsweb-testbed.cern.ch')
     parser.add_argument('-v', '--verbose', help='Increase output verbosity - prints the output before saving it to file', action="store_true")
 
+    parser.add_argument('--cacheDir', help='A directory for caching the server responses between runs. '
+                                           'The ACDC list is then downloaded whole instead of streamed. Default: no cache')
+    parser.add_argument('--cacheSize', type=int, default=200, help='The maximum size of the response cache in MB. Default: 200')
     args = parser.parse_args()
 
+    if args.cacheDir:
+        print("WARNING: --cacheDir is set, the ACDC list is held in memory whole instead of streamed", file=sys.stderr)
+        httpsClient.getSession(CLIENT_ID).cache = httpsClient.ResponseCache(args.cacheDir,
+                                                                            maxSize=args.cacheSize * 1024 * 1024)
+
     plot = True if args.plot else False
     verbose = True if args.verbose else False
     outputFile = args.output if args.output else 'acdcsEstimJobs.json'
@@ -183,12 +171,14 @@ def main():
 
     api = 'TotalEstimatedJobs'
     TotalEstimatedJobsAll = []
-    acdcs=getACDC(baseUrl=reqmgrUrl, api=api)
-
     if verbose:
+        acdcs = getACDC(baseUrl=reqmgrUrl, api=api)
         twPrint(acdcs)
+        acdcItems = acdcs.items()
+    else:
+        acdcItems = iterACDCs(reqmgrUrl, api=api)
 
-    for wf, value in acdcs.items():
+    for wf, value in acdcItems:
         if value['TotalEstimatedJobs']:
             TotalEstimatedJobsAll.append(value['TotalEstimatedJobs'])
 
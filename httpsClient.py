@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+"""
+A small HTTP(S) client shared by the cmsweb scripts in this directory.
+
+The X509 proxy is loaded once, and the connections are kept alive and
+reused per host, so a long list of requests to the same service pays for a
+single TLS handshake instead of one per request. It works with both
+python2 and python3.
+"""
+from __future__ import print_function, division
+
+import codecs
+import hashlib
+import json
+import os
+import pwd
+import re
+import socket
+import ssl
+import sys
+import threading
+import time
+
+try:
+    import httplib
+    from urllib2 import HTTPError, URLError
+    from urlparse import urlsplit
+except ImportError:
+    import http.client as httplib
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import urlsplit
+
+try:
+    from Queue import LifoQueue, Empty
+except ImportError:
+    from queue import LifoQueue, Empty
+
+
+def getX509():
+    "Helper function to get x509 from env or tmp file"
+    proxy = os.environ.get('X509_USER_PROXY', '')
+    if not proxy:
+        proxy = '/tmp/x509up_u%s' % pwd.getpwuid(os.getuid()).pw_uid
+        if not os.path.isfile(proxy):
+            return ''
+    return proxy
+
+
+class Response(object):
+    """
+    A fully read HTTP response
+    """
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        # Header names are lower cased
+        self.headers = headers
+        self.body = body
+
+
+class ResponseCache(object):
+    """
+    A persistent, size bounded, on disk cache of response bodies keyed by url,
+    along with their ETag and Last-Modified headers. The least recently used
+    entries are evicted first.
+    """
+
+    def __init__(self, cacheDir, maxSize=200 * 1024 * 1024):
+        """
+        :param cacheDir: The directory holding the cache. It is created if needed.
+        :param maxSize:  The maximum total size of the cached bodies, in bytes
+        """
+        self.cacheDir = os.path.expanduser(cacheDir)
+        self.maxSize = maxSize
+        self._lock = threading.Lock()
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        # key -> [lastUsed, size]
+        self._index = {}
+        for fileName in os.listdir(self.cacheDir):
+            if fileName.endswith('.body'):
+                filePath = os.path.join(self.cacheDir, fileName)
+                stat = os.stat(filePath)
+                self._index[fileName[:-len('.body')]] = [stat.st_mtime, stat.st_size]
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.cacheDir, key + ext)
+
+    def get(self, url):
+        """
+        :return: A tuple (body, metadata dictionary) or None if the url is not cached
+        """
+        key = self._key(url)
+        with self._lock:
+            if key not in self._index:
+                return None
+            try:
+                with open(self._path(key, '.meta')) as fd:
+                    meta = json.load(fd)
+                with open(self._path(key, '.body'), 'rb') as fd:
+                    body = fd.read()
+            except (IOError, OSError, ValueError):
+                self._remove(key)
+                return None
+            if meta.get('url') != url or meta.get('sha1') != hashlib.sha1(body).hexdigest():
+                # A corrupt or incomplete entry
+                self._remove(key)
+                return None
+            now = time.time()
+            self._index[key][0] = now
+            os.utime(self._path(key, '.body'), (now, now))
+            return body, meta
+
+    def put(self, url, body, headers):
+        """
+        Store a response body if it carries an ETag or a Last-Modified header
+        :param headers: The response headers, with lower cased names
+        """
+        meta = {'url': url, 'etag': headers.get('etag'), 'lastModified': headers.get('last-modified'),
+                'sha1': hashlib.sha1(body).hexdigest()}
+        key = self._key(url)
+        with self._lock:
+            if not (meta['etag'] or meta['lastModified']) or len(body) > self.maxSize:
+                # Drop any outdated entry, it cannot be revalidated any more
+                self._remove(key)
+                return
+            # Write to temporary files first, so an interrupted run never leaves a truncated entry
+            for ext, content, mode in (('.body', body, 'wb'), ('.meta', json.dumps(meta), 'w')):
+                tmpPath = self._path(key, ext + '.tmp')
+                with open(tmpPath, mode) as fd:
+                    fd.write(content)
+                os.rename(tmpPath, self._path(key, ext))
+            self._index[key] = [time.time(), len(body)]
+            self._evict()
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        for ext in ('.body', '.meta'):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def _evict(self):
+        totalSize = sum(size for _, size in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k][0]):
+            if totalSize <= self.maxSize:
+                break
+            totalSize -= self._index[key][1]
+            self._remove(key)
+
+
+class HTTPSession(object):
+    """
+    A pool of keep-alive connections, per scheme and host
+    """
+
+    def __init__(self, key=None, cert=None, userAgent=None, timeout=290, maxPerHost=8, cache=None):
+        """
+        :param key:        The path to the client key (e.g. the X509 proxy)
+        :param cert:       The path to the client certificate (e.g. the X509 proxy)
+        :param userAgent:  The User-Agent header sent with every request
+        :param timeout:    The socket timeout in seconds
+        :param maxPerHost: The maximum number of idle connections kept per host
+        :param cache:      An optional ResponseCache. GET requests for cached urls are sent
+                           as conditional requests, and a 304 reply is served from the cache.
+        """
+        self.cache = cache
+        self.timeout = timeout
+        self.maxPerHost = maxPerHost
+        self.headers = {"Accept": "application/json"}
+        if userAgent:
+            self.headers["User-Agent"] = userAgent
+        self.sslContext = ssl.create_default_context()
+        capath = os.environ.get('X509_CERT_DIR', '')
+        if os.path.isdir(capath):
+            self.sslContext.load_verify_locations(capath=capath)
+        if cert:
+            self.sslContext.load_cert_chain(cert, key or cert)
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, scheme, host):
+        with self._lock:
+            pool = self._pools.get((scheme, host))
+            if pool is None:
+                pool = self._pools[(scheme, host)] = LifoQueue(maxsize=self.maxPerHost)
+            return pool
+
+    def _getConnection(self, scheme, host):
+        """
+        Reuse an idle connection to the host, or open a new one
+        """
+        try:
+            return self._pool(scheme, host).get_nowait()
+        except Empty:
+            return self._newConnection(scheme, host)
+
+    def _newConnection(self, scheme, host):
+        """
+        Open a new connection to the host
+        """
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, timeout=self.timeout, context=self.sslContext)
+        elif scheme == 'http':
+            return httplib.HTTPConnection(host, timeout=self.timeout)
+        raise URLError("Unsupported url scheme: %s" % scheme)
+
+    def _releaseConnection(self, scheme, host, conn):
+        try:
+            self._pool(scheme, host).put_nowait(conn)
+        except Exception:
+            conn.close()
+
+    @staticmethod
+    def _closeIdle(pool):
+        while True:
+            try:
+                pool.get_nowait().close()
+            except Empty:
+                break
+
+    def close(self):
+        """
+        Close all the idle connections
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            self._closeIdle(pool)
+
+    def open(self, url, data=None, headers=None, method=None):
+        """
+        Send a request and return the raw response, without reading its body.
+        The caller must read the body to its end and then call release(), so the
+        connection goes back to the pool. A failed request is retried once over a
+        new connection. The other idle connections to the host are closed then,
+        since the server has most likely dropped them as well.
+        :param url:     The url to request
+        :param data:    An optional request body. The request is a POST if set.
+        :param headers: Additional request headers
+        :param method:  The HTTP method (GET or POST by default)
+        :return:        A tuple (response, release). release is a callable with no arguments.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        reqHeaders = dict(self.headers)
+        reqHeaders.update(headers or {})
+        method = method or ('POST' if data is not None else 'GET')
+        for attempt in range(2):
+            if attempt:
+                self._closeIdle(self._pool(parts.scheme, parts.netloc))
+                conn = self._newConnection(parts.scheme, parts.netloc)
+            else:
+                conn = self._getConnection(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, body=data, headers=reqHeaders)
+                response = conn.getresponse()
+                break
+            except (socket.error, httplib.HTTPException, ssl.SSLError) as ex:
+                conn.close()
+                if attempt:
+                    raise URLError(ex)
+
+        def release():
+            if response.will_close:
+                conn.close()
+            else:
+                self._releaseConnection(parts.scheme, parts.netloc, conn)
+        return response, release
+
+    def request(self, url, data=None, headers=None, method=None):
+        """
+        Send a request and read the whole response
+        :return: A Response instance. A status of 400 or above raises an HTTPError.
+        """
+        cached = None
+        if self.cache is not None and data is None and method in (None, 'GET'):
+            cached = self.cache.get(url)
+        if cached:
+            headers = dict(headers or {})
+            if cached[1].get('etag'):
+                headers['If-None-Match'] = cached[1]['etag']
+            if cached[1].get('lastModified'):
+                headers['If-Modified-Since'] = cached[1]['lastModified']
+        response, release = self.open(url, data=data, headers=headers, method=method)
+        try:
+            body = response.read()
+        except (socket.error, httplib.HTTPException, ssl.SSLError) as ex:
+            response.close()
+            raise URLError(ex)
+        release()
+        respHeaders = dict((name.lower(), value) for name, value in response.getheaders())
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, respHeaders, None)
+        if cached and response.status == 304:
+            return Response(response.status, respHeaders, cached[0])
+        if self.cache is not None and data is None and method in (None, 'GET') and response.status == 200:
+            self.cache.put(url, body, respHeaders)
+        return Response(response.status, respHeaders, body)
+
+    def iterChunks(self, url, data=None, headers=None, method=None, chunkSize=65536):
+        """
+        Send a request and stream the response body in chunks, without ever
+        holding the whole body in memory
+        :return: A generator of bytes chunks. A status of 400 or above raises an HTTPError.
+        """
+        response, release = self.open(url, data=data, headers=headers, method=method)
+        if response.status >= 400:
+            response.read()
+            release()
+            respHeaders = dict((name.lower(), value) for name, value in response.getheaders())
+            raise HTTPError(url, response.status, response.reason, respHeaders, None)
+        try:
+            while True:
+                chunk = response.read(chunkSize)
+                if not chunk:
+                    break
+                yield chunk
+        except (socket.error, httplib.HTTPException, ssl.SSLError) as ex:
+            response.close()
+            raise URLError(ex)
+        except GeneratorExit:
+            # The consumer stopped early, the rest of the body is never read
+            response.close()
+            raise
+        release()
+
+    def iterLines(self, url, data=None, headers=None, method=None, chunkSize=65536):
+        """
+        Send a request and stream the response body line by line (see iterChunks)
+        :return: A generator of text lines, without the line endings
+        """
+        remainder = b''
+        for chunk in self.iterChunks(url, data=data, headers=headers, method=method, chunkSize=chunkSize):
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line.rstrip(b'\r').decode('utf-8')
+        if remainder:
+            yield remainder.rstrip(b'\r').decode('utf-8')
+
+
+class HostRateLimiter(object):
+    """
+    A thread safe limiter spacing out the requests to every host to at most `rate` per second
+    """
+
+    def __init__(self, rate=None):
+        """
+        :param rate: The maximum number of requests per second and host (None or 0 for no limit)
+        """
+        self.interval = 1.0 / rate if rate else 0.0
+        self._nextCall = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        """
+        Block until a new request to the host of the url is allowed
+        """
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.time()
+            nextCall = self._nextCall.get(host, now)
+            self._nextCall[host] = max(now, nextCall) + self.interval
+        if nextCall > now:
+            time.sleep(nextCall - now)
+
+
+def iterCouchRows(lines):
+    """
+    Stream the rows of a CouchDB view or _all_docs response. CouchDB writes
+    every row on a line of its own, so rows are parsed one line at a time.
+    If the response is formatted differently, it is parsed as a whole.
+    :param lines: An iterable of the response text lines
+    :return:      A generator of row dictionaries. A ValueError is raised for a line
+                  between the rows, or around them, which is not part of the response
+                  head ('{..."rows":[') or tail (']}').
+    """
+    buffered = []
+    numRows = 0
+    for line in lines:
+        text = line.strip().rstrip(',')
+        row = None
+        if text.startswith('{') and text.endswith('}'):
+            try:
+                row = json.loads(text)
+            except ValueError:
+                pass
+        if isinstance(row, dict) and 'key' in row:
+            skipped = ''.join(buffered).strip()
+            if (numRows and skipped) or (not numRows and not skipped.endswith('[')):
+                raise ValueError("Unparsable CouchDB rows before row %s: %s" % (numRows + 1, skipped))
+            buffered = []
+            numRows += 1
+            yield row
+        else:
+            buffered.append(line)
+    if not numRows and buffered:
+        for row in json.loads('\n'.join(buffered)).get('rows', []):
+            yield row
+    elif numRows and not ''.join(buffered).strip().startswith(']'):
+        raise ValueError("Unparsable CouchDB rows after row %s: %s" % (numRows, ''.join(buffered).strip()))
+
+
+_RESULT_HEAD = re.compile(r'"result"\s*:\s*\[\s*\{')
+_SEPARATOR = re.compile(r'[\s,]*')
+_COLON = re.compile(r'\s*:\s*')
+_SPACES = re.compile(r'\s*')
+
+
+def _extendBuffer(chunks, textDecoder, buf, pos):
+    """
+    Drop the consumed part of the buffer and append the next chunk to it
+    :return: A tuple (new buffer, True if the chunks are exhausted)
+    """
+    chunk = next(chunks, None)
+    if chunk is None:
+        return buf[pos:] + textDecoder.decode(b'', True), True
+    return buf[pos:] + textDecoder.decode(chunk), False
+
+
+def iterResultItems(chunks):
+    """
+    Incrementally parse a reqmgr2 style {"result": [{key: value, ...}]} json
+    document and stream the key/value pairs of result[0], one at a time, while
+    only the not yet parsed tail of the document is held in memory
+    :param chunks: An iterable of bytes chunks of the document
+    :return:       A generator of tuples (key, value). Nothing is yielded if the
+                   document has no result. A truncated document raises a ValueError.
+    """
+    decoder = json.JSONDecoder()
+    textDecoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf, exhausted = u'', False
+    while True:
+        match = _RESULT_HEAD.search(buf)
+        if match:
+            pos = match.end()
+            break
+        if exhausted:
+            # No result to stream, e.g. {"result": []}, but the document must still be complete
+            try:
+                json.loads(buf)
+            except ValueError:
+                raise ValueError("Truncated json document")
+            return
+        buf, exhausted = _extendBuffer(chunks, textDecoder, buf, 0)
+
+    while True:
+        pos = _SEPARATOR.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == '}':
+            return
+        try:
+            if pos >= len(buf):
+                raise ValueError("Need more data")
+            key, end = decoder.raw_decode(buf, pos)
+            colon = _COLON.match(buf, end)
+            if not colon or colon.end() >= len(buf):
+                raise ValueError("Need more data")
+            value, end = decoder.raw_decode(buf, colon.end())
+            # A number may continue in the next chunk (e.g. 1.5e|-10), so the value
+            # is only complete once the delimiter following it is in the buffer
+            delimiter = _SPACES.match(buf, end).end()
+            if delimiter >= len(buf) or buf[delimiter] not in ',}':
+                raise ValueError("Need more data")
+        except ValueError:
+            if exhausted:
+                raise ValueError("Truncated json document")
+            buf, exhausted = _extendBuffer(chunks, textDecoder, buf, pos)
+            pos = 0
+            continue
+        yield key, value
+        pos = end
+
+
+_session = None
+_sessionLock = threading.Lock()
+
+
+def getSession(clientId):
+    """
+    Return the process wide session, loading the X509 proxy on first use
+    :param clientId: The client identifier used in the User-Agent header
+    """
+    global _session
+    with _sessionLock:
+        if _session is None:
+            cert = getX509()
+            userAgent = '%s (%s)' % (clientId, os.environ.get('USER', ''))
+            _session = HTTPSession(cert, cert, userAgent=userAgent)
+        return _session
+
+
+def getContent(url, params=None, clientId='httpsClient'):
+    """
+    Fetch a url through the shared session
+    :param url:      The url to fetch
+    :param params:   An optional POST body
+    :param clientId: See getSession
+    :return:         The response body, or '{}' if the server returned an error.
+                     Exits with code 2 if the server cannot be reached.
+    """
+    try:
+        output = getSession(clientId).request(url, params).body
+    except HTTPError as e:
+        print("The server couldn't fulfill the request at %s" % url)
+        print("Error code: ", e.code)
+        output = '{}'
+        # sys.exit(1)
+    except URLError as e:
+        print('Failed to reach server at %s' % url)
+        print('Reason: ', e.reason)
+        sys.exit(2)
+    return output
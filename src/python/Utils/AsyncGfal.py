@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+_AsyncGfal_
+
+An asyncio front-end to the blocking gfal2 calls. The calls are executed on a
+sized thread pool executor, with a lazily created gfal2 context per executor
+thread, while the number of calls in flight is limited per RSE and per protocol
+with asyncio semaphores. Waiting on a semaphore costs just a coroutine, so
+thousands of logical operations over many RSEs can be pending at once, while
+the number of threads and gfal2 contexts stays fixed at maxWorkers.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Utils.GfalTreeWalker import pfnProtocol
+
+
+class AsyncGfal2(object):
+    """
+    Runs gfal2 stat/listdir/unlink calls from asyncio code
+    """
+
+    def __init__(self, ctxFactory, maxWorkers=50, rseLimit=20, protoLimit=None, logger=None):
+        """
+        :param ctxFactory: A function creating a new gfal2 context
+        :param maxWorkers: The size of the executor, i.e. the global cap of calls in flight
+        :param rseLimit:   The maximum number of calls in flight per RSE
+        :param protoLimit: The maximum number of calls in flight per protocol. Either an
+                           integer applied to all protocols or a dictionary {proto: limit}.
+                           Default: no per protocol limit
+        :param logger:     A logger to use for the output
+        """
+        self.ctxFactory = ctxFactory
+        self.maxWorkers = maxWorkers
+        self.rseLimit = rseLimit
+        self.protoLimit = protoLimit
+        self.logger = logger or logging.getLogger(__name__)
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix='AsyncGfal2')
+        self._local = threading.local()
+        self._rseSemaphores = {}
+        self._protoSemaphores = {}
+
+    def _getContext(self):
+        """
+        Return the gfal2 context of the current executor thread, creating it on first use
+        """
+        ctx = getattr(self._local, 'ctx', None)
+        if ctx is None:
+            ctx = self._local.ctx = self.ctxFactory()
+        return ctx
+
+    def _runCall(self, method, pfn):
+        """
+        The blocking part, executed in an executor thread
+        """
+        return getattr(self._getContext(), method)(pfn)
+
+    def _rseSemaphore(self, rseName):
+        if rseName not in self._rseSemaphores:
+            self._rseSemaphores[rseName] = asyncio.Semaphore(self.rseLimit)
+        return self._rseSemaphores[rseName]
+
+    def _protoSemaphore(self, proto):
+        if isinstance(self.protoLimit, dict):
+            limit = self.protoLimit.get(proto)
+        else:
+            limit = self.protoLimit
+        if not limit:
+            return None
+        if proto not in self._protoSemaphores:
+            self._protoSemaphores[proto] = asyncio.Semaphore(limit)
+        return self._protoSemaphores[proto]
+
+    async def call(self, rseName, method, pfn):
+        """
+        Execute a single gfal2 call within the RSE and protocol limits
+        :param rseName: The RSE the Pfn belongs to
+        :param method:  The gfal2 context method to call: 'stat', 'listdir', 'unlink'...
+        :param pfn:     The Pfn to call the method with
+        :return:        The result of the gfal2 call. Exceptions are propagated.
+        """
+        protoSemaphore = self._protoSemaphore(pfnProtocol(pfn))
+        async with self._rseSemaphore(rseName):
+            if protoSemaphore is not None:
+                await protoSemaphore.acquire()
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, self._runCall, method, pfn)
+            finally:
+                if protoSemaphore is not None:
+                    protoSemaphore.release()
+
+    async def stat(self, rseName, pfn):
+        return await self.call(rseName, 'stat', pfn)
+
+    async def listdir(self, rseName, pfn):
+        return await self.call(rseName, 'listdir', pfn)
+
+    async def unlink(self, rseName, pfn):
+        return await self.call(rseName, 'unlink', pfn)
+
+    async def mapCalls(self, rseName, method, pfns, window=1000):
+        """
+        Execute the same gfal2 call for many Pfns, keeping at most `window`
+        of them scheduled at any time, so arbitrarily long Pfn iterators can
+        be consumed without creating all the tasks upfront.
+        :param rseName: The RSE the Pfns belong to
+        :param method:  The gfal2 context method to call
+        :param pfns:    An iterable of Pfns
+        :param window:  The maximum number of tasks scheduled at once
+        :return:        An async generator of (pfn, result) tuples in completion order.
+                        A failed call returns the exception as result.
+        """
+        pending = {}
+        pfnIter = iter(pfns)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    pfn = next(pfnIter, None)
+                    if pfn is None:
+                        exhausted = True
+                        break
+                    pending[asyncio.ensure_future(self.call(rseName, method, pfn))] = pfn
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pfn = pending.pop(task)
+                    if task.exception() is not None:
+                        yield pfn, task.exception()
+                    else:
+                        yield pfn, task.result()
+        finally:
+            # In case the consumer stopped early
+            for task in pending:
+                task.cancel()
+
+    def shutdown(self, wait=True):
+        """
+        Shut down the executor
+        """
+        self.executor.shutdown(wait=wait)
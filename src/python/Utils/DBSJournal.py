@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+_DBSJournal_
+
+An append only journal of the file status updates applied to DBS. Every
+successful update is written as a '<status>\t<lfn>' line as soon as it is
+done, so an interrupted run can be restarted and skip everything already
+applied. In memory only a 64 bit digest per lfn is kept, which is enough to
+hold millions of entries.
+"""
+
+import hashlib
+import os
+import threading
+
+
+def lfnDigest(lfn):
+    """
+    :return: A 64 bit integer digest of an lfn
+    """
+    return int.from_bytes(hashlib.blake2b(lfn.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class DBSJournal(object):
+    """
+    A journal of the lfns already set to a given status
+    """
+
+    def __init__(self, journalFile):
+        """
+        :param journalFile: The path to the journal file. It is replayed if it exists.
+        """
+        self.journalFile = journalFile
+        self._done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(journalFile):
+            self._load()
+        self._fd = open(journalFile, 'a')
+
+    def _load(self):
+        with open(self.journalFile) as fd:
+            for line in fd:
+                status, sep, lfn = line.rstrip('\n').partition('\t')
+                if not sep or not lfn:
+                    # A line cut by an interrupted run
+                    continue
+                self._add(lfnDigest(lfn), int(status))
+
+    def _add(self, digest, status):
+        # An lfn has a single current status: a later update supersedes the previous one
+        for otherStatus, digests in self._done.items():
+            if otherStatus != status:
+                digests.discard(digest)
+        self._done.setdefault(status, set()).add(digest)
+
+    def __len__(self):
+        return sum(len(digests) for digests in self._done.values())
+
+    def isDone(self, lfn, status):
+        """
+        Check if the lfn was already set to the given status
+        """
+        return lfnDigest(lfn) in self._done.get(status, ())
+
+    def filterPending(self, lfns, status):
+        """
+        :return: The list of lfns not yet set to the given status, in input order
+        """
+        done = self._done.get(status, set())
+        return [lfn for lfn in lfns if lfnDigest(lfn) not in done]
+
+    def record(self, lfns, status):
+        """
+        Append a list of lfns set to the given status to the journal
+        """
+        with self._lock:
+            self._fd.write(''.join(f"{status}\t{lfn}\n" for lfn in lfns))
+            self._fd.flush()
+            for lfn in lfns:
+                self._add(lfnDigest(lfn), status)
+
+    def close(self):
+        with self._lock:
+            self._fd.close()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+_DBSLineageCache_
+
+An on disk (SQLite) cache of the DBS lineage graph: the files of a dataset
+and the children of a file. Repeated operations on the same lineage (a dry
+run, the actual update, a validation pass) are answered locally instead of
+downloading identical parent/child records from DBS again. Every entry
+carries the time it was fetched and is ignored once older than the TTL.
+
+NOTE: The sqlite connection must only be used from the thread which created it.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_children (parent TEXT NOT NULL, child TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS file_children_parent ON file_children (parent);
+CREATE TABLE IF NOT EXISTS file_fetched (lfn TEXT PRIMARY KEY, fetched REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS dataset_files (dataset TEXT NOT NULL, lfn TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS dataset_files_dataset ON dataset_files (dataset);
+CREATE TABLE IF NOT EXISTS dataset_fetched (dataset TEXT PRIMARY KEY, fetched REAL NOT NULL);
+"""
+
+# Keep the number of bound parameters per query below the sqlite limit
+_MAX_PARAMS = 500
+
+
+class DBSLineageCache(object):
+    """
+    A TTL bound, SQLite backed cache of dataset files and file children
+    """
+
+    def __init__(self, dbPath='~/.dbsLineageCache.db', ttl=24 * 3600):
+        """
+        :param dbPath: The path to the sqlite database file (':memory:' for an in memory cache)
+        :param ttl:    The time in seconds for which a cached entry is considered valid
+        """
+        if dbPath != ':memory:':
+            dbPath = os.path.expanduser(dbPath)
+        self.dbPath = dbPath
+        self.ttl = ttl
+        self._conn = sqlite3.connect(dbPath)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def _minFetched(self):
+        return time.time() - self.ttl
+
+    def getChildren(self, lfns):
+        """
+        Return the cached children of a list of lfns
+        :param lfns: A list of lfns
+        :return:     A dictionary {lfn: [children]} with an entry only for
+                     the lfns cached within the TTL
+        """
+        childrenMap = {}
+        minFetched = self._minFetched()
+        for idx in range(0, len(lfns), _MAX_PARAMS):
+            chunk = lfns[idx:idx + _MAX_PARAMS]
+            marks = ','.join('?' * len(chunk))
+            for (lfn,) in self._conn.execute(
+                    f"SELECT lfn FROM file_fetched WHERE fetched > ? AND lfn IN ({marks})",
+                    [minFetched] + chunk):
+                childrenMap[lfn] = []
+            fresh = [lfn for lfn in chunk if lfn in childrenMap]
+            if not fresh:
+                continue
+            marks = ','.join('?' * len(fresh))
+            for parent, child in self._conn.execute(
+                    f"SELECT parent, child FROM file_children WHERE parent IN ({marks})", fresh):
+                childrenMap[parent].append(child)
+        return childrenMap
+
+    def putChildren(self, childrenMap):
+        """
+        Store the children of a set of lfns, replacing any previous entries
+        :param childrenMap: A dictionary {lfn: [children]}. Files with no children
+                            should be stored with an empty list too.
+        """
+        now = time.time()
+        with self._conn:
+            parents = list(childrenMap)
+            for idx in range(0, len(parents), _MAX_PARAMS):
+                chunk = parents[idx:idx + _MAX_PARAMS]
+                self._conn.execute(f"DELETE FROM file_children WHERE parent IN ({','.join('?' * len(chunk))})",
+                                   chunk)
+            self._conn.executemany("INSERT INTO file_children (parent, child) VALUES (?, ?)",
+                                   ((parent, child) for parent, children in childrenMap.items()
+                                    for child in children))
+            self._conn.executemany("INSERT OR REPLACE INTO file_fetched (lfn, fetched) VALUES (?, ?)",
+                                   ((parent, now) for parent in parents))
+
+    def getDatasetFiles(self, dataset):
+        """
+        Return the cached list of files of a dataset, or None if not cached within the TTL
+        """
+        row = self._conn.execute("SELECT fetched FROM dataset_fetched WHERE dataset = ? AND fetched > ?",
+                                 (dataset, self._minFetched())).fetchone()
+        if row is None:
+            return None
+        return [lfn for (lfn,) in self._conn.execute("SELECT lfn FROM dataset_files WHERE dataset = ?",
+                                                     (dataset,))]
+
+    def putDatasetFiles(self, dataset, lfns):
+        """
+        Store the list of files of a dataset, replacing any previous entry
+        """
+        with self._conn:
+            self._conn.execute("DELETE FROM dataset_files WHERE dataset = ?", (dataset,))
+            self._conn.executemany("INSERT INTO dataset_files (dataset, lfn) VALUES (?, ?)",
+                                   ((dataset, lfn) for lfn in lfns))
+            self._conn.execute("INSERT OR REPLACE INTO dataset_fetched (dataset, fetched) VALUES (?, ?)",
+                               (dataset, time.time()))
+
+    def invalidate(self, datasets=None, lfns=None):
+        """
+        Drop cached entries. With no arguments only the entries older than the TTL are dropped.
+        :param datasets: A list of datasets to drop
+        :param lfns:     A list of lfns whose children are to be dropped
+        """
+        with self._conn:
+            if datasets is None and lfns is None:
+                minFetched = self._minFetched()
+                self._conn.execute("DELETE FROM dataset_files WHERE dataset IN "
+                                   "(SELECT dataset FROM dataset_fetched WHERE fetched <= ?)", (minFetched,))
+                self._conn.execute("DELETE FROM dataset_fetched WHERE fetched <= ?", (minFetched,))
+                self._conn.execute("DELETE FROM file_children WHERE parent IN "
+                                   "(SELECT lfn FROM file_fetched WHERE fetched <= ?)", (minFetched,))
+                self._conn.execute("DELETE FROM file_fetched WHERE fetched <= ?", (minFetched,))
+                return
+            for dataset in datasets or []:
+                self._conn.execute("DELETE FROM dataset_files WHERE dataset = ?", (dataset,))
+                self._conn.execute("DELETE FROM dataset_fetched WHERE dataset = ?", (dataset,))
+            for lfn in lfns or []:
+                self._conn.execute("DELETE FROM file_children WHERE parent = ?", (lfn,))
+                self._conn.execute("DELETE FROM file_fetched WHERE lfn = ?", (lfn,))
+
+    def exportGraph(self, outputFile=None):
+        """
+        Export the whole cached lineage graph, regardless of the TTL
+        :param outputFile: An optional path to dump the graph to, in json format
+        :return:           A dictionary {'datasets': {dataset: [lfns]}, 'children': {lfn: [children]}}
+        """
+        graph = {'datasets': {}, 'children': {}}
+        for dataset, lfn in self._conn.execute("SELECT dataset, lfn FROM dataset_files"):
+            graph['datasets'].setdefault(dataset, []).append(lfn)
+        for (lfn,) in self._conn.execute("SELECT lfn FROM file_fetched"):
+            graph['children'][lfn] = []
+        for parent, child in self._conn.execute("SELECT parent, child FROM file_children"):
+            graph['children'].setdefault(parent, []).append(child)
+        if outputFile:
+            with open(outputFile, 'w') as fd:
+                json.dump(graph, fd, indent=2)
+        return graph
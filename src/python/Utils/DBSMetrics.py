@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+_DBSMetrics_
+
+A small, dependency free, in process metrics registry (counters, gauges and
+histograms with labels), rendered in the Prometheus text exposition format.
+InstrumentedApi wraps a DbsApi instance and records the number, the latency
+and the errors of every call made through it.
+"""
+
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Latency buckets in seconds, suited for DBS REST calls
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _formatLabels(labelKey, extra=()):
+    pairs = list(labelKey) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+def _formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    """
+    Base class of all metrics: a set of values, one per combination of label values
+    """
+    metricType = None
+
+    def __init__(self, name, documentation=''):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(_labelKey(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, labelKey, (), value) for labelKey, value in sorted(self._values.items())]
+
+    def expose(self):
+        """
+        :return: The metric in the Prometheus text exposition format
+        """
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.metricType)]
+        for name, labelKey, extra, value in self._samples():
+            lines.append('%s%s %s' % (name, _formatLabels(labelKey, extra), _formatValue(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing value
+    """
+    metricType = 'counter'
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = _labelKey(labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A value which can go up and down
+    """
+    metricType = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_labelKey(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = _labelKey(labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    The distribution of observed values over a set of buckets
+    """
+    metricType = 'histogram'
+
+    def __init__(self, name, documentation='', buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        with self._lock:
+            key = _labelKey(labels)
+            record = self._values.get(key)
+            if record is None:
+                record = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    record['counts'][idx] += 1
+                    break
+            record['sum'] += value
+            record['count'] += 1
+
+    def get(self, **labels):
+        """
+        :return: A tuple (number of observations, sum of the observed values)
+        """
+        with self._lock:
+            record = self._values.get(_labelKey(labels))
+            return (record['count'], record['sum']) if record else (0, 0.0)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for labelKey, record in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, record['counts']):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', labelKey, (('le', _formatValue(bound)),), cumulative))
+                samples.append((self.name + '_sum', labelKey, (), record['sum']))
+                samples.append((self.name + '_count', labelKey, (), record['count']))
+        return samples
+
+
+class MetricsRegistry(object):
+    """
+    A named collection of metrics. Metrics are created on first use.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _getOrCreate(self, metricClass, name, documentation, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metricClass(name, documentation, **kwargs)
+            elif not isinstance(metric, metricClass):
+                raise ValueError("Metric %s is already registered as a %s" % (name, metric.metricType))
+            return metric
+
+    def counter(self, name, documentation=''):
+        return self._getOrCreate(Counter, name, documentation)
+
+    def gauge(self, name, documentation=''):
+        return self._getOrCreate(Gauge, name, documentation)
+
+    def histogram(self, name, documentation='', buckets=DEFAULT_BUCKETS):
+        return self._getOrCreate(Histogram, name, documentation, buckets=buckets)
+
+    def expose(self):
+        """
+        :return: All metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return ''.join(metric.expose() for metric in metrics)
+
+
+class InstrumentedApi(object):
+    """
+    A proxy to a DbsApi instance, recording every call in a MetricsRegistry:
+    dbs_calls_total, dbs_call_errors_total and dbs_call_duration_seconds, labelled by method
+    """
+
+    def __init__(self, dbsApi, registry):
+        self._dbsApi = dbsApi
+        self._calls = registry.counter('dbs_calls_total', 'Number of DBS API calls')
+        self._errors = registry.counter('dbs_call_errors_total', 'Number of failed DBS API calls')
+        self._duration = registry.histogram('dbs_call_duration_seconds', 'Duration of the DBS API calls')
+
+    def __getattr__(self, name):
+        attr = getattr(self._dbsApi, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def instrumented(*args, **kwargs):
+            startTime = time.time()
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                self._errors.inc(method=name)
+                raise
+            finally:
+                self._calls.inc(method=name)
+                self._duration.observe(time.time() - startTime, method=name)
+        return instrumented
+
+
+def startMetricsServer(registry, port=9090, address='127.0.0.1'):
+    """
+    Serve the metrics of a registry over HTTP (any path), from a daemon thread
+    :param registry: A MetricsRegistry instance
+    :param port:     The port to listen on (0 for any free port)
+    :param address:  The address to bind to: the local host only by default,
+                     '' to expose the metrics on all interfaces
+    :return:         The server instance. Call its shutdown() method to stop it.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            payload = registry.expose().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True)
+    thread.start()
+    return server
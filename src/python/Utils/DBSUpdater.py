@@ -1,14 +1,141 @@
 #!/usr/bin/env python
 
+import json
+import math
+import os
+import queue
+import re
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 from dbs.apis.dbsClient import DbsApi
 from WMCore.Lexicon import dataset as isDataset, block as isBlock , lfn as isLfn
 
+from Utils.DBSMetrics import InstrumentedApi
+
+
+# Cheap, precompiled shape checks, selecting the (much slower) Lexicon validator to run
+DATASET_SHAPE = re.compile(r'^/[^/#]+/[^/#]+/[^/#]+$')
+BLOCK_SHAPE = re.compile(r'^/[^/#]+/[^/#]+/[^/#]+#[^/#]+$')
+LFN_SHAPE = re.compile(r'^/store/[^#]+$')
+
+ENTRY_TYPES = ('dataset', 'block', 'lfn')
+
+
+def _shapeCandidates(candidate):
+    """
+    :return: The entry types a string may be of, judging by its shape only
+    """
+    if not isinstance(candidate, str):
+        return ()
+    if BLOCK_SHAPE.match(candidate):
+        return ('block',)
+    if DATASET_SHAPE.match(candidate):
+        # NOTE: A three level path under /store is a valid lfn as well
+        return ('dataset', 'lfn') if LFN_SHAPE.match(candidate) else ('dataset',)
+    if LFN_SHAPE.match(candidate):
+        return ('lfn',)
+    return ()
+
+
+# NOTE: The same datasets and parent lfns come up again and again in lineage updates and
+#       input lists, while batches of unique lfns only cycle through a bounded cache
+@lru_cache(maxsize=4096)
+def classifyEntry(candidate, strict=True):
+    """
+    Classify a single string as a dataset, a block or an lfn
+    :param candidate: The string to classify
+    :param strict:    Confirm the shape check with the WMCore Lexicon validator.
+                      Without it, any path under /store is taken for an lfn.
+    :return:          One of ENTRY_TYPES or None
+    """
+    candidates = _shapeCandidates(candidate)
+    if not strict:
+        if 'lfn' in candidates:
+            return 'lfn'
+        return candidates[0] if candidates else None
+    validators = {'dataset': isDataset, 'block': isBlock, 'lfn': isLfn}
+    for entryType in candidates:
+        try:
+            if validators[entryType](candidate):
+                return entryType
+        except AssertionError:
+            pass
+    return None
+
+
+def classifyEntries(entries, strict=True):
+    """
+    Sort a batch of strings into datasets, blocks and lfns in a single pass
+    :param entries: An iterable of strings
+    :param strict:  See classifyEntry
+    :return:        A dictionary {'dataset': [], 'block': [], 'lfn': [], 'unknown': []}, in input order
+    """
+    classified = {entryType: [] for entryType in ENTRY_TYPES + ('unknown',)}
+    for entry in entries:
+        entryType = classifyEntry(entry, strict) if isinstance(entry, str) else None
+        classified[entryType or 'unknown'].append(entry)
+    return classified
+
+
+class RateLimiter(object):
+    """
+    A thread safe limiter spacing out calls to at most `rate` per second
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: The maximum number of calls per second (None or 0 for no limit)
+        """
+        self.interval = 1.0 / rate if rate else 0.0
+        self._nextCall = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next call is allowed
+        """
+        with self._lock:
+            now = time.time()
+            delay = self._nextCall - now
+            self._nextCall = max(now, self._nextCall) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
 
 class DBSUpdater(object):
 
-    def __init__(self, dbsUrl=None):
+    def __init__(self, dbsUrl=None, chunkSize=100, nThreads=8, apiFactory=DbsApi, cache=None, journal=None,
+                 metrics=None):
+        """
+        :param dbsUrl:     The DBS writer url
+        :param chunkSize:  The maximum number of lfns sent in a single DBS call
+        :param nThreads:   The number of threads fetching file children in parallel
+        :param apiFactory: A callable returning a DBS client for a given url
+        :param cache:      An optional DBSLineageCache instance, queried before DBS.
+                           It is only ever accessed from the thread creating the DBSUpdater.
+        :param journal:    An optional DBSJournal instance. Every file status update is recorded
+                           in it, and the files already set to the target status are skipped.
+        :param metrics:    An optional DBSMetrics.MetricsRegistry instance. Every DBS call and
+                           the progress of the updates are recorded in it.
+        """
+        self.cache = cache
+        self.journal = journal
+        self.metrics = metrics
         self.dbsUrl = dbsUrl
-        self.dbsApi = DbsApi(dbsUrl)
+        self.apiFactory = apiFactory
+        self.dbsApi = self._mainApi()
+        self.chunkSize = chunkSize
+        self.nThreads = nThreads
+        # The DBS client is not thread safe, every worker thread gets its own instance
+        self._threadData = threading.local()
+        # Switched off automatically if the DBS server turns out not to accept bulk updates
+        self.bulkUpdates = True
+        # The number of update calls sent at the same time, see PooledDBSUpdater
+        self.updateConcurrency = 1
         self.statusMap = {'valid': 1,
                           'invalid': 0,
                           '1':1,
@@ -17,39 +144,77 @@ class DBSUpdater(object):
                           0:0}
     @staticmethod
     def _isDataset(candidate):
-        try:
-            return isDataset(candidate)
-        except AssertionError:
-            return False
+        return classifyEntry(candidate) == 'dataset'
 
     @staticmethod
     def _isBlock(candidate):
-        try:
-            return isBlock(candidate)
-        except AssertionError:
-            return False
+        return classifyEntry(candidate) == 'block'
 
     @staticmethod
     def _isLfn(candidate):
-        try:
-            return isLfn(candidate)
-        except AssertionError:
-            return False
+        return classifyEntry(candidate) == 'lfn'
 
     def getDatasetFiles(self, dataset=None, status=None):
-        if status:
-            status = self.statusMap[status]
-            return [fileRec['logical_file_name'] for fileRec in  self.dbsApi.listFileArray(dataset=dataset, detail=True)
-                    if  fileRec['is_file_valid'] == status]
+        if status is not None:
+            return self.filterFilesByStatus(dataset, status)
         else:
-            return [fileRec['logical_file_name'] for fileRec in  self.dbsApi.listFileArray(dataset=dataset, detail=False)]
+            lfns = self.cache.getDatasetFiles(dataset) if self.cache else None
+            if lfns is None:
+                lfns = [fileRec['logical_file_name'] for fileRec in  self.dbsApi.listFileArray(dataset=dataset, detail=False)]
+                if self.cache:
+                    self.cache.putDatasetFiles(dataset, lfns)
+            return lfns
 
-    def filterFilesByStatus(self, files=None, status=None):
+    def iterFilesByStatus(self, files, status=None):
+        """
+        Select the files with a given status, with a single detailed listFileArray
+        call per dataset or per chunk of lfns, filtered on is_file_valid.
+        NOTE: listFileArray returns the complete list of records of a call, so only the
+              output is generated lazily: for a list of lfns at most chunkSize records are
+              held at once, but for a dataset all its file records are fetched in one go.
+        NOTE: validFileOnly is not used, since DBS selects on the dataset access type
+              with it as well, so valid files of a non VALID dataset would be missed.
+        NOTE: For a list of lfns, lfns unknown to DBS are not returned at all.
+        :param files:  A datasetName, a single lfn or a list of lfns
+        :param status: The file status to select
+        :return:       A generator of lfns
+        """
         status = self.statusMap[status]
         if isinstance(files, str) and self._isDataset(files):
-            return self.filterFilesByStatus(self.getDatasetFiles(files), status)
-        return [fileRec['logical_file_name'] for fileRec in  self.dbsApi.listFileArray(logical_file_name=files, detail=True)
-            if  fileRec['is_file_valid'] == status]
+            queries = [{'dataset': files}]
+        else:
+            lfns = [files] if isinstance(files, str) else files
+            queries = [{'logical_file_name': lfns[idx:idx + self.chunkSize]}
+                       for idx in range(0, len(lfns), self.chunkSize)]
+        for query in queries:
+            # NOTE: File status is what we are changing, so it is never served from the cache
+            for fileRec in self.dbsApi.listFileArray(detail=True, **query):
+                if fileRec['is_file_valid'] == status:
+                    yield fileRec['logical_file_name']
+
+    def filterFilesByStatus(self, files, status=None):
+        return list(self.iterFilesByStatus(files, status))
+
+    @staticmethod
+    def _childrenMap(lfns, fileRecs):
+        """
+        Build a {lfn: [children]} dictionary out of the DBS listFileChildren records,
+        with an empty list for the lfns with no children at all.
+        DBS returns either a single child lfn or a list of them per parent file.
+        """
+        childrenMap = {lfn: [] for lfn in lfns}
+        for fileRec in fileRecs:
+            child = fileRec['child_logical_file_name']
+            children = childrenMap.setdefault(fileRec['logical_file_name'], [])
+            if isinstance(child, list):
+                children.extend(child)
+            elif child:
+                children.append(child)
+        return childrenMap
+
+    @staticmethod
+    def _flattenChildren(lfns, childrenMap):
+        return [child for lfn in lfns for child in childrenMap.get(lfn, [])]
 
     def getFilesChildren(self, files):
         """
@@ -57,12 +222,332 @@ class DBSUpdater(object):
         """
         if isinstance(files, str) and self._isDataset(files):
             return self.getFilesChildren(self.getDatasetFiles(files))
+        lfns = [files] if isinstance(files, str) else files
+        childrenMap = self.cache.getChildren(lfns) if self.cache else {}
+        missing = [lfn for lfn in lfns if lfn not in childrenMap]
+        if missing:
+            fetched = self._childrenMap(missing, self.dbsApi.listFileChildren(logical_file_name=missing))
+            if self.cache:
+                self.cache.putChildren(fetched)
+            childrenMap.update(fetched)
+        return self._flattenChildren(lfns, childrenMap)
+
+    def _newApi(self):
+        """
+        Create a new DBS client, instrumented if a metrics registry is set
+        """
+        dbsApi = self.apiFactory(self.dbsUrl)
+        if self.metrics is not None:
+            dbsApi = InstrumentedApi(dbsApi, self.metrics)
+        return dbsApi
+
+    def _mainApi(self):
+        """
+        Create the DBS client used from the thread creating the DBSUpdater
+        """
+        return self._newApi()
+
+    def _probeApi(self):
+        """
+        Return the DBS client for the calls bisecting a failed update
+        """
+        return self.dbsApi
+
+    def _gauge(self, name, documentation, value):
+        if self.metrics is not None:
+            self.metrics.gauge(name, documentation).set(value)
+
+    def _threadApi(self):
+        """
+        Return the DBS client of the current thread, creating it on first use
+        """
+        dbsApi = getattr(self._threadData, 'dbsApi', None)
+        if dbsApi is None:
+            dbsApi = self._threadData.dbsApi = self._newApi()
+        return dbsApi
+
+    def _fetchChildrenChunk(self, lfns):
+        return self._childrenMap(lfns, self._threadApi().listFileChildren(logical_file_name=lfns))
+
+    def _submitChildrenFetch(self, pool, lfns):
+        """
+        Look up the children of a list of lfns in the cache, split the rest
+        in chunks and submit their lookups to the thread pool
+        :return: A tuple (childrenMap of the cached lfns, list of futures)
+        """
+        childrenMap = self.cache.getChildren(lfns) if self.cache else {}
+        missing = [lfn for lfn in lfns if lfn not in childrenMap]
+        futures = [pool.submit(self._fetchChildrenChunk, missing[idx:idx + self.chunkSize])
+                   for idx in range(0, len(missing), self.chunkSize)]
+        return childrenMap, futures
+
+    def _callUpdateFileStatus(self, lfns, status, report, probe=False):
+        """
+        Make a single updateFileStatus call for a list of lfns
+        :param probe: Flag, True for the calls bisecting a failed update
+        :return: True on success, False on failure
+        """
+        report['calls'] += 1
+        dbsApi = self._probeApi() if probe else self.dbsApi
+        try:
+            dbsApi.updateFileStatus(logical_file_name=lfns if len(lfns) > 1 else lfns[0],
+                                         is_file_valid=status)
+            return True
+        except Exception as ex:
+            print(f"Failed to update the status of {len(lfns)} files. Error: {ex}")
+            return False
+
+    def _bisectUpdate(self, lfns, status, report, probe=False):
+        """
+        Update the status of a list of lfns in a single call. If the call fails,
+        split the list in two halves and retry each of them, until the lfns
+        causing the failure are isolated.
+        :param probe: Flag, True if lfns is already part of a failed update
+        :return:      The number of successful calls updating more than one lfn
+        """
+        if self._callUpdateFileStatus(lfns, status, report, probe=probe):
+            report['updated'] += len(lfns)
+            if self.journal is not None:
+                self.journal.record(lfns, status)
+            return 1 if len(lfns) > 1 else 0
+        if len(lfns) == 1:
+            report['failed'].append(lfns[0])
+            return 0
+        middle = len(lfns) // 2
+        return self._bisectUpdate(lfns[:middle], status, report, probe=True) + \
+            self._bisectUpdate(lfns[middle:], status, report, probe=True)
+
+    @staticmethod
+    def _mapChunks(func, chunks):
+        """
+        Apply func to every chunk, in order. Sequential here, see PooledDBSUpdater.
+        """
+        return map(func, chunks)
+
+    def _updateChunk(self, chunk, status):
+        """
+        Update the status of a chunk of lfns, bisecting it on failure
+        :return: A report dictionary for the chunk, see updateFilesStatusBulk
+        """
+        report = {'updated': 0, 'failed': [], 'calls': 0}
+        if not self.bulkUpdates:
+            for lfn in chunk:
+                self._bisectUpdate([lfn], status, report)
+        elif self._callUpdateFileStatus(chunk, status, report):
+            report['updated'] += len(chunk)
+            if self.journal is not None:
+                self.journal.record(chunk, status)
         else:
-            return [fileRec['child_logical_file_name'] for fileRec in  self.dbsApi.listFileChildren(logical_file_name=files)]
+            bulkSuccess = self._bisectUpdate(chunk[:len(chunk) // 2], status, report, probe=True) + \
+                self._bisectUpdate(chunk[len(chunk) // 2:], status, report, probe=True)
+            if len(chunk) > 1 and not bulkSuccess and not report['failed']:
+                print("No bad lfn found in a failing chunk. Switching bulk file status updates off.")
+                self.bulkUpdates = False
+        return report
+
+    def updateFilesStatusBulk(self, lfns, status=None):
+        """
+        Update the status of a list of lfns in chunks of self.chunkSize. A failing
+        chunk is bisected to find the bad lfns, so only those end up updated
+        one by one. If a failing chunk turns out to contain no bad lfn at all,
+        bulk updates are considered unsupported by the server and the rest of
+        the lfns are updated with one call per file.
+        Lfns already set to the status according to the journal are skipped.
+        :param lfns:   A list of lfns (or a single lfn)
+        :param status: The new file status
+        :return:       A report dictionary: {'updated': int, 'failed': [lfns], 'calls': int, 'skipped': int}
+        """
+        if isinstance(lfns, str):
+            lfns = [lfns]
+        status = self.statusMap[status]
+        report = {'updated': 0, 'failed': [], 'calls': 0, 'skipped': 0}
+        if self.journal is not None:
+            pending = self.journal.filterPending(lfns, status)
+            report['skipped'] = len(lfns) - len(pending)
+            lfns = pending
+        chunks = [lfns[idx:idx + self.chunkSize] for idx in range(0, len(lfns), self.chunkSize)]
+        pending = len(lfns)
+        self._gauge('dbsupdater_pending_files', 'Files left to update in the current batch', pending)
+        for chunkReport in self._mapChunks(lambda chunk: self._updateChunk(chunk, status), chunks):
+            report['updated'] += chunkReport['updated']
+            report['failed'].extend(chunkReport['failed'])
+            report['calls'] += chunkReport['calls']
+            pending -= chunkReport['updated'] + len(chunkReport['failed'])
+            self._gauge('dbsupdater_pending_files', 'Files left to update in the current batch', pending)
+            if self.metrics is not None:
+                self.metrics.counter('dbsupdater_files_updated_total', 'Files updated').inc(chunkReport['updated'])
+                self.metrics.counter('dbsupdater_files_failed_total', 'Files failed to update').inc(
+                    len(chunkReport['failed']))
+        if self.metrics is not None and report['skipped']:
+            self.metrics.counter('dbsupdater_files_skipped_total', 'Files skipped as already done').inc(
+                report['skipped'])
+        print(f"Updated the status of {report['updated']} files with {report['calls']} calls. "
+              f"Failed: {len(report['failed'])}, skipped: {report['skipped']}")
+        return report
 
-    def updateFilesStatus(self, entries, status=None, recursive=False):
+    def _resolveEntries(self, entries):
+        """
+        :param entries: A datasetName, a single lfn or a list of lfns
+        :return:        A tuple (datasetName or None, list of lfns)
+        """
+        if isinstance(entries, str) and self._isDataset(entries):
+            return entries, self.getDatasetFiles(entries)
+        elif isinstance(entries, str):
+            return None, [entries]
+        return None, list(entries)
+
+    def _iterLineage(self, lfns, maxDepth=None):
+        """
+        Walk the lineage of a list of lfns one generation at a time (breadth first).
+        The children of every generation are fetched in parallel chunks by a
+        thread pool, while the consumer is processing the generation itself.
+        Files reachable through more than one parent are visited only once.
+        :param lfns:     The list of lfns of the first generation
+        :param maxDepth: The last generation to be walked (None for no limit)
+        :return:         A generator of tuples (depth, list of lfns)
+        """
+        visited = set()
+        depth = 0
+        generation = lfns
+        with ThreadPoolExecutor(max_workers=self.nThreads) as pool:
+            while generation and (maxDepth is None or depth <= maxDepth):
+                generation = [lfn for lfn in dict.fromkeys(generation) if lfn not in visited]
+                if not generation:
+                    break
+                visited.update(generation)
+                childrenMap, futures = {}, []
+                if maxDepth is None or depth < maxDepth:
+                    childrenMap, futures = self._submitChildrenFetch(pool, generation)
+
+                yield depth, generation
+
+                for future in futures:
+                    fetched = future.result()
+                    if self.cache:
+                        self.cache.putChildren(fetched)
+                    childrenMap.update(fetched)
+                generation = self._flattenChildren(generation, childrenMap)
+                depth += 1
+
+    def updateLineageStatus(self, entries, status=None, maxDepth=None):
+        """
+        Update the status of a set of files and all of their descendants, one
+        generation at a time. See _iterLineage.
+        :param entries:  A datasetName, a single lfn or a list of lfns
+        :param status:   The new file status
+        :param maxDepth: The last generation to be updated (None for no limit)
+        :return:         A report dictionary: {'updated': int, 'failed': [lfns], 'calls': int, 'skipped': int,
+                                               'generations': [{'depth', 'files', 'updated', 'failed', 'time'}]}
+        """
+        dataset, lfns = self._resolveEntries(entries)
+        report = {'updated': 0, 'failed': [], 'calls': 0, 'skipped': 0, 'generations': []}
+        numFiles = 0
+        startTime = time.time()
+        for depth, generation in self._iterLineage(lfns, maxDepth=maxDepth):
+            datasetCall = dataset and depth == 0
+            if datasetCall and self.journal is not None and \
+                    len(self.journal.filterPending(generation, self.statusMap[status])) < len(generation):
+                # Partially done by a previous run, only the rest of the files are to be updated
+                datasetCall = False
+            if datasetCall:
+                # The whole dataset is updated with a single call
+                genReport = {'updated': 0, 'failed': [], 'calls': 1, 'skipped': 0}
+                try:
+                    self.dbsApi.updateFileStatus(dataset=dataset, is_file_valid=self.statusMap[status])
+                    genReport['updated'] = len(generation)
+                    if self.journal is not None:
+                        self.journal.record(generation, self.statusMap[status])
+                except Exception as ex:
+                    print(f"Failed to update the status of dataset {dataset}. Falling back to file updates. Error: {ex}")
+                    genReport = self.updateFilesStatusBulk(generation, status=status)
+                    genReport['calls'] += 1
+            else:
+                genReport = self.updateFilesStatusBulk(generation, status=status)
+
+            numFiles += len(generation)
+            report['updated'] += genReport['updated']
+            report['failed'].extend(genReport['failed'])
+            report['calls'] += genReport['calls']
+            report['skipped'] += genReport['skipped']
+            genStats = {'depth': depth,
+                        'files': len(generation),
+                        'updated': genReport['updated'],
+                        'failed': len(genReport['failed']),
+                        'time': time.time() - startTime}
+            report['generations'].append(genStats)
+            self._gauge('dbsupdater_lineage_depth', 'Current generation of the lineage update', depth)
+            self._gauge('dbsupdater_lineage_files', 'Files visited by the lineage update', numFiles)
+            print(f"Generation {depth}: {genStats['updated']}/{genStats['files']} files updated, "
+                  f"{genStats['failed']} failed, {numFiles} files visited in total, "
+                  f"took {genStats['time']:.2f} sec.")
+            startTime = time.time()
+        return report
+
+    def _fetchFilesInfoChunk(self, lfns):
+        """
+        :return: A tuple (list of DBS file records, the duration of the call)
+        """
+        startTime = time.time()
+        fileRecs = self._threadApi().listFileArray(logical_file_name=lfns, detail=True)
+        return fileRecs, time.time() - startTime
+
+    def planLineageStatus(self, entries, status=None, maxDepth=None, callLatency=None):
+        """
+        Dry run of updateLineageStatus: resolve all the files and datasets affected by
+        a recursive status change, without changing anything in DBS, and estimate
+        the number of update calls and the time needed for the current chunkSize.
+        :param entries:     A datasetName, a single lfn or a list of lfns
+        :param status:      The new file status
+        :param maxDepth:    The last generation to be updated (None for no limit)
+        :param callLatency: The time in seconds a single update call is expected to take.
+                            By default the average latency of the file info lookups is used.
+                            The estimated time accounts for the concurrent update calls
+                            of a PooledDBSUpdater.
+        :return:            A plan dictionary:
+                            {'files': int, 'atTarget': int, 'updateCalls': int, 'lookupCalls': int,
+                             'datasets': {datasetName: int}, 'callLatency': float, 'estimatedTime': float,
+                             'generations': [{'depth', 'files', 'atTarget', 'updateCalls'}]}
+        """
+        status = self.statusMap[status]
+        dataset, lfns = self._resolveEntries(entries)
+        plan = {'files': 0, 'atTarget': 0, 'updateCalls': 0, 'lookupCalls': 0,
+                'datasets': {}, 'generations': []}
+        latencies = []
+        with ThreadPoolExecutor(max_workers=self.nThreads) as pool:
+            for depth, generation in self._iterLineage(lfns, maxDepth=maxDepth):
+                chunks = [generation[idx:idx + self.chunkSize] for idx in range(0, len(generation), self.chunkSize)]
+                genPlan = {'depth': depth, 'files': len(generation), 'atTarget': 0,
+                           'updateCalls': 1 if dataset and depth == 0 else len(chunks)}
+                for fileRecs, latency in pool.map(self._fetchFilesInfoChunk, chunks):
+                    latencies.append(latency)
+                    for fileRec in fileRecs:
+                        if fileRec.get('dataset'):
+                            plan['datasets'][fileRec['dataset']] = plan['datasets'].get(fileRec['dataset'], 0) + 1
+                        if fileRec.get('is_file_valid') == status:
+                            genPlan['atTarget'] += 1
+                plan['files'] += genPlan['files']
+                plan['atTarget'] += genPlan['atTarget']
+                plan['updateCalls'] += genPlan['updateCalls']
+                plan['lookupCalls'] += len(chunks)
+                plan['generations'].append(genPlan)
+                print(f"Generation {depth}: {genPlan['files']} files to be updated with "
+                      f"{genPlan['updateCalls']} calls, {genPlan['atTarget']} already at status {status}.")
+        if callLatency is None:
+            callLatency = sum(latencies) / len(latencies) if latencies else 0.0
+        plan['callLatency'] = callLatency
+        # Generations are updated one after the other, and the calls of a generation
+        # in waves of updateConcurrency calls at a time
+        plan['estimatedTime'] = callLatency * sum(math.ceil(genPlan['updateCalls'] / self.updateConcurrency)
+                                                  for genPlan in plan['generations'])
+        print(f"Plan: {plan['files']} files in {len(plan['datasets'])} datasets over "
+              f"{len(plan['generations'])} generations, {plan['updateCalls']} update calls "
+              f"with chunkSize={self.chunkSize}, estimated time {plan['estimatedTime']:.1f} sec.")
+        return plan
+
+    def updateFilesStatus(self, entries, status=None, recursive=False, dryRun=False):
         """
         :param entries: list of lfns or a datasetName
+        :param dryRun:  Do not change anything, only return the plan of the update (see planLineageStatus)
         """
         kwargs={}
         if isinstance(entries, str) and self._isDataset(entries):
@@ -70,7 +555,11 @@ class DBSUpdater(object):
         elif isinstance(entries, str) and self._isLfn(entries):
             kwargs['logical_file_name'] = entries
         elif isinstance(entries, list):
-            kwargs['logical_file_name'] = entries
+            classified = classifyEntries(entries, strict=False)
+            if len(classified['lfn']) < len(entries):
+                print(f"Skipping {len(entries) - len(classified['lfn'])} entries which are not lfns: "
+                      f"{classified['dataset'] + classified['block'] + classified['unknown']}")
+            kwargs['logical_file_name'] = classified['lfn']
         else:
             print("bad entries")
             return False
@@ -78,29 +567,15 @@ class DBSUpdater(object):
         kwargs['is_file_valid'] = self.statusMap[status]
 
         # print(f"kwargs: {kwargs}")
-        if recursive and kwargs.get('dataset', None):
-            print(f"self.updateFilesStatus({kwargs['dataset']}, status={status}, recursive=False)")
-            self.updateFilesStatus(kwargs['dataset'], status=status, recursive=False)
-            newEntries = self.getFilesChildren(kwargs['dataset'])
-            while newEntries:
-                print(f"Updating Children files for dataset {kwargs['dataset']} recursively:")
-                print(f"self.updateFilesStatus({len(newEntries)} entries, status={status}, recursive=True)")
-                self.updateFilesStatus(newEntries, status=status, recursive=recursive)
-                return
-        elif recursive and kwargs.get('logical_file_name', None):
-            print(f"self.updateFilesStatus({len(entries)} entries, status={status}, recursive=False)")
-            # NOTE: Updates on bulk/file lists does not work in dbs integration.
-            #       Needs to be tested in production as well
-            #  # self.updateFilesStatus(entries, status=status, recursive=False)
-            for entry in entries:
-                self.updateFilesStatus(entry, status=status, recursive=False)
-            children = self.getFilesChildren(entries)
-            while children:
-                print(f"Updating filelist with {len(children)} members recursively:")
-                print(f"self.updateFilesStatus({len(children)} entries, status={status}, recursive=True)")
-                self.updateFilesStatus(children, status=status, recursive=True)
-                return
-                # self.updateFilesStatus(children, status=status, recursive=recursive)
+        if dryRun:
+            return self.planLineageStatus(kwargs.get('dataset') or kwargs['logical_file_name'], status=status,
+                                          maxDepth=None if recursive else 0)
+        elif recursive:
+            # NOTE: Updates on bulk/file lists did not work in dbs integration. The bulk
+            #       update engine falls back to per file calls if that is still the case.
+            return self.updateLineageStatus(kwargs.get('dataset') or kwargs['logical_file_name'], status=status)
+        elif isinstance(kwargs.get('logical_file_name', None), list):
+            return self.updateFilesStatusBulk(kwargs['logical_file_name'], status=status)
         else:
             return self.dbsApi.updateFileStatus(**kwargs)
 
@@ -112,3 +587,218 @@ class DBSUpdater(object):
 
     def getDatasetInfo(self, dataset):
         return self.dbsApi.listDatasets(dataset=dataset, detail=True)
+
+    @staticmethod
+    def readDatasets(datasets):
+        """
+        :param datasets: An iterable of datasetNames or the path to a file with one
+                         datasetName per line (empty lines and '#' comments are skipped)
+        :return:         A list of unique datasetNames, in input order
+        """
+        if isinstance(datasets, str):
+            with open(datasets) as fd:
+                datasets = [line.split('#')[0].strip() for line in fd]
+        return [dataset for dataset in dict.fromkeys(datasets) if dataset]
+
+    def _fetchDatasetInfo(self, dataset):
+        """
+        :return: A tuple (datasetName, list of DBS dataset records or the exception raised)
+        """
+        try:
+            # NOTE: By default DBS lists VALID datasets only
+            return dataset, self._threadApi().listDatasets(dataset=dataset, detail=True, dataset_access_type='*')
+        except Exception as ex:
+            return dataset, ex
+
+    def iterDatasetsInfo(self, datasets):
+        """
+        Look up the DBS records of many datasets concurrently
+        :param datasets: See readDatasets
+        :return:         A generator of tuples (datasetName, list of DBS records or exception), in input order
+        """
+        with ThreadPoolExecutor(max_workers=self.nThreads) as pool:
+            yield from pool.map(self._fetchDatasetInfo, self.readDatasets(datasets))
+
+    def getDatasetsInfo(self, datasets):
+        """
+        Batch version of getDatasetInfo
+        :return: A dictionary {datasetName: list of DBS records or exception}
+        """
+        return dict(self.iterDatasetsInfo(datasets))
+
+    @staticmethod
+    def _readCheckpoint(checkpointFile):
+        """
+        :return: A dictionary {datasetName: result record} out of a json lines checkpoint file
+        """
+        results = {}
+        if checkpointFile and os.path.exists(checkpointFile):
+            with open(checkpointFile) as fd:
+                for line in fd:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut by an interrupted run
+                        continue
+                    results[record['dataset']] = record
+        return results
+
+    def updateDatasetsStatus(self, datasets, status, rate=5.0, checkpointFile=None):
+        """
+        Batch version of updateDatasetStatus. Dataset info lookups run concurrently,
+        while the access type changes are applied one by one, at most `rate` per second.
+        Every result is appended to the checkpoint file as soon as it is known, and the
+        datasets already handled in a previous run with the same status are skipped.
+        :param datasets:       See readDatasets
+        :param status:         The new dataset access type
+        :param rate:           The maximum number of updates per second
+        :param checkpointFile: An optional path to a json lines checkpoint file
+        :return:               A per dataset report: {datasetName: {'dataset', 'status', 'result', 'previous', 'error'}}
+                               with result one of 'updated', 'unchanged', 'notFound', 'failed'
+        """
+        report = {}
+        previous = self._readCheckpoint(checkpointFile)
+        todo = []
+        for dataset in self.readDatasets(datasets):
+            record = previous.get(dataset)
+            if record and record['status'] == status and record['result'] != 'failed':
+                report[dataset] = record
+            else:
+                todo.append(dataset)
+        if report:
+            print(f"Resuming from checkpoint: {len(report)} datasets already done, {len(todo)} to go.")
+
+        rateLimiter = RateLimiter(rate)
+        checkpoint = open(checkpointFile, 'a') if checkpointFile else None
+        try:
+            for dataset, info in self.iterDatasetsInfo(todo):
+                record = {'dataset': dataset, 'status': status, 'result': None, 'previous': None, 'error': None}
+                if isinstance(info, Exception):
+                    record['result'], record['error'] = 'failed', str(info)
+                elif not info:
+                    record['result'] = 'notFound'
+                else:
+                    record['previous'] = info[0].get('dataset_access_type')
+                    if record['previous'] == status:
+                        record['result'] = 'unchanged'
+                    else:
+                        rateLimiter.wait()
+                        try:
+                            self.updateDatasetStatus(dataset, status)
+                            record['result'] = 'updated'
+                        except Exception as ex:
+                            record['result'], record['error'] = 'failed', str(ex)
+                report[dataset] = record
+                if checkpoint:
+                    checkpoint.write(json.dumps(record) + '\n')
+                    checkpoint.flush()
+        finally:
+            if checkpoint:
+                checkpoint.close()
+        summary = {}
+        for record in report.values():
+            summary[record['result']] = summary.get(record['result'], 0) + 1
+        print(f"Dataset status updates to {status}: {summary}")
+        return report
+
+
+class _PooledApi(object):
+    """
+    A DbsApi look alike dispatching every call to a client borrowed from a
+    pool of DbsApi instances. The size of the pool limits the number of calls
+    in flight. Failed calls are retried with an exponential backoff.
+    """
+
+    def __init__(self, apiFactory, poolSize, retries, backoff):
+        """
+        :param apiFactory: A callable with no arguments returning a new DBS client
+        """
+        self._pool = queue.LifoQueue()
+        for _ in range(poolSize):
+            # Every client keeps its own persistent HTTPS connection to DBS
+            self._pool.put(apiFactory())
+        self.retries = retries
+        self.backoff = backoff
+
+    def withoutRetries(self):
+        """
+        :return: A _PooledApi sharing the pool of this one, never retrying a failed call
+        """
+        pooledApi = _PooledApi.__new__(_PooledApi)
+        pooledApi.__dict__.update(self.__dict__, retries=0)
+        return pooledApi
+
+    def _call(self, methodName, *args, **kwargs):
+        attempt = 0
+        while True:
+            dbsApi = self._pool.get()
+            try:
+                return getattr(dbsApi, methodName)(*args, **kwargs)
+            except Exception as ex:
+                # NOTE: Client errors (4xx) are not going to succeed on a retry
+                code = getattr(ex, 'code', None)
+                if attempt >= self.retries or (isinstance(code, int) and 400 <= code < 500):
+                    raise
+                delay = self.backoff * 2 ** attempt
+                attempt += 1
+                print(f"DBS call {methodName} failed: {ex}. Retry {attempt}/{self.retries} in {delay:.1f} sec.")
+            finally:
+                self._pool.put(dbsApi)
+            time.sleep(delay)
+
+    def __getattr__(self, methodName):
+        if methodName.startswith('_'):
+            raise AttributeError(methodName)
+        return lambda *args, **kwargs: self._call(methodName, *args, **kwargs)
+
+
+class PooledDBSUpdater(DBSUpdater):
+    """
+    A DBSUpdater issuing its DBS calls concurrently: bulk status updates, file
+    children and file info lookups all go through a pool of persistent DBS
+    clients, with at most maxInFlight calls at a time, retried with a backoff.
+    The calls bisecting a failed bulk update are not retried: they are expected
+    to fail, and a retry would only multiply the calls made to find the bad lfns.
+    Use it as a context manager, or call close() to stop its worker threads.
+    """
+
+    def __init__(self, dbsUrl=None, chunkSize=100, maxInFlight=8, retries=3, backoff=1.0,
+                 apiFactory=DbsApi, cache=None, journal=None, metrics=None):
+        """
+        :param maxInFlight: The maximum number of concurrent DBS calls
+        :param retries:     The number of retries of a failed DBS call
+        :param backoff:     The delay in seconds before the first retry, doubled on every next one
+        See DBSUpdater for the rest of the parameters
+        """
+        self.maxInFlight = maxInFlight
+        self.retries = retries
+        self.backoff = backoff
+        super().__init__(dbsUrl, chunkSize=chunkSize, nThreads=maxInFlight, apiFactory=apiFactory,
+                         cache=cache, journal=journal, metrics=metrics)
+        self.updateConcurrency = maxInFlight
+        self._noRetryApi = self.dbsApi.withoutRetries()
+        self._executor = ThreadPoolExecutor(max_workers=maxInFlight)
+
+    def _mainApi(self):
+        return _PooledApi(self._newApi, self.maxInFlight, self.retries, self.backoff)
+
+    def _probeApi(self):
+        return self._noRetryApi
+
+    def _threadApi(self):
+        return self.dbsApi
+
+    def _mapChunks(self, func, chunks):
+        return self._executor.map(func, chunks)
+
+    def close(self):
+        """
+        Stop the worker threads
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+_GfalBenchmark_
+
+A benchmark harness for the tree traversal path used by the MSUnmerged
+standalone scripts. It runs a GfalTreeWalker with different walker strategies
+either against real gfal2 contexts or against a FakeGfal2Context with a
+configurable tree shape and per call latency, and measures:
+ * throughput in entries per second
+ * p50/p95/p99 latency per gfal2 call type
+ * the peak Python heap growth during every walk, traced with tracemalloc
+   in a separate, untimed walk
+The RSS high-water mark of the process only goes up over its lifetime, so it
+is not meaningful per run and is recorded once per report by dumpResults.
+"""
+
+import errno
+import json
+import logging
+import os
+import random
+import resource
+import stat
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+
+from Utils.GfalTreeWalker import GError, GfalTreeWalker
+
+
+# The walker strategies to compare. nCtx=None means: use the whole context pool
+STRATEGIES = {'sequential': {'nCtx': 1, 'useReadpp': False},
+              'concurrent': {'nCtx': None, 'useReadpp': False},
+              'concurrent-readpp': {'nCtx': None, 'useReadpp': True}}
+
+FakeStat = namedtuple('FakeStat', ['st_mode', 'st_size', 'st_mtime'])
+FakeDirent = namedtuple('FakeDirent', ['d_name'])
+
+
+class FakeGfal2Context(object):
+    """
+    A gfal2 context emulating a remote storage with a regular tree under
+    basePfn: every directory down to the given depth contains `fanout`
+    subdirectories named dir<N> and `filesPerDir` files named file<N>.root.
+    Every call sleeps for latency +/- jitter seconds before returning.
+    """
+
+    def __init__(self, basePfn, depth=3, fanout=4, filesPerDir=10, fileSize=1024,
+                 latency=0.0, jitter=0.0, supportsReadpp=True):
+        self.basePfn = basePfn.rstrip('/')
+        self.depth = depth
+        self.fanout = fanout
+        self.filesPerDir = filesPerDir
+        self.fileSize = fileSize
+        self.latency = latency
+        self.jitter = jitter
+        self.supportsReadpp = supportsReadpp
+        self._random = random.Random(0)
+
+    def _sleep(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _resolve(self, pfn):
+        """
+        Return ('dir', level) or ('file', level) for a Pfn from the emulated tree
+        """
+        pfn = pfn.rstrip('/')
+        if pfn == self.basePfn:
+            return 'dir', 0
+        if not pfn.startswith(self.basePfn + '/'):
+            raise GError("No such file or directory: %s" % pfn, errno.ENOENT)
+        parts = pfn[len(self.basePfn) + 1:].split('/')
+        for level, part in enumerate(parts):
+            isLast = level == len(parts) - 1
+            if part.startswith('dir') and part[3:].isdigit() and int(part[3:]) < self.fanout \
+                    and level < self.depth:
+                continue
+            if isLast and part.startswith('file') and part.endswith('.root') \
+                    and part[4:-5].isdigit() and int(part[4:-5]) < self.filesPerDir:
+                return 'file', level
+            raise GError("No such file or directory: %s" % pfn, errno.ENOENT)
+        return 'dir', len(parts)
+
+    def _entries(self, level):
+        entries = ['file%s.root' % num for num in range(self.filesPerDir)]
+        if level < self.depth:
+            entries.extend('dir%s' % num for num in range(self.fanout))
+        return entries
+
+    def _stat(self, pfn):
+        kind, _ = self._resolve(pfn)
+        if kind == 'dir':
+            return FakeStat(stat.S_IFDIR | 0o755, 0, 0)
+        return FakeStat(stat.S_IFREG | 0o644, self.fileSize, 0)
+
+    def stat(self, pfn):
+        self._sleep()
+        return self._stat(pfn)
+
+    def listdir(self, pfn):
+        self._sleep()
+        kind, level = self._resolve(pfn)
+        if kind != 'dir':
+            raise GError("Not a directory: %s" % pfn, errno.ENOTDIR)
+        return self._entries(level)
+
+    def opendir(self, pfn):
+        self._sleep()
+        if not self.supportsReadpp:
+            raise GError("Operation not supported", errno.EOPNOTSUPP)
+        kind, level = self._resolve(pfn)
+        if kind != 'dir':
+            raise GError("Not a directory: %s" % pfn, errno.ENOTDIR)
+        return _FakeGfal2Directory(self, pfn.rstrip('/') + '/', self._entries(level))
+
+    def countEntries(self):
+        """
+        Return the number of entries a full walk under basePfn is expected to find
+        """
+        numDirs = sum(self.fanout ** level for level in range(1, self.depth + 1))
+        return numDirs + self.filesPerDir * (numDirs + 1)
+
+
+class _FakeGfal2Directory(object):
+    """
+    The directory handle returned by FakeGfal2Context.opendir
+    """
+
+    def __init__(self, ctx, dirPfn, entries):
+        self.ctx = ctx
+        self.dirPfn = dirPfn
+        self.entries = iter(entries)
+
+    def readpp(self):
+        # The listing is returned in a single round trip, so no latency per entry
+        dirEntry = next(self.entries, None)
+        if dirEntry is None:
+            return None, None
+        return FakeDirent(dirEntry), self.ctx._stat(self.dirPfn + dirEntry)
+
+
+class TimedContext(object):
+    """
+    A thin wrapper around a gfal2 context recording the latency of every call
+    """
+
+    def __init__(self, ctx, callLatencies, lock):
+        """
+        :param ctx:           The gfal2 context to wrap
+        :param callLatencies: A dictionary {callName: [latencies]} to be filled
+        :param lock:          A lock protecting callLatencies
+        """
+        self.ctx = ctx
+        self.callLatencies = callLatencies
+        self.lock = lock
+
+    def _timed(self, callName, func, *args):
+        startTime = time.time()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.time() - startTime
+            with self.lock:
+                self.callLatencies.setdefault(callName, []).append(elapsed)
+
+    def stat(self, pfn):
+        return self._timed('stat', self.ctx.stat, pfn)
+
+    def listdir(self, pfn):
+        return self._timed('listdir', self.ctx.listdir, pfn)
+
+    def opendir(self, pfn):
+        # NOTE: The whole listing is accounted as a single opendir call
+        startTime = time.time()
+        try:
+            dirHandle = self.ctx.opendir(pfn)
+            entries = []
+            while True:
+                dirent, entryStat = dirHandle.readpp()
+                if dirent is None:
+                    break
+                entries.append((dirent, entryStat))
+            return _ListedDirectory(entries)
+        finally:
+            elapsed = time.time() - startTime
+            with self.lock:
+                self.callLatencies.setdefault('opendir', []).append(elapsed)
+
+
+class _ListedDirectory(object):
+    """
+    A directory handle serving an already completed readpp listing
+    """
+
+    def __init__(self, entries):
+        self.entries = iter(entries)
+
+    def readpp(self):
+        return next(self.entries, (None, None))
+
+
+def percentile(values, pct):
+    """
+    Return the nearest-rank percentile of a list of values
+    :param values: A list of numbers
+    :param pct:    The percentile to compute, in the range [0, 100]
+    :return:       The percentile value or None for an empty list
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+def peakRssMb():
+    """
+    Return the peak resident set size of the current process over its lifetime in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def tracedWalkPeak(walker, baseDirPfn):
+    """
+    Walk the tree under baseDirPfn with tracemalloc on and return the peak
+    growth of the Python heap during the walk, in MB. The peak is reset before
+    the walk, and a tracing started by the caller is left running.
+    """
+    ownTracing = not tracemalloc.is_tracing()
+    if ownTracing:
+        tracemalloc.start()
+    else:
+        tracemalloc.reset_peak()
+    tracedStart = tracemalloc.get_traced_memory()[0]
+    try:
+        for _ in walker.walk(baseDirPfn):
+            pass
+        return (tracemalloc.get_traced_memory()[1] - tracedStart) / 1024.0 / 1024.0
+    finally:
+        if ownTracing:
+            tracemalloc.stop()
+
+
+def benchmarkWalk(ctxPool, baseDirPfn, strategy='concurrent-readpp', traceMemory=True, logger=None):
+    """
+    Run a single tree walk under baseDirPfn and measure it.
+    :param ctxPool:     A list of gfal2 (or fake) contexts
+    :param baseDirPfn:  The Pfn of the baseDir starting point
+    :param strategy:    One of the STRATEGIES keys
+    :param traceMemory: Flag, if True measure the Python heap peak of the walk (see tracedWalkPeak).
+                        Tracing slows down every allocation, so this is done in a second,
+                        untimed walk, which doubles the load on the storage.
+    :param logger:      A logger to use for the output
+    :return:            A dictionary with the measurements
+    """
+    logger = logger or logging.getLogger(__name__)
+    if not isinstance(ctxPool, (list, tuple)):
+        ctxPool = [ctxPool]
+    strategyConf = STRATEGIES[strategy]
+    nCtx = strategyConf['nCtx'] or len(ctxPool)
+
+    callLatencies = {}
+    lock = threading.Lock()
+    timedPool = [TimedContext(ctx, callLatencies, lock) for ctx in ctxPool[:nCtx]]
+    walker = GfalTreeWalker(timedPool, useReadpp=strategyConf['useReadpp'], logger=logger)
+
+    numEntries = 0
+    startTime = time.time()
+    for _ in walker.walk(baseDirPfn):
+        numEntries += 1
+    elapsed = time.time() - startTime
+
+    tracedPeak = None
+    if traceMemory:
+        memWalker = GfalTreeWalker(ctxPool[:nCtx], useReadpp=strategyConf['useReadpp'], logger=logger)
+        tracedPeak = tracedWalkPeak(memWalker, baseDirPfn)
+
+    allLatencies = [latency for latencies in callLatencies.values() for latency in latencies]
+    latencyReport = {}
+    for callName, latencies in list(callLatencies.items()) + [('all', allLatencies)]:
+        latencyReport[callName] = {'calls': len(latencies),
+                                   'p50': percentile(latencies, 50),
+                                   'p95': percentile(latencies, 95),
+                                   'p99': percentile(latencies, 99)}
+    result = {'strategy': strategy,
+              'contexts': nCtx,
+              'entries': numEntries,
+              'elapsed': elapsed,
+              'entriesPerSec': numEntries / elapsed if elapsed else None,
+              'latency': latencyReport,
+              'listingStats': walker.getListingStats(),
+              'peakTracedMb': tracedPeak}
+    logger.info("Benchmark %s on %s: %s entries in %.3f sec", strategy, baseDirPfn, numEntries, elapsed)
+    return result
+
+
+def benchmarkProtocols(protoTargets, strategies=None, traceMemory=True, logger=None):
+    """
+    Benchmark all the given strategies for every protocol.
+    :param protoTargets: A dictionary {proto: (ctxPool, baseDirPfn)}
+    :param strategies:   A list of STRATEGIES keys. Default: all of them
+    :param traceMemory:  Flag, passed to benchmarkWalk
+    :param logger:       A logger to use for the output
+    :return:             A dictionary {proto: {strategy: measurements}}
+    """
+    strategies = strategies or sorted(STRATEGIES)
+    results = {}
+    for proto, (ctxPool, baseDirPfn) in protoTargets.items():
+        results[proto] = {}
+        for strategy in strategies:
+            results[proto][strategy] = benchmarkWalk(ctxPool, baseDirPfn, strategy=strategy,
+                                                     traceMemory=traceMemory, logger=logger)
+    return results
+
+
+def dumpResults(results, outputFile):
+    """
+    Write the benchmark results to a JSON file together with some run metadata
+    :param results:    The output of benchmarkProtocols
+    :param outputFile: The path to the JSON file to be written
+    """
+    report = {'timestamp': time.time(),
+              'host': os.uname()[1],
+              'processPeakRssMb': peakRssMb(),
+              'results': results}
+    with open(outputFile, 'w') as fd:
+        json.dump(report, fd, indent=4, sort_keys=True)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""
+_GfalTreeWalker_
+
+A concurrent, breadth-first directory tree walker built on top of a pool of
+gfal2 contexts. Every context from the pool is owned by a single worker thread,
+so up to len(ctxPool) listdir/stat calls are kept in flight at any time.
+
+The entries found are streamed back to the caller as TreeEntry records through
+a bounded results queue. If the caller consumes them slower than they are found,
+the worker threads block, so the memory footprint stays flat regardless of the
+size of the tree.
+
+Directories are listed with gfal2 opendir/readpp, which returns the stat
+information together with the entry names, wherever the protocol plugin
+supports it. For protocols which do not, the walker falls back to listdir plus
+a stat call per entry. Per protocol counters of the listings done and the stat
+calls saved are kept in the walker.
+"""
+
+import errno
+import logging
+import queue
+import stat
+import threading
+from collections import namedtuple
+
+try:
+    import gfal2
+    GError = gfal2.GError
+except ImportError:
+    # Without gfal2 only fake contexts can be walked, e.g. by GfalBenchmark
+    class GError(Exception):
+        """
+        A stand in for gfal2.GError
+        """
+        def __init__(self, message, code=0):
+            super(GError, self).__init__(message)
+            self.message = message
+            self.code = code
+
+
+# Marker put on the results queue by every worker thread when it exits
+_WORKER_DONE = object()
+
+# A single record per directory entry found during the walk
+TreeEntry = namedtuple('TreeEntry', ['pfn', 'isDir', 'size', 'mtime'])
+
+# gfal2 error codes meaning a plugin does not implement readpp
+_READPP_NOT_SUPPORTED = (errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+
+def pfnProtocol(pfn):
+    """
+    Return the protocol (the url scheme) of a Pfn, e.g. 'srm', 'root', 'davs'
+    """
+    if '://' in pfn:
+        return pfn.split('://', 1)[0]
+    return 'file'
+
+
+def makeTreeEntry(pfn, entryStat):
+    """
+    Build a TreeEntry record out of a Pfn and its stat result
+    :param pfn:       The Pfn of the entry
+    :param entryStat: The gfal2 stat object for the entry
+    :return:          A TreeEntry namedtuple
+    """
+    return TreeEntry(pfn, stat.S_ISDIR(entryStat.st_mode), entryStat.st_size, entryStat.st_mtime)
+
+
+class GfalTreeWalker(object):
+    """
+    Walks the tree under a base directory Pfn level by level. Directories yet
+    to be listed are kept in a bounded frontier queue shared between all the
+    worker threads. If the frontier is full, the worker who found the
+    directory keeps it on its own local stack and lists it itself, so the
+    memory used for the frontier never grows above maxFrontier entries.
+    """
+
+    def __init__(self, ctxPool, maxFrontier=10000, maxResults=10000, pollInterval=0.1,
+                 useReadpp=True, logger=None):
+        """
+        :param ctxPool:      A gfal2 context or a list of gfal2 contexts. One worker
+                             thread is started per context.
+        :param maxFrontier:  The maximum number of directories waiting to be listed
+        :param maxResults:   The maximum number of entries found but not yet consumed
+        :param pollInterval: The time (in seconds) an idle worker waits on the frontier
+                             before rechecking for walk completion or cancellation
+        :param useReadpp:    Flag, if False always list with listdir and a stat per entry
+        :param logger:       A logger to use for the output
+        """
+        if not isinstance(ctxPool, (list, tuple)):
+            ctxPool = [ctxPool]
+        if not ctxPool:
+            raise ValueError("GfalTreeWalker needs at least one gfal2 context")
+        self.ctxPool = list(ctxPool)
+        self.maxFrontier = maxFrontier
+        self.maxResults = maxResults
+        self.pollInterval = pollInterval
+        self.useReadpp = useReadpp
+        self.logger = logger or logging.getLogger(__name__)
+        self._halt = threading.Event()
+        self._cancelled = threading.Event()
+        self._statsLock = threading.Lock()
+        # Protocols for which readpp was found not to be supported
+        self._noReadpp = set()
+        self.listingStats = {}
+
+    def getListingStats(self):
+        """
+        Return a copy of the per protocol listing counters in the form:
+        {proto: {'readppListings': int, 'fallbackListings': int, 'statCalls': int, 'statsSaved': int}}
+        """
+        with self._statsLock:
+            return {proto: dict(counters) for proto, counters in self.listingStats.items()}
+
+    def _updateListingStats(self, proto, **counts):
+        """
+        Add the counts from a single directory listing to the protocol counters
+        """
+        with self._statsLock:
+            counters = self.listingStats.setdefault(proto, {'readppListings': 0, 'fallbackListings': 0,
+                                                            'statCalls': 0, 'statsSaved': 0})
+            for counter, value in counts.items():
+                counters[counter] += value
+
+    def cancel(self):
+        """
+        Signal all worker threads to stop at the first possible moment.
+        The generator returned by walk() finishes right after that.
+        """
+        self._cancelled.set()
+        self._halt.set()
+
+    def walk(self, baseDirPfn, haltAtBottom=False):
+        """
+        Traverse the tree under baseDirPfn and yield a record for every directory
+        and file found.
+        :param baseDirPfn:   The Pfn of the baseDir starting point
+        :param haltAtBottom: Flag, if True stop the walk at the moment the first fileEntry is found
+        :return:             A generator over TreeEntry records: (pfn, isDir, size, mtime)
+        """
+        self._halt.clear()
+        self._cancelled.clear()
+
+        # First test if baseDirPfn is actually a directory entry:
+        try:
+            self.logger.info("Stat baseDirPfn: %s", baseDirPfn)
+            entryStat = self.ctxPool[0].stat(baseDirPfn)
+        except GError as gfalExc:
+            if gfalExc.code == errno.ENOENT:
+                self.logger.warning("MISSING baseDir: %s", baseDirPfn)
+            else:
+                self.logger.error("FAILED to open baseDir: %s: gfalException: %s", baseDirPfn, str(gfalExc))
+            return
+        if not stat.S_ISDIR(entryStat.st_mode):
+            self.logger.info("walk called with a fileEntry: %s", baseDirPfn)
+            yield makeTreeEntry(baseDirPfn, entryStat)
+            return
+
+        walkState = {'pending': 1, 'error': None, 'lock': threading.Lock()}
+        frontier = queue.Queue(maxsize=self.maxFrontier)
+        results = queue.Queue(maxsize=self.maxResults)
+        frontier.put(baseDirPfn)
+
+        threadList = []
+        for ctxNum, ctx in enumerate(self.ctxPool):
+            thread = threading.Thread(name="TreeWalker%s" % ctxNum, target=self._worker,
+                                      args=(ctx, frontier, results, walkState, haltAtBottom),
+                                      daemon=True)
+            thread.start()
+            threadList.append(thread)
+
+        finished = 0
+        try:
+            while finished < len(threadList) and not self._cancelled.is_set():
+                entry = results.get()
+                if entry is _WORKER_DONE:
+                    finished += 1
+                    continue
+                yield entry
+        finally:
+            # Covers both the normal end of the walk and an early close of the generator.
+            # Keep draining the results queue, so no worker is left blocked on it.
+            self._halt.set()
+            for thread in threadList:
+                while thread.is_alive():
+                    self._drain(results)
+                    thread.join(self.pollInterval)
+
+        if walkState['error'] is not None:
+            raise walkState['error']
+
+    @staticmethod
+    def _drain(results):
+        """
+        Discard everything currently waiting in the results queue
+        """
+        try:
+            while True:
+                results.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _putResult(self, results, entry):
+        """
+        Put an entry on the bounded results queue, blocking while it is full,
+        unless the walk gets halted meanwhile.
+        :return: True if the entry was queued, False if the walk was halted
+        """
+        while not self._halt.is_set():
+            try:
+                results.put(entry, timeout=self.pollInterval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, ctx, frontier, results, walkState, haltAtBottom):
+        """
+        The worker thread body. Takes directories from the frontier (or from its
+        own local stack), lists them and feeds the results queue.
+        """
+        localStack = []
+        try:
+            while not self._halt.is_set():
+                if localStack:
+                    dirPfn = localStack.pop()
+                else:
+                    try:
+                        dirPfn = frontier.get(timeout=self.pollInterval)
+                    except queue.Empty:
+                        with walkState['lock']:
+                            if walkState['pending'] == 0:
+                                break
+                        continue
+                try:
+                    self._listDir(ctx, dirPfn, frontier, localStack, results, walkState, haltAtBottom)
+                except Exception as exc:
+                    # Any failure stops the whole walk and is raised from walk(),
+                    # so a partial listing is never taken for a complete one
+                    with walkState['lock']:
+                        if walkState['error'] is None:
+                            walkState['error'] = exc
+                    self._halt.set()
+                finally:
+                    with walkState['lock']:
+                        walkState['pending'] -= 1
+        finally:
+            results.put(_WORKER_DONE)
+
+    def _readDirPlus(self, ctx, dirPfn):
+        """
+        List a directory through opendir/readpp.
+        :return: A list of (dirEntry, entryStat) tuples or None if readpp is not
+                 supported for the current protocol
+        """
+        if not hasattr(ctx, 'opendir'):
+            return None
+        try:
+            dirHandle = ctx.opendir(dirPfn)
+            if not hasattr(dirHandle, 'readpp'):
+                return None
+            dirEntryList = []
+            while True:
+                dirent, entryStat = dirHandle.readpp()
+                if dirent is None:
+                    break
+                dirEntryList.append((dirent.d_name, entryStat))
+            return dirEntryList
+        except GError as gfalExc:
+            if gfalExc.code in _READPP_NOT_SUPPORTED:
+                return None
+            raise
+
+    def _listDir(self, ctx, dirPfn, frontier, localStack, results, walkState, haltAtBottom):
+        """
+        List a single directory and stat all of its entries, unless the stat
+        information was already returned by the listing itself.
+        """
+        if dirPfn[-1] != '/':
+            dirPfn += '/'
+        proto = pfnProtocol(dirPfn)
+        dirEntryList = None
+        try:
+            self.logger.info("Listing dirPfn: %s", dirPfn)
+            if self.useReadpp and proto not in self._noReadpp:
+                dirEntryList = self._readDirPlus(ctx, dirPfn)
+                if dirEntryList is None:
+                    self.logger.info("readpp not supported for protocol: %s. Falling back to listdir + stat.", proto)
+                    self._noReadpp.add(proto)
+            if dirEntryList is None:
+                dirEntryList = [(dirEntry, None) for dirEntry in ctx.listdir(dirPfn)]
+                self._updateListingStats(proto, fallbackListings=1)
+            else:
+                self._updateListingStats(proto, readppListings=1)
+        except GError as gfalExc:
+            self.logger.error("gfal Exception raised while listing %s. GError: %s", dirPfn, str(gfalExc))
+            raise
+
+        statCalls = statsSaved = 0
+        for dirEntry, entryStat in dirEntryList:
+            if self._halt.is_set():
+                break
+            if dirEntry in ['.', '..']:
+                continue
+            dirEntryPfn = dirPfn + dirEntry
+            if entryStat is not None:
+                statsSaved += 1
+            else:
+                try:
+                    self.logger.debug("Stat dirEntryPfn: %s", dirEntryPfn)
+                    statCalls += 1
+                    entryStat = ctx.stat(dirEntryPfn)
+                except GError as gfalExc:
+                    if gfalExc.code == errno.ENOENT:
+                        self.logger.warning("MISSING dirEntry: %s", dirEntryPfn)
+                    else:
+                        self.logger.error("FAILED to open dirEntry: %s: gfalException: %s", dirEntryPfn, str(gfalExc))
+                    continue
+
+            entry = makeTreeEntry(dirEntryPfn, entryStat)
+            if not self._putResult(results, entry):
+                break
+            if entry.isDir:
+                with walkState['lock']:
+                    walkState['pending'] += 1
+                try:
+                    frontier.put_nowait(dirEntryPfn)
+                except queue.Full:
+                    localStack.append(dirEntryPfn)
+            elif haltAtBottom:
+                self.logger.info("Found file: %s", dirEntry)
+                self._halt.set()
+                break
+        self._updateListingStats(proto, statCalls=statCalls, statsSaved=statsSaved)
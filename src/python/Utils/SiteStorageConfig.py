@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+_SiteStorageConfig_
+
+A cache of the site storage configurations (SITECONF/<site>/storage.json).
+Every storage.json is parsed once into a flat (rse, protocol) -> pfnPrefix
+index. Entries are revalidated against the file mtime at most once per
+checkInterval seconds, and all sites can be preloaded in bulk, in parallel.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StorageConfigCache(object):
+    """
+    Resolves Pfn prefixes per (rse, protocol) from the site storage.json files
+    """
+
+    def __init__(self, siteConfRoot='/cvmfs/cms.cern.ch/SITECONF', checkInterval=60, logger=None):
+        """
+        :param siteConfRoot:  The root directory of the site configurations
+        :param checkInterval: The minimum time (in seconds) between two mtime checks
+                              of the same storage.json file
+        :param logger:        A logger to use for the output
+        """
+        self.siteConfRoot = siteConfRoot
+        self.checkInterval = checkInterval
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # (rseName, proto) -> pfnPrefix
+        self._prefixes = {}
+        # rseName -> {'mtime': float or None, 'checked': float, 'protos': [proto]}
+        self._sites = {}
+
+    def configPath(self, rseName):
+        """
+        Return the path to the storage.json file of a site
+        """
+        return os.path.join(self.siteConfRoot, rseName, 'storage.json')
+
+    @staticmethod
+    def _getMtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _load(self, rseName):
+        """
+        Parse the storage.json of a site and (re)build its part of the index.
+        NOTE: As the per site lookups used so far, only the first storage
+              volume defined in the file is considered and, for protocols
+              defined more than once, the last prefix wins.
+        """
+        configPath = self.configPath(rseName)
+        mtime = self._getMtime(configPath)
+        sitePrefixes = {}
+        try:
+            with open(configPath, 'r') as storageConfigFile:
+                storageConfig = json.load(storageConfigFile)
+            for protoConfig in storageConfig[0]['protocols']:
+                if 'prefix' in protoConfig:
+                    sitePrefixes[protoConfig['protocol']] = protoConfig['prefix']
+        except Exception as ex:
+            self.logger.error("Could not open Storage Config File for site: %s. Error: %s", rseName, str(ex))
+
+        with self._lock:
+            self._dropSite(rseName)
+            for proto, pfnPrefix in sitePrefixes.items():
+                self._prefixes[(rseName, proto)] = pfnPrefix
+            self._sites[rseName] = {'mtime': mtime, 'checked': time.time(), 'protos': list(sitePrefixes)}
+        return sitePrefixes
+
+    def _dropSite(self, rseName):
+        """
+        Drop the index entries of a site. Must be called with the lock held.
+        """
+        siteInfo = self._sites.pop(rseName, None)
+        if siteInfo:
+            for proto in siteInfo['protos']:
+                self._prefixes.pop((rseName, proto), None)
+
+    def _isFresh(self, rseName):
+        """
+        Check if the cached entries of a site are still valid, looking at the
+        storage.json mtime only if checkInterval has passed since the last check.
+        """
+        with self._lock:
+            siteInfo = self._sites.get(rseName)
+            if siteInfo is None:
+                return False
+            if time.time() - siteInfo['checked'] < self.checkInterval:
+                return True
+        mtime = self._getMtime(self.configPath(rseName))
+        with self._lock:
+            if mtime != siteInfo['mtime']:
+                return False
+            siteInfo['checked'] = time.time()
+        return True
+
+    def getPfnPrefix(self, rseName, proto):
+        """
+        Return the Pfn prefix of a site for the given protocol
+        :param rseName: The site name
+        :param proto:   The protocol name, e.g. 'SRMv2', 'XRootD', 'WebDAV'
+        :return:        The Pfn prefix or None if not defined
+        """
+        if not self._isFresh(rseName):
+            self._load(rseName)
+        with self._lock:
+            return self._prefixes.get((rseName, proto))
+
+    def preload(self, rseNames=None, nThreads=8):
+        """
+        Load the storage configuration of many sites at once
+        :param rseNames: A list of site names. Default: all sites under siteConfRoot
+        :param nThreads: The number of parallel loads
+        :return:         The number of sites loaded
+        """
+        if rseNames is None:
+            try:
+                rseNames = [rseName for rseName in os.listdir(self.siteConfRoot)
+                            if os.path.isfile(self.configPath(rseName))]
+            except OSError as ex:
+                self.logger.error("Could not list the site configurations at: %s. Error: %s",
+                                  self.siteConfRoot, str(ex))
+                return 0
+        with ThreadPoolExecutor(max_workers=nThreads) as executor:
+            list(executor.map(self._load, rseNames))
+        self.logger.info("Preloaded the storage configuration of %s sites", len(rseNames))
+        return len(rseNames)
+
+    def invalidate(self, rseName=None):
+        """
+        Drop the cached entries of a single site or of all sites
+        """
+        with self._lock:
+            if rseName is None:
+                self._prefixes.clear()
+                self._sites.clear()
+                return
+            self._dropSite(rseName)
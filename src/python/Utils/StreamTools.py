@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+_StreamTools_
+
+Helpers for consuming large text payloads (e.g. the RucioConMon file lists)
+incrementally, chunk by chunk, without ever holding the whole payload in memory.
+"""
+
+import zlib
+
+
+# Magic bytes at the beginning of a gzip stream
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def iterDecompressed(chunks, compressed=None):
+    """
+    Decompress a stream of byte chunks on the fly
+    :param chunks:     An iterable of bytes objects
+    :param compressed: True to force gzip/zlib decompression, False to disable it,
+                       None to detect a gzip stream from its first bytes
+    :return:           A generator of (decompressed) bytes objects
+    """
+    decompressor = None
+    firstChunk = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if firstChunk:
+            firstChunk = False
+            if compressed is None:
+                compressed = chunk[:2] == GZIP_MAGIC
+            if compressed:
+                # wbits=32 + MAX_WBITS accepts both gzip and zlib headers
+                decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+            if chunk:
+                yield chunk
+        else:
+            yield chunk
+    if decompressor:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+def iterLines(chunks, compressed=None, encoding='utf-8'):
+    """
+    Split a stream of byte chunks into text lines, decompressing it if needed.
+    Lines split between two chunks are glued back together. Empty lines are skipped.
+    :param chunks:     An iterable of bytes objects
+    :param compressed: See iterDecompressed
+    :param encoding:   The text encoding of the payload
+    :return:           A generator of stripped, non empty lines
+    """
+    remainder = b''
+    for chunk in iterDecompressed(chunks, compressed=compressed):
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line.decode(encoding)
+    remainder = remainder.strip()
+    if remainder:
+        yield remainder.decode(encoding)
+
+
+def iterFileChunks(fileObj, chunkSize=1024 * 1024):
+    """
+    Read a file like object (e.g. an HTTP response) in chunks of chunkSize bytes
+    """
+    return iter(lambda: fileObj.read(chunkSize), b'')
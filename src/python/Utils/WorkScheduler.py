@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+_WorkScheduler_
+
+A thread pool fed from a single shared priority queue. Every unit of work
+submitted (e.g. all the files under a single fileGen path) is split into
+chunks of a fixed size, so a single huge unit is spread over all the worker
+threads instead of keeping one of them busy while the rest sit idle. Chunks
+coming from bigger units are served first, which keeps the tail of the run short.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+
+class ChunkedWorkScheduler(object):
+    """
+    Distributes chunks of work between nWorkers threads through one shared
+    priority queue and keeps per thread utilisation metrics.
+    """
+
+    def __init__(self, workFunc, nWorkers=10, chunkSize=100, resourceFactory=None, logger=None):
+        """
+        :param workFunc:        A function called as workFunc(resource, key, chunk) for every chunk
+        :param nWorkers:        The number of worker threads
+        :param chunkSize:       The maximum number of items per chunk
+        :param resourceFactory: An optional function creating a per thread resource
+                                (e.g. a gfal2 context), which is passed to workFunc
+        :param logger:          A logger to use for the output
+        """
+        self.workFunc = workFunc
+        self.nWorkers = nWorkers
+        self.chunkSize = chunkSize
+        self.resourceFactory = resourceFactory
+        self.logger = logger or logging.getLogger(__name__)
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._threads = []
+        self._metricsLock = threading.Lock()
+        self._startTime = None
+        self.threadMetrics = {}
+
+    def submit(self, key, items):
+        """
+        Split a unit of work into chunks and put them on the shared queue
+        :param key:   An identifier of the unit of work (passed to workFunc)
+        :param items: A list of items to be processed
+        :return:      The number of chunks created
+        """
+        items = list(items)
+        # Bigger units get higher priority (lower value)
+        priority = -len(items)
+        numChunks = 0
+        for idx in range(0, len(items), self.chunkSize):
+            self._queue.put((priority, next(self._counter), key, items[idx:idx + self.chunkSize]))
+            numChunks += 1
+        return numChunks
+
+    def start(self):
+        """
+        Start the worker threads
+        """
+        self._startTime = time.time()
+        for workerNum in range(self.nWorkers):
+            threadName = "Worker%s" % workerNum
+            with self._metricsLock:
+                self.threadMetrics[threadName] = {'busyTime': 0.0, 'idleTime': 0.0, 'chunks': 0,
+                                                  'items': 0, 'errors': 0}
+            thread = threading.Thread(name=threadName, target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        """
+        Block until all the chunks submitted so far are processed
+        """
+        self._queue.join()
+
+    def stop(self):
+        """
+        Wait for the queued work to finish and stop all the worker threads
+        """
+        self.join()
+        for _ in self._threads:
+            # The stop sentinels go behind any work with the lowest priority
+            self._queue.put((float('inf'), next(self._counter), None, _STOP))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _worker(self):
+        """
+        The worker thread body
+        """
+        threadName = threading.current_thread().name
+        resource = self.resourceFactory() if self.resourceFactory else None
+        while True:
+            waitStart = time.time()
+            _, _, key, chunk = self._queue.get()
+            workStart = time.time()
+            if chunk is _STOP:
+                self._queue.task_done()
+                break
+            errors = 0
+            try:
+                self.workFunc(resource, key, chunk)
+            except Exception as ex:
+                errors = 1
+                self.logger.error("%s: Failed to process a chunk of %s items from %s. Error: %s",
+                                  threadName, len(chunk), key, str(ex))
+            finally:
+                workEnd = time.time()
+                with self._metricsLock:
+                    metrics = self.threadMetrics[threadName]
+                    metrics['idleTime'] += workStart - waitStart
+                    metrics['busyTime'] += workEnd - workStart
+                    metrics['chunks'] += 1
+                    metrics['items'] += len(chunk)
+                    metrics['errors'] += errors
+                self._queue.task_done()
+
+    def getMetrics(self):
+        """
+        Return the per thread metrics together with the utilisation of every
+        thread and of the pool as a whole (busy time over wall clock time).
+        """
+        wallTime = time.time() - self._startTime if self._startTime else 0.0
+        with self._metricsLock:
+            threadMetrics = {name: dict(metrics) for name, metrics in self.threadMetrics.items()}
+        totalBusy = 0.0
+        for metrics in threadMetrics.values():
+            metrics['utilisation'] = metrics['busyTime'] / wallTime if wallTime else 0.0
+            totalBusy += metrics['busyTime']
+        poolUtilisation = totalBusy / (wallTime * len(threadMetrics)) if wallTime and threadMetrics else 0.0
+        return {'wallTime': wallTime,
+                'queued': self._queue.qsize(),
+                'poolUtilisation': poolUtilisation,
+                'threads': threadMetrics}
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Unittests for the AsyncGfal module
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+
+from Utils.AsyncGfal import AsyncGfal2
+
+
+class CountingContext(object):
+    """
+    A fake gfal2 context counting the calls in flight per Pfn prefix
+    """
+    lock = threading.Lock()
+    inFlight = {}
+    maxInFlight = {}
+    contexts = 0
+
+    def __init__(self):
+        with self.lock:
+            CountingContext.contexts += 1
+
+    def _call(self, pfn):
+        key = pfn.split('/')[2]
+        with self.lock:
+            self.inFlight[key] = self.inFlight.get(key, 0) + 1
+            self.maxInFlight[key] = max(self.maxInFlight.get(key, 0), self.inFlight[key])
+        time.sleep(0.005)
+        with self.lock:
+            self.inFlight[key] -= 1
+        if pfn.endswith('bad'):
+            raise IOError("Failed: %s" % pfn)
+        return pfn
+
+    def stat(self, pfn):
+        return self._call(pfn)
+
+    def unlink(self, pfn):
+        return self._call(pfn)
+
+
+class AsyncGfal2Tests(unittest.TestCase):
+    """
+    unittest for the AsyncGfal2 class
+    """
+
+    def setUp(self):
+        CountingContext.inFlight = {}
+        CountingContext.maxInFlight = {}
+        CountingContext.contexts = 0
+
+    def testLimits(self):
+        """
+        Test the per RSE limits and the global cap on contexts
+        """
+        asyncGfal = AsyncGfal2(CountingContext, maxWorkers=8, rseLimit=3)
+
+        async def runAll():
+            tasks = []
+            for rseName in ['T2_A', 'T2_B']:
+                for num in range(30):
+                    tasks.append(asyncGfal.stat(rseName, 'davs://%s/store/file%s' % (rseName, num)))
+            return await asyncio.gather(*tasks)
+
+        results = asyncio.run(runAll())
+        asyncGfal.shutdown()
+        self.assertEqual(len(results), 60)
+        self.assertEqual(CountingContext.maxInFlight['T2_A'], 3)
+        self.assertEqual(CountingContext.maxInFlight['T2_B'], 3)
+        self.assertLessEqual(CountingContext.contexts, 8)
+
+    def testProtoLimit(self):
+        """
+        Test the per protocol limits
+        """
+        asyncGfal = AsyncGfal2(CountingContext, maxWorkers=10, rseLimit=10, protoLimit={'root': 2})
+
+        async def runAll():
+            tasks = [asyncGfal.stat('T2_A', 'root://rootHost/store/file%s' % num) for num in range(20)]
+            tasks += [asyncGfal.stat('T2_A', 'davs://davsHost/store/file%s' % num) for num in range(20)]
+            return await asyncio.gather(*tasks)
+
+        asyncio.run(runAll())
+        asyncGfal.shutdown()
+        self.assertEqual(CountingContext.maxInFlight['rootHost'], 2)
+        self.assertGreater(CountingContext.maxInFlight['davsHost'], 2)
+
+    def testMapCalls(self):
+        """
+        Test mapCalls over a Pfn generator with failures
+        """
+        asyncGfal = AsyncGfal2(CountingContext, maxWorkers=4, rseLimit=4)
+        pfnGen = ('davs://T2_A/store/file%s%s' % (num, 'bad' if num % 10 == 0 else '') for num in range(50))
+
+        async def runAll():
+            return [item async for item in asyncGfal.mapCalls('T2_A', 'unlink', pfnGen, window=5)]
+
+        results = asyncio.run(runAll())
+        asyncGfal.shutdown()
+        self.assertEqual(len(results), 50)
+        failed = [pfn for pfn, result in results if isinstance(result, Exception)]
+        self.assertEqual(len(failed), 5)
+        self.assertTrue(all(pfn.endswith('bad') for pfn in failed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Unittests for the DBSJournal module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Utils.DBSJournal import DBSJournal, lfnDigest
+
+
+class DBSJournalTests(unittest.TestCase):
+    """
+    unittest for the DBSJournal class
+    """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.journalFile = os.path.join(self.tmpDir, 'journal.txt')
+        self.lfns = ['/store/data/Era/PD/RAW/v1/000/file%s.root' % num for num in range(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testReplay(self):
+        """
+        Test the journal is replayed on restart and later updates supersede earlier ones
+        """
+        journal = DBSJournal(self.journalFile)
+        journal.record(self.lfns[:6], 0)
+        journal.record(self.lfns[4:6], 1)
+        journal.close()
+        with open(self.journalFile, 'a') as fd:
+            fd.write('0\t/store/data/cut')
+
+        journal = DBSJournal(self.journalFile)
+        self.assertEqual(len(journal), 7)
+        self.assertTrue(journal.isDone(self.lfns[0], 0))
+        self.assertFalse(journal.isDone(self.lfns[4], 0))
+        self.assertTrue(journal.isDone(self.lfns[4], 1))
+        self.assertEqual(journal.filterPending(self.lfns, 0), self.lfns[4:])
+        journal.close()
+
+    def testDigest(self):
+        """
+        Test the lfn digests are 64 bit integers
+        """
+        digest = lfnDigest(self.lfns[0])
+        self.assertEqual(digest, lfnDigest(self.lfns[0]))
+        self.assertNotEqual(digest, lfnDigest(self.lfns[1]))
+        self.assertLess(digest, 2 ** 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Unittests for the DBSLineageCache module
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from Utils.DBSLineageCache import DBSLineageCache
+
+
+class DBSLineageCacheTests(unittest.TestCase):
+    """
+    unittest for the DBSLineageCache class
+    """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.dbPath = os.path.join(self.tmpDir, 'lineage.db')
+        self.cache = DBSLineageCache(self.dbPath, ttl=60)
+        self.dataset = '/PD/Era-v1/RAW'
+        self.lfns = ['/store/data/Era/PD/RAW/v1/000/file%s.root' % num for num in range(3)]
+        self.children = {self.lfns[0]: ['/store/data/Era/PD/AOD/v1/000/child0.root'],
+                         self.lfns[1]: [],
+                         self.lfns[2]: ['/store/data/Era/PD/AOD/v1/000/child1.root',
+                                        '/store/data/Era/PD/AOD/v1/000/child2.root']}
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpDir)
+
+    def testRoundTrip(self):
+        """
+        Test dataset files and children are stored and read back, also across connections
+        """
+        self.assertIsNone(self.cache.getDatasetFiles(self.dataset))
+        self.assertEqual(self.cache.getChildren(self.lfns), {})
+        self.cache.putDatasetFiles(self.dataset, self.lfns)
+        self.cache.putChildren(self.children)
+        self.cache.close()
+        self.cache = DBSLineageCache(self.dbPath, ttl=60)
+        self.assertEqual(self.cache.getDatasetFiles(self.dataset), self.lfns)
+        self.assertEqual(self.cache.getChildren(self.lfns + ['/store/data/other.root']), self.children)
+        # Replacing an entry drops the old children
+        self.cache.putChildren({self.lfns[0]: []})
+        self.assertEqual(self.cache.getChildren(self.lfns[:1]), {self.lfns[0]: []})
+
+    def testExpiry(self):
+        """
+        Test entries older than the TTL are ignored and dropped on invalidation
+        """
+        self.cache.putDatasetFiles(self.dataset, self.lfns)
+        self.cache.putChildren(self.children)
+        self.cache.ttl = -1
+        self.assertIsNone(self.cache.getDatasetFiles(self.dataset))
+        self.assertEqual(self.cache.getChildren(self.lfns), {})
+        self.assertEqual(len(self.cache.exportGraph()['children']), 3)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.exportGraph(), {'datasets': {}, 'children': {}})
+
+        self.cache.ttl = 60
+        self.cache.putChildren(self.children)
+        self.cache.invalidate(lfns=self.lfns[:1])
+        self.assertEqual(sorted(self.cache.getChildren(self.lfns)), self.lfns[1:])
+
+    def testExportGraph(self):
+        """
+        Test the graph export
+        """
+        self.cache.putDatasetFiles(self.dataset, self.lfns)
+        self.cache.putChildren(self.children)
+        outputFile = os.path.join(self.tmpDir, 'graph.json')
+        graph = self.cache.exportGraph(outputFile)
+        self.assertEqual(graph, {'datasets': {self.dataset: self.lfns}, 'children': self.children})
+        with open(outputFile) as fd:
+            self.assertEqual(json.load(fd), graph)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Unittests for the DBSMetrics module
+"""
+
+import unittest
+
+from urllib.request import urlopen
+
+from Utils.DBSMetrics import MetricsRegistry, InstrumentedApi, startMetricsServer
+
+
+class FakeApi(object):
+    def listFileArray(self, **kwargs):
+        return []
+
+    def updateFileStatus(self, **kwargs):
+        raise RuntimeError("Service unavailable")
+
+
+class DBSMetricsTests(unittest.TestCase):
+    """
+    unittest for the metrics registry and the instrumented DBS client
+    """
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def testExposition(self):
+        """
+        Test the Prometheus text exposition of all metric types
+        """
+        self.registry.counter('calls_total', 'Calls').inc(method='listFileArray')
+        self.registry.counter('calls_total').inc(2, method='listFileArray')
+        self.registry.gauge('pending', 'Pending work').set(5)
+        self.registry.gauge('pending').dec()
+        histogram = self.registry.histogram('duration_seconds', 'Durations', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 2.0):
+            histogram.observe(value, method='x')
+        self.assertEqual(self.registry.counter('calls_total').get(method='listFileArray'), 3)
+        self.assertEqual(histogram.get(method='x'), (3, 2.55))
+        self.assertRaises(ValueError, self.registry.gauge, 'calls_total')
+        self.assertEqual(self.registry.expose().splitlines(), [
+            '# HELP calls_total Calls',
+            '# TYPE calls_total counter',
+            'calls_total{method="listFileArray"} 3',
+            '# HELP duration_seconds Durations',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{method="x",le="0.1"} 1',
+            'duration_seconds_bucket{method="x",le="1.0"} 2',
+            'duration_seconds_bucket{method="x",le="+Inf"} 3',
+            'duration_seconds_sum{method="x"} 2.55',
+            'duration_seconds_count{method="x"} 3',
+            '# HELP pending Pending work',
+            '# TYPE pending gauge',
+            'pending 4'])
+
+    def testInstrumentedApi(self):
+        """
+        Test DBS calls, errors and latencies are recorded and served over HTTP
+        """
+        dbsApi = InstrumentedApi(FakeApi(), self.registry)
+        self.assertEqual(dbsApi.listFileArray(dataset='/a/b/c'), [])
+        self.assertRaises(RuntimeError, dbsApi.updateFileStatus, logical_file_name='/store/a')
+        self.assertEqual(self.registry.counter('dbs_calls_total').get(method='listFileArray'), 1)
+        self.assertEqual(self.registry.counter('dbs_call_errors_total').get(method='updateFileStatus'), 1)
+        self.assertEqual(self.registry.histogram('dbs_call_duration_seconds').get(method='updateFileStatus')[0], 1)
+
+        server = startMetricsServer(self.registry, port=0)
+        try:
+            # Only the local host can scrape the metrics by default
+            self.assertEqual(server.server_address[0], '127.0.0.1')
+            with urlopen('http://127.0.0.1:%s/metrics' % server.server_address[1]) as response:
+                self.assertEqual(response.read().decode('utf-8'), self.registry.expose())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
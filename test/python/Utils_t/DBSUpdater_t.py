@@ -0,0 +1,559 @@
+#!/usr/bin/env python
+"""
+Unittests for the DBSUpdater module
+"""
+
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+
+from Utils.DBSJournal import DBSJournal
+from Utils.DBSMetrics import MetricsRegistry
+from Utils.DBSLineageCache import DBSLineageCache
+from Utils.DBSUpdater import DBSUpdater, PooledDBSUpdater, RateLimiter, classifyEntries, classifyEntry
+
+
+class FakeDbsApi(object):
+    """
+    A minimal in memory stand in for the DbsApi client
+    """
+
+    def __init__(self, files=None, children=None, badLfns=None, supportsBulk=True):
+        """
+        :param files:        A dictionary {dataset: [lfn]}
+        :param children:     A dictionary {lfn: [child lfn]}
+        :param badLfns:      A set of lfns failing any status update
+        :param supportsBulk: False to make every multi lfn update fail
+        """
+        self.files = files or {}
+        self.children = children or {}
+        self.badLfns = set(badLfns or [])
+        self.supportsBulk = supportsBulk
+        self.status = {}
+        self.calls = []
+        self.accessTypes = {}
+        self.badDatasets = set()
+
+    def updateFileStatus(self, logical_file_name=None, is_file_valid=None, dataset=None):
+        self.calls.append(('updateFileStatus', logical_file_name or dataset))
+        if dataset:
+            lfns = self.files.get(dataset, [])
+        elif isinstance(logical_file_name, list):
+            lfns = logical_file_name
+            if not self.supportsBulk and len(lfns) > 1:
+                raise RuntimeError("bulk updates not supported")
+        else:
+            lfns = [logical_file_name]
+        if self.badLfns.intersection(lfns):
+            raise RuntimeError("bad lfn in %s" % lfns)
+        for lfn in lfns:
+            self.status[lfn] = is_file_valid
+
+    def listFileArray(self, dataset=None, logical_file_name=None, detail=False, validFileOnly=0):
+        self.calls.append(('listFileArray', dataset or logical_file_name))
+        if dataset:
+            fileDatasets = [(lfn, dataset) for lfn in self.files.get(dataset, [])]
+        else:
+            datasets = {lfn: dset for dset, lfns in self.files.items() for lfn in lfns}
+            fileDatasets = [(lfn, datasets[lfn]) for lfn in logical_file_name if lfn in datasets]
+        if validFileOnly:
+            # DBS selects the files of VALID and PRODUCTION datasets only
+            fileDatasets = [(lfn, dset) for lfn, dset in fileDatasets if self.status.get(lfn, 1) == 1 and
+                            self.accessTypes.get(dset, 'VALID') in ('VALID', 'PRODUCTION')]
+        if not detail:
+            return [{'logical_file_name': lfn} for lfn, _ in fileDatasets]
+        return [{'logical_file_name': lfn, 'dataset': dset, 'is_file_valid': self.status.get(lfn, 1)}
+                for lfn, dset in fileDatasets]
+
+    def listDatasets(self, dataset=None, detail=False, dataset_access_type=None):
+        self.calls.append(('listDatasets', dataset))
+        if dataset not in self.accessTypes:
+            return []
+        return [{'dataset': dataset, 'dataset_access_type': self.accessTypes[dataset]}]
+
+    def updateDatasetType(self, dataset=None, dataset_access_type=None):
+        self.calls.append(('updateDatasetType', dataset))
+        if dataset in self.badDatasets:
+            raise RuntimeError("cannot update %s" % dataset)
+        self.accessTypes[dataset] = dataset_access_type
+
+    def listFileChildren(self, logical_file_name=None):
+        self.calls.append(('listFileChildren', logical_file_name))
+        lfns = logical_file_name if isinstance(logical_file_name, list) else [logical_file_name]
+        return [{'logical_file_name': lfn, 'child_logical_file_name': self.children[lfn]}
+                for lfn in lfns if lfn in self.children]
+
+
+class SlowFakeDbsApi(FakeDbsApi):
+    """
+    A FakeDbsApi with a latency per update call, tracking the calls in flight
+    and failing the first numFailures calls
+    """
+
+    def __init__(self, latency=0.02, numFailures=0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.numFailures = numFailures
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self._lock = threading.Lock()
+
+    def updateFileStatus(self, **kwargs):
+        with self._lock:
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            failure = self.numFailures > 0
+            self.numFailures -= 1
+        try:
+            time.sleep(self.latency)
+            if failure:
+                raise RuntimeError("Service unavailable")
+            return super().updateFileStatus(**kwargs)
+        finally:
+            with self._lock:
+                self.inFlight -= 1
+
+
+class DbsStandIn(BaseHTTPRequestHandler):
+    """
+    A local DBS writer stand-in, serving updateFileStatus calls sent as JSON POSTs.
+    An update containing any of server.badLfns fails with a server error, and so do
+    the first server.unavailable requests.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        kwargs = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        lfns = kwargs['logical_file_name']
+        lfns = lfns if isinstance(lfns, list) else [lfns]
+        with self.server.lock:
+            self.server.requests.append(lfns)
+            unavailable = self.server.unavailable > 0
+            self.server.unavailable -= 1
+        if unavailable:
+            self.reply(503, {'error': 'Service unavailable'})
+        elif not self.path.endswith('/updateFileStatus'):
+            self.reply(404, {'error': 'Unknown API %s' % self.path})
+        elif self.server.badLfns.intersection(lfns):
+            self.reply(500, {'error': 'Failed to update %s files' % len(lfns)})
+        else:
+            with self.server.lock:
+                self.server.status.update((lfn, kwargs['is_file_valid']) for lfn in lfns)
+            self.reply(200, [])
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpDbsApi(object):
+    """
+    A DbsApi look alike sending every call to a DbsStandIn over a persistent connection
+    """
+
+    def __init__(self, url):
+        parts = urlparse(url)
+        self.url = url
+        self.conn = http.client.HTTPConnection(parts.netloc, timeout=10)
+
+    def _call(self, methodName, **kwargs):
+        self.conn.request('POST', '%s/%s' % (self.url, methodName), json.dumps(kwargs),
+                          {'Content-Type': 'application/json'})
+        response = self.conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise HTTPError(self.url, response.status, body.decode('utf-8'), response.headers, None)
+        return json.loads(body)
+
+    def __getattr__(self, methodName):
+        if methodName.startswith('_'):
+            raise AttributeError(methodName)
+        return lambda **kwargs: self._call(methodName, **kwargs)
+
+    def close(self):
+        self.conn.close()
+
+
+class DBSUpdaterTests(unittest.TestCase):
+    """
+    unittest for the DBSUpdater class
+    """
+
+    def setUp(self):
+        self.lfns = ['/store/data/Era/PD/RAW/v1/000/file%s.root' % num for num in range(50)]
+        self.fakeApi = FakeDbsApi()
+        self.updater = DBSUpdater('https://cmsweb.cern.ch/dbs/prod/global/DBSWriter', chunkSize=10,
+                                  nThreads=4, apiFactory=lambda url: self.fakeApi)
+
+    def makeLineage(self):
+        """
+        A dataset of 20 files, each with two children, sharing a single grand child per pair
+        """
+        dataset = '/PD/Era-v1/RAW'
+        self.fakeApi.files[dataset] = self.lfns[:20]
+        for num, lfn in enumerate(self.lfns[:20]):
+            self.fakeApi.children[lfn] = ['%s.child%s' % (lfn, idx) for idx in range(2)]
+            self.fakeApi.files.setdefault('/PD/Era-v1/AOD', []).extend(self.fakeApi.children[lfn])
+            for child in self.fakeApi.children[lfn]:
+                self.fakeApi.children[child] = '/store/data/Era/PD/MINIAOD/v1/000/grandChild%s.root' % (num // 2)
+            if num % 2:
+                self.fakeApi.files.setdefault('/PD/Era-v1/MINIAOD', []).append(self.fakeApi.children[child])
+        return dataset
+
+    def testClassify(self):
+        """
+        Test sorting entries into datasets, blocks and lfns
+        """
+        entries = [self.lfns[0], '/PD/Era-v1/AOD', '/PD/Era-v1/AOD#1234', 'garbage', None, self.lfns[1],
+                   '/PD/Era-v1/AOD#12#34']
+        classified = classifyEntries(entries)
+        self.assertEqual(classified, {'dataset': ['/PD/Era-v1/AOD'],
+                                      'block': ['/PD/Era-v1/AOD#1234'],
+                                      'lfn': self.lfns[:2],
+                                      'unknown': ['garbage', None, '/PD/Era-v1/AOD#12#34']})
+        self.assertEqual(classifyEntry('/store/data/RAW'), 'dataset')
+        self.assertEqual(classifyEntries(entries, strict=False), classified)
+        self.assertTrue(DBSUpdater._isDataset('/PD/Era-v1/AOD'))
+        self.assertTrue(DBSUpdater._isBlock('/PD/Era-v1/AOD#1234'))
+        self.assertFalse(DBSUpdater._isLfn('/PD/Era-v1/AOD'))
+        # Non lfn entries are not sent to DBS
+        report = self.updater.updateFilesStatus(self.lfns[:2] + ['/PD/Era-v1/AOD'], status='invalid')
+        self.assertEqual(report['updated'], 2)
+        self.assertNotIn('/PD/Era-v1/AOD', self.fakeApi.status)
+        # A three level lfn is not mistaken for a dataset
+        self.assertEqual(classifyEntry('/store/temp/file.root', strict=False), 'lfn')
+        report = self.updater.updateFilesStatus(['/store/temp/file.root', self.lfns[2]], status='invalid')
+        self.assertEqual(report['updated'], 2)
+        self.assertEqual(self.fakeApi.status['/store/temp/file.root'], 0)
+
+    def testBulkUpdates(self):
+        """
+        Test lfns are updated in chunks
+        """
+        report = self.updater.updateFilesStatusBulk(self.lfns, status='invalid')
+        self.assertEqual(report, {'updated': 50, 'failed': [], 'calls': 5, 'skipped': 0})
+        self.assertEqual(self.updater.dbsApi.status, {lfn: 0 for lfn in self.lfns})
+        self.updater.updateFilesStatus(self.lfns[0], status='valid', recursive=True)
+        self.assertEqual(self.updater.dbsApi.status[self.lfns[0]], 1)
+
+    def testBisectFailures(self):
+        """
+        Test a failing chunk is bisected down to the bad lfns only
+        """
+        badLfns = [self.lfns[3], self.lfns[27]]
+        self.updater.dbsApi.badLfns = set(badLfns)
+        report = self.updater.updateFilesStatusBulk(self.lfns, status='invalid')
+        self.assertEqual(report['updated'], 48)
+        self.assertEqual(report['failed'], badLfns)
+        self.assertLess(report['calls'], 20)
+        self.assertTrue(self.updater.bulkUpdates)
+        self.assertNotIn(self.lfns[3], self.updater.dbsApi.status)
+
+    def testNoBulkSupport(self):
+        """
+        Test bulk updates are switched off if the server does not accept them
+        """
+        self.updater.dbsApi.supportsBulk = False
+        report = self.updater.updateFilesStatusBulk(self.lfns, status='invalid')
+        self.assertEqual(report['updated'], 50)
+        self.assertEqual(report['failed'], [])
+        self.assertFalse(self.updater.bulkUpdates)
+        # One failing chunk bisected, followed by per file calls for the rest
+        self.assertLess(report['calls'], 2 * len(self.lfns))
+
+    def testLineage(self):
+        """
+        Test all descendants are updated generation by generation, each file only once
+        """
+        dataset = self.makeLineage()
+        report = self.updater.updateFilesStatus(dataset, status='invalid', recursive=True)
+        self.assertEqual([gen['files'] for gen in report['generations']], [20, 40, 10])
+        self.assertEqual(report['updated'], 70)
+        self.assertEqual(len(self.fakeApi.status), 70)
+        self.assertTrue(all(status == 0 for status in self.fakeApi.status.values()))
+        # The dataset itself is updated with a single call
+        self.assertIn(('updateFileStatus', dataset), self.fakeApi.calls)
+
+        report = self.updater.updateLineageStatus(self.lfns[:2], status='valid', maxDepth=1)
+        self.assertEqual([gen['files'] for gen in report['generations']], [2, 4])
+        self.assertEqual(self.updater.getFilesChildren(self.lfns[:1]), self.fakeApi.children[self.lfns[0]])
+
+    def testLineageCache(self):
+        """
+        Test a second traversal of the same lineage is answered from the cache
+        """
+        dataset = self.makeLineage()
+        self.updater.cache = DBSLineageCache(':memory:')
+        self.updater.updateLineageStatus(dataset, status='invalid')
+        numLookups = len([call for call in self.fakeApi.calls if call[0] != 'updateFileStatus'])
+        self.assertGreater(numLookups, 0)
+        report = self.updater.updateLineageStatus(dataset, status='valid')
+        self.assertEqual(report['updated'], 70)
+        self.assertEqual(len([call for call in self.fakeApi.calls if call[0] != 'updateFileStatus']), numLookups)
+        self.assertEqual(len(self.updater.cache.exportGraph()['children']), 70)
+
+    def testDryRun(self):
+        """
+        Test the dry run plan of a recursive update changes nothing
+        """
+        dataset = self.makeLineage()
+        self.fakeApi.status[self.lfns[0]] = 0
+        plan = self.updater.updateFilesStatus(dataset, status='invalid', recursive=True, dryRun=True)
+        self.assertFalse([call for call in self.fakeApi.calls if call[0] == 'updateFileStatus'])
+        self.assertEqual(plan['files'], 70)
+        self.assertEqual(plan['atTarget'], 1)
+        self.assertEqual(plan['datasets'], {dataset: 20, '/PD/Era-v1/AOD': 40, '/PD/Era-v1/MINIAOD': 10})
+        self.assertEqual([gen['updateCalls'] for gen in plan['generations']], [1, 4, 1])
+        self.assertEqual(plan['updateCalls'], 6)
+        # Only the lfns of a list are planned, as they would be updated
+        plan = self.updater.updateFilesStatus(self.lfns[:3] + [dataset, 'garbage'], status='invalid', dryRun=True)
+        self.assertEqual(plan['files'], 3)
+        self.assertEqual(plan['datasets'], {dataset: 3})
+        plan = self.updater.planLineageStatus(self.lfns[:20], status='invalid', maxDepth=0, callLatency=0.5)
+        self.assertEqual(plan['updateCalls'], 2)
+        self.assertEqual(plan['estimatedTime'], 1.0)
+
+    def testFilterByStatus(self):
+        """
+        Test selecting files by status
+        """
+        dataset = '/PD/Era-v1/RAW'
+        self.fakeApi.files[dataset] = self.lfns
+        for lfn in self.lfns[:5]:
+            self.fakeApi.status[lfn] = 0
+        self.assertEqual(self.updater.getDatasetFiles(dataset, status='valid'), self.lfns[5:])
+        self.assertEqual(self.updater.filterFilesByStatus(dataset, status='invalid'), self.lfns[:5])
+        self.assertEqual(self.updater.filterFilesByStatus(self.lfns[3:8], status=0), self.lfns[3:5])
+        self.assertEqual(list(self.updater.iterFilesByStatus(self.lfns[3], status=1)), [])
+        self.fakeApi.calls = []
+        # A dataset is listed once, never file by file
+        self.updater.filterFilesByStatus(dataset, status='invalid')
+        self.assertEqual(self.fakeApi.calls, [('listFileArray', dataset)])
+        # Lfns unknown to DBS are neither valid nor invalid
+        unknownLfn = '/store/data/Era/PD/RAW/v1/000/unknown.root'
+        self.assertEqual(self.updater.filterFilesByStatus([unknownLfn] + self.lfns[4:6], status=0), self.lfns[4:5])
+        self.assertEqual(self.updater.filterFilesByStatus([unknownLfn], status=1), [])
+        # The valid files of a dataset which is not VALID are still valid
+        self.fakeApi.accessTypes[dataset] = 'INVALID'
+        self.assertEqual(self.updater.filterFilesByStatus(dataset, status='valid'), self.lfns[5:])
+        self.assertEqual(self.updater.filterFilesByStatus(dataset, status='invalid'), self.lfns[:5])
+        # The files to select from are always required
+        self.assertRaises(TypeError, self.updater.filterFilesByStatus, status='valid')
+
+    def testJournal(self):
+        """
+        Test a restarted lineage update skips the files already done
+        """
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        journalFile = os.path.join(tmpDir, 'journal.txt')
+        dataset = self.makeLineage()
+        self.updater.journal = DBSJournal(journalFile)
+        # Interrupted after the first generation
+        self.updater.updateLineageStatus(dataset, status='invalid', maxDepth=0)
+        self.updater.journal.close()
+
+        self.fakeApi.calls = []
+        self.updater.journal = DBSJournal(journalFile)
+        report = self.updater.updateLineageStatus(dataset, status='invalid')
+        self.assertEqual(report['skipped'], 20)
+        self.assertEqual(report['updated'], 50)
+        self.assertNotIn(('updateFileStatus', dataset), self.fakeApi.calls)
+        report = self.updater.updateLineageStatus(dataset, status='invalid')
+        self.assertEqual(report['skipped'], 70)
+        self.assertEqual(report['calls'], 0)
+        self.updater.journal.close()
+        with open(journalFile) as fd:
+            self.assertEqual(len(fd.readlines()), 70)
+
+    def testMetrics(self):
+        """
+        Test the DBS calls and the update progress are recorded in the metrics registry
+        """
+        registry = MetricsRegistry()
+        self.updater = DBSUpdater('https://cmsweb.cern.ch/dbs/prod/global/DBSWriter', chunkSize=10,
+                                  nThreads=4, apiFactory=lambda url: self.fakeApi, metrics=registry)
+        self.fakeApi.badLfns = {self.lfns[0]}
+        dataset = self.makeLineage()
+        self.updater.updateLineageStatus(dataset, status='invalid')
+        self.assertEqual(registry.counter('dbs_calls_total').get(method='listFileChildren'), 7)
+        self.assertGreater(registry.counter('dbs_call_errors_total').get(method='updateFileStatus'), 0)
+        self.assertEqual(registry.counter('dbsupdater_files_updated_total').get(), 69)
+        self.assertEqual(registry.counter('dbsupdater_files_failed_total').get(), 1)
+        self.assertEqual(registry.gauge('dbsupdater_pending_files').get(), 0)
+        self.assertEqual(registry.gauge('dbsupdater_lineage_files').get(), 70)
+        self.assertIn('dbs_call_duration_seconds_count{method="listFileArray"} 1', registry.expose())
+
+    def testBatchDatasets(self):
+        """
+        Test batch dataset status updates, resumed from a checkpoint
+        """
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        datasets = ['/PD%s/Era-v1/AOD' % num for num in range(6)]
+        datasetsFile = os.path.join(tmpDir, 'datasets.txt')
+        with open(datasetsFile, 'w') as fd:
+            fd.write('# campaign clean up\n\n' + '\n'.join(datasets + datasets[:1]) + '\n')
+        checkpointFile = os.path.join(tmpDir, 'checkpoint.json')
+        for dataset in datasets[:5]:
+            self.fakeApi.accessTypes[dataset] = 'VALID'
+        self.fakeApi.accessTypes[datasets[1]] = 'INVALID'
+        self.fakeApi.badDatasets = {datasets[2]}
+
+        self.assertEqual(DBSUpdater.readDatasets(datasetsFile), datasets)
+        info = self.updater.getDatasetsInfo(datasets[:2])
+        self.assertEqual(info[datasets[1]][0]['dataset_access_type'], 'INVALID')
+
+        report = self.updater.updateDatasetsStatus(datasetsFile, 'INVALID', rate=None, checkpointFile=checkpointFile)
+        self.assertEqual([report[dataset]['result'] for dataset in datasets],
+                         ['updated', 'unchanged', 'failed', 'updated', 'updated', 'notFound'])
+        self.assertEqual(report[datasets[0]]['previous'], 'VALID')
+        with open(checkpointFile) as fd:
+            self.assertEqual(len([json.loads(line) for line in fd]), 6)
+
+        # Only the failed dataset is retried
+        self.fakeApi.badDatasets = set()
+        self.fakeApi.calls = []
+        report = self.updater.updateDatasetsStatus(datasets, 'INVALID', rate=None, checkpointFile=checkpointFile)
+        self.assertEqual(report[datasets[2]]['result'], 'updated')
+        self.assertEqual(self.fakeApi.calls, [('listDatasets', datasets[2]), ('updateDatasetType', datasets[2])])
+        self.assertEqual(len(report), 6)
+
+    def testRateLimiter(self):
+        """
+        Test calls are spaced out by the rate limiter
+        """
+        rateLimiter = RateLimiter(50)
+        startTime = time.time()
+        for _ in range(5):
+            rateLimiter.wait()
+        self.assertGreaterEqual(time.time() - startTime, 4 / 50.0)
+
+
+class PooledDBSUpdaterTests(unittest.TestCase):
+    """
+    unittest for the PooledDBSUpdater class
+    """
+
+    def setUp(self):
+        self.lfns = ['/store/data/Era/PD/RAW/v1/000/file%s.root' % num for num in range(100)]
+        self.fakeApi = SlowFakeDbsApi()
+        self.updater = PooledDBSUpdater('https://cmsweb.cern.ch/dbs/prod/global/DBSWriter', chunkSize=10,
+                                        maxInFlight=4, retries=2, backoff=0.01,
+                                        apiFactory=lambda url: self.fakeApi)
+
+    def tearDown(self):
+        self.updater.close()
+
+    def testConcurrentUpdates(self):
+        """
+        Test chunks are updated concurrently, within the in flight limit
+        """
+        self.fakeApi.badLfns = {self.lfns[42]}
+        report = self.updater.updateFilesStatusBulk(self.lfns, status='invalid')
+        self.assertEqual(report['updated'], 99)
+        self.assertEqual(report['failed'], [self.lfns[42]])
+        self.assertEqual(self.fakeApi.maxInFlight, 4)
+
+    def testRetries(self):
+        """
+        Test failed calls are retried with a backoff
+        """
+        self.fakeApi.numFailures = 2
+        report = self.updater.updateFilesStatusBulk(self.lfns[:10], status='invalid')
+        self.assertEqual(report, {'updated': 10, 'failed': [], 'calls': 1, 'skipped': 0})
+        self.fakeApi.numFailures = 3
+        self.assertRaises(RuntimeError, self.updater.dbsApi.updateFileStatus,
+                          logical_file_name=self.lfns[0], is_file_valid=1)
+
+    def testDryRun(self):
+        """
+        Test the estimated time of a plan accounts for the concurrent update calls
+        """
+        plan = self.updater.planLineageStatus(self.lfns[:50], status='invalid', maxDepth=0, callLatency=0.5)
+        self.assertEqual(plan['updateCalls'], 5)
+        # Two waves of at most 4 calls
+        self.assertEqual(plan['estimatedTime'], 1.0)
+
+
+
+class PooledDBSUpdaterHttpTests(unittest.TestCase):
+    """
+    unittest for the PooledDBSUpdater class, against a local DBS stand-in over HTTP
+    """
+
+    def setUp(self):
+        self.lfns = ['/store/data/Era/PD/RAW/v1/000/file%s.root' % num for num in range(30)]
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), DbsStandIn)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.status = {}
+        self.server.badLfns = set()
+        self.server.unavailable = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%s/dbs/prod/global/DBSWriter' % self.server.server_address[1]
+        self.clients = []
+
+    def newApi(self, url):
+        dbsApi = HttpDbsApi(url)
+        self.clients.append(dbsApi)
+        self.addCleanup(dbsApi.close)
+        return dbsApi
+
+    def newUpdater(self):
+        return PooledDBSUpdater(self.url, chunkSize=10, maxInFlight=4, retries=2, backoff=0.01,
+                                apiFactory=self.newApi)
+
+    def testBisectWithoutRetries(self):
+        """
+        Test a failed chunk is retried, but none of the calls bisecting it
+        """
+        self.server.badLfns = {self.lfns[13]}
+        with self.newUpdater() as updater:
+            report = updater.updateFilesStatusBulk(self.lfns, status='invalid')
+        self.assertEqual(report['updated'], 29)
+        self.assertEqual(report['failed'], [self.lfns[13]])
+        self.assertEqual(self.server.status, {lfn: 0 for lfn in self.lfns if lfn != self.lfns[13]})
+        # Only the first call of the failing chunk is retried, twice
+        self.assertEqual(len(self.server.requests), report['calls'] + 2)
+        self.assertEqual(self.server.requests.count(self.lfns[10:20]), 3)
+        # A client per call in flight, and no other
+        self.assertEqual(len(self.clients), 4)
+        # The worker threads are stopped on exit
+        self.assertRaises(RuntimeError, updater._executor.submit, print)
+
+    def testRetries(self):
+        """
+        Test a server error on a chunk update is retried
+        """
+        self.server.unavailable = 2
+        with self.newUpdater() as updater:
+            report = updater.updateFilesStatusBulk(self.lfns[:10], status='valid')
+        self.assertEqual(report, {'updated': 10, 'failed': [], 'calls': 1, 'skipped': 0})
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.status, {lfn: 1 for lfn in self.lfns[:10]})
+
+
+if __name__ == '__main__':
+    unittest.main()
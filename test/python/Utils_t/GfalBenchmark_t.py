@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Unittests for the GfalBenchmark module
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import unittest
+
+from Utils.GfalBenchmark import FakeGfal2Context, STRATEGIES, benchmarkWalk, \
+    benchmarkProtocols, dumpResults, percentile
+
+
+class GfalBenchmarkTests(unittest.TestCase):
+    """
+    unittest for the GfalBenchmark functions
+    """
+
+    def setUp(self):
+        self.basePfn = 'davs://fake.site/store/unmerged'
+
+    def testPercentile(self):
+        """
+        Test the percentile function
+        """
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def testFakeContext(self):
+        """
+        Test the tree shape emulated by FakeGfal2Context
+        """
+        ctx = FakeGfal2Context(self.basePfn, depth=2, fanout=2, filesPerDir=3)
+        self.assertEqual(sorted(ctx.listdir(self.basePfn + '/dir1')),
+                         ['dir0', 'dir1', 'file0.root', 'file1.root', 'file2.root'])
+        self.assertEqual(sorted(ctx.listdir(self.basePfn + '/dir1/dir0/')),
+                         ['file0.root', 'file1.root', 'file2.root'])
+        self.assertEqual(ctx.stat(self.basePfn + '/dir1/file2.root').st_size, 1024)
+        self.assertEqual(ctx.countEntries(), (2 + 4) + 3 * (1 + 2 + 4))
+        for missing in ['/dir2', '/dir1/dir0/dir0', '/file3.root', '/dir0/file0.root/dir0']:
+            self.assertRaises(Exception, ctx.stat, self.basePfn + missing)
+
+    def testBenchmarkWalk(self):
+        """
+        Test a single benchmark run for every strategy
+        """
+        ctxPool = [FakeGfal2Context(self.basePfn, depth=2, fanout=3, filesPerDir=4) for _ in range(3)]
+        for strategy in STRATEGIES:
+            result = benchmarkWalk(ctxPool, self.basePfn, strategy=strategy)
+            self.assertEqual(result['entries'], ctxPool[0].countEntries())
+            self.assertEqual(result['contexts'], 1 if strategy == 'sequential' else 3)
+            self.assertGreater(result['latency']['all']['calls'], 0)
+            self.assertIsNotNone(result['latency']['all']['p99'])
+            self.assertNotIn('peakRssMb', result)
+            self.assertIsNotNone(result['peakTracedMb'])
+        result = benchmarkWalk(ctxPool, self.basePfn, strategy='concurrent-readpp', traceMemory=False)
+        self.assertEqual(result['listingStats']['davs']['statCalls'], 0)
+        self.assertIsNone(result['peakTracedMb'])
+
+    def testTracedPeakPerRun(self):
+        """
+        Test the traced heap peak of a run does not include the allocations made before it
+        """
+        ctxPool = [FakeGfal2Context(self.basePfn, depth=1, fanout=2, filesPerDir=2)]
+        tracemalloc.start()
+        try:
+            blob = bytearray(32 * 1024 * 1024)
+            del blob
+            result = benchmarkWalk(ctxPool, self.basePfn, strategy='sequential')
+            # The tracing started here is left running
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+        self.assertLess(result['peakTracedMb'], 8)
+
+    def testWithoutGfal2(self):
+        """
+        Test the benchmark against fake contexts runs without gfal2 installed
+        """
+        script = ("import sys; sys.modules['gfal2'] = None\n"
+                  "from Utils.GfalBenchmark import FakeGfal2Context, benchmarkWalk\n"
+                  "ctx = FakeGfal2Context('root://fake.site//store', depth=1, fanout=2, filesPerDir=2)\n"
+                  "print(benchmarkWalk([ctx], 'root://fake.site//store')['entries'])\n")
+        output = subprocess.check_output([sys.executable, '-c', script], env=dict(os.environ))
+        self.assertEqual(output.strip(), b'8')
+
+    def testBenchmarkProtocols(self):
+        """
+        Test a benchmark over multiple protocols and the JSON output
+        """
+        protoTargets = {}
+        for proto, prefix in [('WebDAV', 'davs://fake.site'), ('XRootD', 'root://fake.site/')]:
+            basePfn = prefix + '/store/unmerged'
+            protoTargets[proto] = ([FakeGfal2Context(basePfn, depth=1, fanout=2, filesPerDir=2)], basePfn)
+        results = benchmarkProtocols(protoTargets, strategies=['sequential', 'concurrent'])
+        self.assertEqual(sorted(results), ['WebDAV', 'XRootD'])
+        self.assertEqual(sorted(results['XRootD']), ['concurrent', 'sequential'])
+
+        with tempfile.TemporaryDirectory() as tmpDir:
+            outputFile = os.path.join(tmpDir, 'bench.json')
+            dumpResults(results, outputFile)
+            with open(outputFile) as fd:
+                report = json.load(fd)
+        self.assertEqual(report['results']['WebDAV']['sequential']['entries'], 2 + 2 * 3)
+        self.assertGreater(report['processPeakRssMb'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+Unittests for the GfalTreeWalker module
+"""
+
+import errno
+import stat
+import unittest
+from collections import namedtuple
+
+import gfal2
+
+from Utils.GfalTreeWalker import GfalTreeWalker, TreeEntry
+
+
+FakeStat = namedtuple('FakeStat', ['st_mode', 'st_size', 'st_mtime'])
+
+
+class FakeGfalContext(object):
+    """
+    A minimal in-memory replacement of a gfal2 context. The tree is given as
+    a dictionary: directories map to dictionaries, files map to their size.
+    """
+
+    def __init__(self, tree, prefix='davs://fake.site/store'):
+        self.prefix = prefix
+        self.tree = tree
+        self.calls = {'stat': 0, 'listdir': 0}
+
+    def _lookup(self, pfn):
+        if not pfn.startswith(self.prefix):
+            raise gfal2.GError("No such file or directory", errno.ENOENT)
+        node = self.tree
+        for part in [p for p in pfn[len(self.prefix):].split('/') if p]:
+            if not isinstance(node, dict) or part not in node:
+                raise gfal2.GError("No such file or directory", errno.ENOENT)
+            node = node[part]
+        return node
+
+    def stat(self, pfn):
+        self.calls['stat'] += 1
+        node = self._lookup(pfn)
+        if isinstance(node, dict):
+            return FakeStat(stat.S_IFDIR | 0o755, 0, 0)
+        return FakeStat(stat.S_IFREG | 0o644, node, 0)
+
+    def listdir(self, pfn):
+        self.calls['listdir'] += 1
+        node = self._lookup(pfn)
+        if not isinstance(node, dict):
+            raise gfal2.GError("Not a directory", errno.ENOTDIR)
+        return ['.', '..'] + list(node)
+
+
+FakeDirent = namedtuple('FakeDirent', ['d_name'])
+
+
+class FakeGfalDirectory(object):
+    """
+    A minimal replacement of a gfal2 directory handle supporting readpp
+    """
+
+    def __init__(self, ctx, pfn, dirEntryList):
+        self.ctx = ctx
+        self.pfn = pfn.rstrip('/') + '/'
+        self.dirEntryList = list(dirEntryList)
+
+    def readpp(self):
+        if not self.dirEntryList:
+            return None, None
+        dirEntry = self.dirEntryList.pop(0)
+        return FakeDirent(dirEntry), self.ctx.stat(self.pfn + dirEntry, count=False)
+
+
+class FakeGfalContextPlus(FakeGfalContext):
+    """
+    A fake gfal2 context supporting listing through opendir/readpp
+    """
+
+    def __init__(self, tree, prefix='davs://fake.site/store', readppErrno=None):
+        super(FakeGfalContextPlus, self).__init__(tree, prefix=prefix)
+        self.readppErrno = readppErrno
+        self.calls['opendir'] = 0
+
+    def stat(self, pfn, count=True):
+        if not count:
+            self.calls['stat'] -= 1
+        return super(FakeGfalContextPlus, self).stat(pfn)
+
+    def opendir(self, pfn):
+        self.calls['opendir'] += 1
+        if self.readppErrno:
+            raise gfal2.GError("Operation not supported", self.readppErrno)
+        dirEntryList = [dirEntry for dirEntry in self.listdir(pfn, count=False) if dirEntry not in ['.', '..']]
+        return FakeGfalDirectory(self, pfn, dirEntryList)
+
+    def listdir(self, pfn, count=True):
+        if not count:
+            self.calls['listdir'] -= 1
+        return super(FakeGfalContextPlus, self).listdir(pfn)
+
+
+def makeTree(depth, fanout, filesPerDir):
+    """
+    Build a regular tree with the given shape
+    """
+    node = {'file%s.root' % num: 1024 for num in range(filesPerDir)}
+    if depth:
+        for num in range(fanout):
+            node['dir%s' % num] = makeTree(depth - 1, fanout, filesPerDir)
+    return node
+
+
+class GfalTreeWalkerTests(unittest.TestCase):
+    """
+    unittest for the GfalTreeWalker class
+    """
+
+    def setUp(self):
+        self.tree = {'unmerged': makeTree(3, 3, 2)}
+        self.basePfn = 'davs://fake.site/store/unmerged'
+        # 3 + 9 + 27 directories and 2 files in each of them plus the base dir
+        self.numEntries = (3 + 9 + 27) + 2 * (1 + 3 + 9 + 27)
+
+    def testWalkSingleContext(self):
+        """
+        Test a full walk with a single context
+        """
+        walker = GfalTreeWalker(FakeGfalContext(self.tree))
+        entries = list(walker.walk(self.basePfn))
+        self.assertEqual(len(entries), self.numEntries)
+        self.assertEqual(len(set(entries)), self.numEntries)
+        self.assertIn(TreeEntry(self.basePfn + '/dir0/dir1/dir2/file1.root', False, 1024, 0), entries)
+        self.assertIn(TreeEntry(self.basePfn + '/dir0/dir1', True, 0, 0), entries)
+
+    def testWalkContextPool(self):
+        """
+        Test a full walk with a pool of contexts and a tiny frontier
+        """
+        ctxPool = [FakeGfalContext(self.tree) for _ in range(4)]
+        walker = GfalTreeWalker(ctxPool, maxFrontier=2, maxResults=3, pollInterval=0.01)
+        entries = list(walker.walk(self.basePfn + '/'))
+        self.assertEqual(len(entries), self.numEntries)
+        self.assertEqual(len(set(entries)), self.numEntries)
+        self.assertEqual(sum(ctx.calls['listdir'] for ctx in ctxPool), 1 + 3 + 9 + 27)
+
+    def testWalkReadpp(self):
+        """
+        Test the stat information is taken from readpp when it is supported
+        """
+        ctx = FakeGfalContextPlus(self.tree)
+        walker = GfalTreeWalker(ctx)
+        entries = list(walker.walk(self.basePfn))
+        self.assertEqual(len(entries), self.numEntries)
+        self.assertIn(TreeEntry(self.basePfn + '/dir2/file0.root', False, 1024, 0), entries)
+        # Only the base directory has been stat-ed
+        self.assertEqual(ctx.calls['stat'], 1)
+        self.assertEqual(ctx.calls['listdir'], 0)
+        self.assertEqual(walker.getListingStats(),
+                         {'davs': {'readppListings': 1 + 3 + 9 + 27, 'fallbackListings': 0,
+                                   'statCalls': 0, 'statsSaved': self.numEntries}})
+
+    def testWalkReadppFallback(self):
+        """
+        Test the fallback to listdir + stat for protocols without readpp
+        """
+        ctx = FakeGfalContextPlus(self.tree, readppErrno=errno.EOPNOTSUPP)
+        walker = GfalTreeWalker(ctx)
+        entries = list(walker.walk(self.basePfn))
+        self.assertEqual(len(entries), self.numEntries)
+        # readpp is tried only once per protocol
+        self.assertEqual(ctx.calls['opendir'], 1)
+        self.assertEqual(walker.getListingStats(),
+                         {'davs': {'readppListings': 0, 'fallbackListings': 1 + 3 + 9 + 27,
+                                   'statCalls': self.numEntries, 'statsSaved': 0}})
+
+        ctx = FakeGfalContextPlus(self.tree)
+        walker = GfalTreeWalker(ctx, useReadpp=False)
+        self.assertEqual(len(list(walker.walk(self.basePfn))), self.numEntries)
+        self.assertEqual(ctx.calls['opendir'], 0)
+
+    def testWalkFileAndMissing(self):
+        """
+        Test walks started from a file and from a missing entry
+        """
+        walker = GfalTreeWalker(FakeGfalContext(self.tree))
+        filePfn = self.basePfn + '/file0.root'
+        self.assertEqual([entry.pfn for entry in walker.walk(filePfn)], [filePfn])
+        self.assertEqual(list(walker.walk(self.basePfn + '/missing')), [])
+
+    def testHaltAtBottom(self):
+        """
+        Test the walk stops at the first file found
+        """
+        walker = GfalTreeWalker(FakeGfalContext(self.tree))
+        entries = list(walker.walk(self.basePfn, haltAtBottom=True))
+        self.assertFalse(entries[-1].isDir)
+        self.assertTrue(entries[-1].pfn.endswith('.root'))
+        self.assertLess(len(entries), self.numEntries)
+
+    def testCancel(self):
+        """
+        Test early cancellation by closing the generator and by cancel()
+        """
+        ctxPool = [FakeGfalContext(self.tree) for _ in range(3)]
+        walker = GfalTreeWalker(ctxPool, maxResults=1, pollInterval=0.01)
+        walkGen = walker.walk(self.basePfn)
+        next(walkGen)
+        walkGen.close()
+
+        walkGen = walker.walk(self.basePfn)
+        next(walkGen)
+        walker.cancel()
+        self.assertLess(len(list(walkGen)) + 1, self.numEntries)
+
+    def testListingError(self):
+        """
+        Test a listing error is propagated to the caller
+        """
+        ctx = FakeGfalContext(self.tree)
+        ctx.listdir = lambda pfn: (_ for _ in ()).throw(gfal2.GError("Permission denied", errno.EACCES))
+        walker = GfalTreeWalker(ctx)
+        with self.assertRaises(gfal2.GError):
+            list(walker.walk(self.basePfn))
+
+    def testUnexpectedError(self):
+        """
+        Test any other exception raised by a context stops the walk and is propagated
+        """
+        ctxPool = [FakeGfalContext(self.tree) for _ in range(3)]
+        for ctx in ctxPool:
+            ctx.listdir = lambda pfn: (_ for _ in ()).throw(RuntimeError("Plugin crashed"))
+        walker = GfalTreeWalker(ctxPool, pollInterval=0.01)
+        with self.assertRaises(RuntimeError):
+            list(walker.walk(self.basePfn))
+
+        # An AttributeError raised while listing is not mistaken for a missing readpp
+        ctx = FakeGfalContextPlus(self.tree)
+        ctx.opendir = lambda pfn: FakeGfalDirectory(None, pfn, ['file0.root'])
+        walker = GfalTreeWalker(ctx, pollInterval=0.01)
+        with self.assertRaises(AttributeError):
+            list(walker.walk(self.basePfn))
+
+
+if __name__ == '__main__':
+    unittest.main()
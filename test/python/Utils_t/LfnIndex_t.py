@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Unittests for the LfnIndex module
+"""
+
+import tracemalloc
+import unittest
+
+from Utils.LfnIndex import LfnIndex
+
+
+class LfnIndexTests(unittest.TestCase):
+    """
+    unittest for the LfnIndex class
+    """
+
+    def setUp(self):
+        self.protected = ['/store/unmerged/Run3Summer22/QCD/GEN-SIM/124X_v1-v2',
+                          '/store/unmerged/Run3Summer22/QCD/GEN-SIM/124X_v1-v3',
+                          '/store/unmerged/Run2022A/MinBias/RAW/v1/000']
+        self.index = LfnIndex(self.protected)
+
+    def testMembership(self):
+        """
+        Test exact membership and the length of the index
+        """
+        self.assertEqual(len(self.index), 3)
+        self.index.add(self.protected[0] + '/')
+        self.assertEqual(len(self.index), 3)
+        for lfn in self.protected:
+            self.assertIn(lfn, self.index)
+        self.assertNotIn('/store/unmerged/Run3Summer22/QCD/GEN-SIM', self.index)
+        self.assertNotIn('/store/unmerged/Run3Summer22/QCD/GEN-SIM/124X_v1-v4', self.index)
+
+    def testAncestors(self):
+        """
+        Test the LFN or any of its ancestors is found
+        """
+        lfn = '/store/unmerged/Run3Summer22/QCD/GEN-SIM/124X_v1-v2/0000/file.root'
+        self.assertTrue(self.index.isProtected(lfn))
+        self.assertEqual(self.index.findAncestor(lfn), self.protected[0])
+        self.assertEqual(self.index.findAncestor(self.protected[1]), self.protected[1])
+        # Not a component boundary
+        self.assertFalse(self.index.isProtected('/store/unmerged/Run3Summer22/QCD/GEN-SIM/124X_v1-v22/file.root'))
+        self.assertFalse(self.index.isProtected('/store/unmerged/Run3Summer22/QCD/GEN-SIM'))
+        self.assertFalse(self.index.isProtected('/store/unmerged/Other/file.root'))
+
+    def testBatch(self):
+        """
+        Test the batch queries
+        """
+        lfns = ['/store/unmerged/Run3Summer22/QCD/GEN-SIM/124X_v1-v2/0000/file%s.root' % num for num in range(3)]
+        lfns += ['/store/unmerged/Run3Summer22/QCD/GEN-SIM/124X_v1-v5/0000/file%s.root' % num for num in range(3)]
+        lfns += ['/store/unmerged/Run2022A/MinBias/RAW/v1/000', '/store/unmerged/Run2022A/MinBias/RAW/v1/001']
+        self.assertEqual(list(self.index.isProtectedMany(lfns)), [True] * 3 + [False] * 3 + [True, False])
+        self.assertEqual(list(self.index.filterUnprotected(iter(lfns))), lfns[3:6] + lfns[7:])
+
+    def testNestedEntries(self):
+        """
+        Test ancestors are found among entries sorting between a parent and its children
+        """
+        index = LfnIndex(['/store/a/b', '/store/a/b-x', '/store/a/b.y/c', '/store/a/b/c/d'])
+        self.assertEqual(index.findAncestor('/store/a/b/c/d/e.root'), '/store/a/b')
+        self.assertEqual(index.findAncestor('/store/a/b-x/e.root'), '/store/a/b-x')
+        self.assertIsNone(index.findAncestor('/store/a/b.y/e.root'))
+        self.assertIsNone(index.findAncestor('/store/a'))
+        self.assertIn('/store/a/b/c/d', index)
+        index.add('/')
+        self.assertEqual(index.findAncestor('/other/file.root'), '/')
+        self.assertEqual(len(index), 5)
+
+    def testMemory(self):
+        """
+        Test the index takes less memory than a set of the same LFNs
+        """
+        def tracedSize(build):
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                built = build()
+                return tracemalloc.get_traced_memory()[0] - before, built
+            finally:
+                tracemalloc.stop()
+
+        lfnTemplate = '/store/unmerged/Run3Summer22EE%sMiniAODv4/PrimaryDataset%s_TuneCP5_13p6TeV/' \
+                      'MINIAODSIM/130X_mcRun3_2022_realistic_postEE_v6_%s-v2'
+        lfns = lambda: (lfnTemplate % (num % 20, num % 700, num) for num in range(20000))
+        setSize, _ = tracedSize(lambda: set(lfns()))
+        indexSize, index = tracedSize(lambda: LfnIndex(lfns()))
+        self.assertEqual(len(index), 20000)
+        self.assertLess(indexSize, 0.7 * setSize)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Unittests for the SiteStorageConfig module
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from Utils.SiteStorageConfig import StorageConfigCache
+
+
+class StorageConfigCacheTests(unittest.TestCase):
+    """
+    unittest for the StorageConfigCache class
+    """
+
+    def setUp(self):
+        self.siteConfRoot = tempfile.mkdtemp()
+        self.writeConfig('T2_XX_Site1', [{'protocol': 'SRMv2', 'prefix': 'srm://site1/data'},
+                                         {'protocol': 'XRootD', 'prefix': 'root://site1//data'},
+                                         {'protocol': 'WebDAV', 'rules': []},
+                                         {'protocol': 'XRootD', 'prefix': 'root://site1-new//data'}])
+        self.writeConfig('T2_XX_Site2', [{'protocol': 'WebDAV', 'prefix': 'davs://site2:2880/data'}])
+
+    def tearDown(self):
+        shutil.rmtree(self.siteConfRoot)
+
+    def writeConfig(self, rseName, protocols, mtime=None):
+        siteDir = os.path.join(self.siteConfRoot, rseName)
+        if not os.path.isdir(siteDir):
+            os.makedirs(siteDir)
+        configPath = os.path.join(siteDir, 'storage.json')
+        with open(configPath, 'w') as fd:
+            json.dump([{'site': rseName, 'protocols': protocols}], fd)
+        if mtime:
+            os.utime(configPath, (mtime, mtime))
+
+    def testGetPfnPrefix(self):
+        """
+        Test the prefix resolution
+        """
+        cache = StorageConfigCache(siteConfRoot=self.siteConfRoot)
+        self.assertEqual(cache.getPfnPrefix('T2_XX_Site1', 'SRMv2'), 'srm://site1/data')
+        self.assertEqual(cache.getPfnPrefix('T2_XX_Site1', 'XRootD'), 'root://site1-new//data')
+        self.assertIsNone(cache.getPfnPrefix('T2_XX_Site1', 'WebDAV'))
+        self.assertEqual(cache.getPfnPrefix('T2_XX_Site2', 'WebDAV'), 'davs://site2:2880/data')
+        self.assertIsNone(cache.getPfnPrefix('T2_XX_Missing', 'WebDAV'))
+
+    def testMtimeInvalidation(self):
+        """
+        Test a changed storage.json is reloaded, but only after checkInterval
+        """
+        cache = StorageConfigCache(siteConfRoot=self.siteConfRoot, checkInterval=3600)
+        self.assertEqual(cache.getPfnPrefix('T2_XX_Site2', 'WebDAV'), 'davs://site2:2880/data')
+        self.writeConfig('T2_XX_Site2', [{'protocol': 'WebDAV', 'prefix': 'davs://site2-new/data'}], mtime=1000)
+        self.assertEqual(cache.getPfnPrefix('T2_XX_Site2', 'WebDAV'), 'davs://site2:2880/data')
+
+        cache.checkInterval = 0
+        self.assertEqual(cache.getPfnPrefix('T2_XX_Site2', 'WebDAV'), 'davs://site2-new/data')
+        cache.invalidate('T2_XX_Site2')
+        self.assertEqual(cache.getPfnPrefix('T2_XX_Site2', 'WebDAV'), 'davs://site2-new/data')
+
+    def testPreload(self):
+        """
+        Test the bulk preloading of all sites
+        """
+        cache = StorageConfigCache(siteConfRoot=self.siteConfRoot, checkInterval=3600)
+        self.assertEqual(cache.preload(), 2)
+        # Remove the files: everything must be served from the cache now
+        shutil.rmtree(os.path.join(self.siteConfRoot, 'T2_XX_Site1'))
+        self.assertEqual(cache.getPfnPrefix('T2_XX_Site1', 'SRMv2'), 'srm://site1/data')
+        cache.invalidate()
+        self.assertIsNone(cache.getPfnPrefix('T2_XX_Site1', 'SRMv2'))
+        self.assertEqual(cache.preload(['T2_XX_Site2']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
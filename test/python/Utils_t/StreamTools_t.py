@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Unittests for the StreamTools module
+"""
+
+import gzip
+import io
+import unittest
+
+from Utils.StreamTools import iterDecompressed, iterLines, iterFileChunks
+
+
+def splitChunks(data, size):
+    return [data[idx:idx + size] for idx in range(0, len(data), size)]
+
+
+class StreamToolsTests(unittest.TestCase):
+    """
+    unittest for the StreamTools functions
+    """
+
+    def setUp(self):
+        self.lines = ['/store/unmerged/era/primDs/tier/v1/000/file%s.root' % num for num in range(100)]
+        self.payload = ('\n'.join(self.lines[:50]) + '\r\n\n' + '\n'.join(self.lines[50:])).encode('utf-8')
+
+    def testPlainLines(self):
+        """
+        Test lines split over chunk boundaries
+        """
+        for size in (1, 7, 64, len(self.payload)):
+            self.assertEqual(list(iterLines(splitChunks(self.payload, size))), self.lines)
+        self.assertEqual(list(iterLines([])), [])
+
+    def testCompressedLines(self):
+        """
+        Test gzip payloads are detected and decompressed on the fly
+        """
+        zipped = gzip.compress(self.payload)
+        for size in (3, 100, len(zipped)):
+            self.assertEqual(list(iterLines(splitChunks(zipped, size))), self.lines)
+        self.assertEqual(b''.join(iterDecompressed(splitChunks(zipped, 5), compressed=True)), self.payload)
+        self.assertEqual(b''.join(iterDecompressed(splitChunks(self.payload, 5), compressed=False)), self.payload)
+
+    def testFileChunks(self):
+        """
+        Test reading a file like object in chunks
+        """
+        chunks = list(iterFileChunks(io.BytesIO(self.payload), chunkSize=1000))
+        self.assertEqual(b''.join(chunks), self.payload)
+        self.assertTrue(all(len(chunk) <= 1000 for chunk in chunks))
+        # The generator pipeline stops reading as soon as the consumer stops
+        fileObj = io.BytesIO(self.payload)
+        lineGen = iterLines(iterFileChunks(fileObj, chunkSize=100))
+        self.assertEqual(next(lineGen), self.lines[0])
+        self.assertLess(fileObj.tell(), len(self.payload))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Unittests for the WorkScheduler module
+"""
+
+import threading
+import time
+import unittest
+
+from Utils.WorkScheduler import ChunkedWorkScheduler
+
+
+class ChunkedWorkSchedulerTests(unittest.TestCase):
+    """
+    unittest for the ChunkedWorkScheduler class
+    """
+
+    def setUp(self):
+        self.processed = []
+        self.lock = threading.Lock()
+
+    def _work(self, resource, key, chunk):
+        time.sleep(0.001 * len(chunk))
+        with self.lock:
+            self.processed.extend((key, item, resource) for item in chunk)
+
+    def testChunking(self):
+        """
+        Test a big unit of work is split in chunks and spread over all threads
+        """
+        scheduler = ChunkedWorkScheduler(self._work, nWorkers=4, chunkSize=10)
+        self.assertEqual(scheduler.submit('big', range(200)), 20)
+        self.assertEqual(scheduler.submit('small', range(5)), 1)
+        scheduler.start()
+        scheduler.stop()
+        self.assertEqual(len(self.processed), 205)
+        self.assertEqual(sorted(item for key, item, _ in self.processed if key == 'big'), list(range(200)))
+
+        metrics = scheduler.getMetrics()
+        self.assertEqual(len(metrics['threads']), 4)
+        self.assertEqual(metrics['queued'], 0)
+        self.assertEqual(sum(thread['items'] for thread in metrics['threads'].values()), 205)
+        # Every thread got a share of the big unit
+        for thread in metrics['threads'].values():
+            self.assertGreater(thread['chunks'], 0)
+            self.assertGreater(thread['utilisation'], 0)
+        self.assertGreater(metrics['poolUtilisation'], 0)
+
+    def testPriority(self):
+        """
+        Test chunks from bigger units are served first
+        """
+        scheduler = ChunkedWorkScheduler(self._work, nWorkers=1, chunkSize=100)
+        scheduler.submit('small', range(1))
+        scheduler.submit('big', range(50))
+        scheduler.start()
+        scheduler.stop()
+        self.assertEqual(self.processed[0][0], 'big')
+        self.assertEqual(self.processed[-1][0], 'small')
+
+    def testResourceAndErrors(self):
+        """
+        Test the per thread resources and the error accounting
+        """
+        resources = []
+
+        def resourceFactory():
+            with self.lock:
+                resources.append(object())
+                return resources[-1]
+
+        def failingWork(resource, key, chunk):
+            if key == 'bad':
+                raise RuntimeError("bad chunk")
+            self._work(resource, key, chunk)
+
+        scheduler = ChunkedWorkScheduler(failingWork, nWorkers=3, chunkSize=2, resourceFactory=resourceFactory)
+        scheduler.start()
+        scheduler.submit('good', range(6))
+        scheduler.submit('bad', range(4))
+        scheduler.join()
+        self.assertEqual(len(self.processed), 6)
+        self.assertTrue(all(resource in resources for _, _, resource in self.processed))
+        scheduler.stop()
+        self.assertEqual(len(resources), 3)
+        metrics = scheduler.getMetrics()
+        self.assertEqual(sum(thread['errors'] for thread in metrics['threads'].values()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Check the bulk workloadsummary retrieval of couchdbWfInfo against a local
+CouchDB stand-in, serving both the per document and the _all_docs API.
+Run it from the top directory: python tests/testCouchBulk.py
+"""
+from __future__ import print_function
+
+import json
+import os
+import sys
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import couchdbWfInfo
+
+DBPATH = '/couchdb/workloadsummary/'
+DOCS = dict(('wf%s' % num, {'_id': 'wf%s' % num, 'output': {'/PD/Era-v%s/AOD' % num: {'events': num}}})
+            for num in range(25))
+REQUESTS = []
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    # Every keep-alive connection is served by a thread of its own
+    daemon_threads = True
+
+
+class CouchStandIn(BaseHTTPRequestHandler):
+    """
+    Serves DOCS, formatting _all_docs responses either the way CouchDB does
+    (one row per line) or as a single line, depending on the class attribute
+    """
+    protocol_version = 'HTTP/1.1'
+    rowPerLine = True
+
+    def reply(self, code, payload):
+        body = payload.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        REQUESTS.append(self.path)
+        docId = self.path[len(DBPATH):]
+        if docId in DOCS:
+            self.reply(200, json.dumps(DOCS[docId]))
+        else:
+            self.reply(404, json.dumps({'error': 'not_found', 'reason': 'missing'}))
+
+    def do_POST(self):
+        REQUESTS.append(self.path)
+        if self.path != DBPATH + '_all_docs?include_docs=true':
+            self.reply(400, '{}')
+            return
+        keys = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))['keys']
+        rows = []
+        for key in keys:
+            if key in DOCS:
+                rows.append({'id': key, 'key': key, 'value': {'rev': '1-abc'}, 'doc': DOCS[key]})
+            else:
+                rows.append({'key': key, 'error': 'not_found'})
+        if self.rowPerLine:
+            payload = '{"total_rows":%s,"offset":0,"rows":[\r\n' % len(DOCS)
+            payload += ',\r\n'.join(json.dumps(row) for row in rows)
+            payload += '\r\n]}\n'
+        else:
+            payload = json.dumps({'total_rows': len(DOCS), 'offset': 0, 'rows': rows})
+        self.reply(200, payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingServer(('127.0.0.1', 0), CouchStandIn)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    reqmgrUrl = 'http://127.0.0.1:%s' % server.server_address[1]
+    listRequests = sorted(DOCS) + ['missingWf']
+
+    single = list(couchdbWfInfo.fetchCouchdb(listRequests, reqmgrUrl, nThreads=4))
+    for rowPerLine in (True, False):
+        CouchStandIn.rowPerLine = rowPerLine
+        del REQUESTS[:]
+        bulk = list(couchdbWfInfo.fetchCouchdbBulk(listRequests, reqmgrUrl, batchSize=10))
+        assert bulk == single, "bulk and single document results differ"
+        assert len(REQUESTS) == 3, "expected 3 _all_docs requests, got %s" % len(REQUESTS)
+        assert dict(bulk)['missingWf'] == {}
+        print("OK: %s workflows in %s requests (rowPerLine=%s)" % (len(bulk), len(REQUESTS), rowPerLine))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Unittests for the concurrent workflow fetches of couchdbWfInfo, with the
+couchdb lookup of a single workflow replaced by a local stand-in.
+Run them from the top directory: python tests/testCouchdbWfInfo.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import couchdbWfInfo
+
+
+class FetchCouchdbTests(unittest.TestCase):
+    """
+    unittest for the fetchCouchdb function
+    """
+
+    def setUp(self):
+        self.listRequests = ['wf%s' % num for num in range(8)]
+        self.calls = []
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.reqmgrUrl = 'https://cmsweb.cern.ch'
+        handleCoucdb = couchdbWfInfo.handleCoucdb
+        self.addCleanup(setattr, couchdbWfInfo, 'handleCoucdb', handleCoucdb)
+        couchdbWfInfo.handleCoucdb = self.fakeHandleCouchdb
+
+    def fakeHandleCouchdb(self, reqName, reqmgrUrl):
+        """
+        The later a workflow comes in the list, the faster its lookup completes
+        """
+        with self.lock:
+            self.calls.append((reqName, time.time()))
+        time.sleep(0.01 * (len(self.listRequests) - self.listRequests.index(reqName)))
+        if reqName in self.failures:
+            raise self.failures[reqName]
+        return {'_id': reqName, 'url': reqmgrUrl}
+
+    def testOrdered(self):
+        """
+        Test the results are yielded in input order, whatever the completion order
+        """
+        results = list(couchdbWfInfo.fetchCouchdb(self.listRequests, self.reqmgrUrl, nThreads=8))
+        self.assertEqual([reqName for reqName, _ in results], self.listRequests)
+        for reqName, couchdbOut in results:
+            self.assertEqual(couchdbOut, {'_id': reqName, 'url': self.reqmgrUrl})
+        self.assertEqual(sorted(reqName for reqName, _ in self.calls), self.listRequests)
+
+    def testUnordered(self):
+        """
+        Test the results are yielded as they complete if ordered is False
+        """
+        results = list(couchdbWfInfo.fetchCouchdb(self.listRequests, self.reqmgrUrl, nThreads=8, ordered=False))
+        self.assertEqual(sorted(reqName for reqName, _ in results), self.listRequests)
+        self.assertNotEqual([reqName for reqName, _ in results], self.listRequests)
+
+    def testFailures(self):
+        """
+        Test a failed lookup is reported as its exception, without losing the other workflows
+        """
+        self.failures['wf3'] = ValueError("No JSON object could be decoded")
+        self.failures['wf6'] = KeyError('result')
+        results = list(couchdbWfInfo.fetchCouchdb(self.listRequests, self.reqmgrUrl, nThreads=3))
+        self.assertEqual([reqName for reqName, _ in results], self.listRequests)
+        for reqName, couchdbOut in results:
+            if reqName in self.failures:
+                self.assertIs(couchdbOut, self.failures[reqName])
+            else:
+                self.assertEqual(couchdbOut['_id'], reqName)
+        # An unreachable server still stops the script, and no other lookup is started
+        self.failures['wf5'] = SystemExit(2)
+        self.calls = []
+        self.assertRaises(SystemExit, list, couchdbWfInfo.fetchCouchdb(self.listRequests, self.reqmgrUrl))
+        time.sleep(0.2)
+        # The single worker thread may have started the next lookup before the failure was seen
+        self.assertIn([reqName for reqName, _ in self.calls], [self.listRequests[:6], self.listRequests[:7]])
+
+    def testRate(self):
+        """
+        Test the lookups are spaced out according to the rate, whatever the number of threads
+        """
+        list(couchdbWfInfo.fetchCouchdb(self.listRequests[:6], self.reqmgrUrl, nThreads=6, rate=20))
+        callTimes = sorted(callTime for _, callTime in self.calls)
+        self.assertEqual(len(callTimes), 6)
+        for previous, current in zip(callTimes, callTimes[1:]):
+            self.assertGreaterEqual(current - previous, 0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
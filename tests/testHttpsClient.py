@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+"""
+Unittests for the httpsClient module, run against a local HTTP server.
+Run them from the top directory: python tests/testHttpsClient.py
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+from collections import OrderedDict
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import httpsClient
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    # Every keep-alive connection is served by a thread of its own
+    daemon_threads = True
+
+    def __init__(self, address, handler):
+        HTTPServer.__init__(self, address, handler)
+        # path -> (status, body)
+        self.docs = {}
+        # path -> ETag of the document
+        self.etags = {}
+        self.connections = 0
+        # The server side sockets of all the connections
+        self.sockets = []
+        self.requests = []
+        # The request headers, with lower cased names
+        self.requestHeaders = []
+        # Close every connection after a reply, without telling the client
+        self.dropConnections = False
+
+    def dropIdleConnections(self):
+        """
+        Close all the connections made so far, as a server does with idle keep-alive connections
+        """
+        for sock in self.sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves the documents of the server, counting the connections and recording the requests
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+        self.server.sockets.append(self.connection)
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.server.requestHeaders.append(dict((name.lower(), value) for name, value in self.headers.items()))
+        status, body = self.server.docs.get(self.path, (404, b'{"error": "not_found"}'))
+        etag = self.server.etags.get(self.path)
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.reply(304, b'', {'ETag': etag})
+        else:
+            self.reply(status, body, {'ETag': etag} if etag else {})
+        if self.server.dropConnections:
+            self.close_connection = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPSessionTests(unittest.TestCase):
+    """
+    unittest for the HTTPSession class
+    """
+
+    def setUp(self):
+        self.server = ThreadingServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.baseUrl = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.session = httpsClient.HTTPSession()
+        self.addCleanup(lambda: self.session.close())
+        for num in range(5):
+            self.server.docs['/doc%s' % num] = (200, ('{"num": %s}' % num).encode('utf-8'))
+
+    def testConnectionReuse(self):
+        """
+        Test consecutive requests to a host go over a single connection
+        """
+        for num in range(5):
+            response = self.session.request('%s/doc%s' % (self.baseUrl, num))
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.body, ('{"num": %s}' % num).encode('utf-8'))
+        self.assertEqual(list(self.session.iterLines(self.baseUrl + '/doc1')), ['{"num": 1}'])
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.requests), 6)
+
+    def testReconnect(self):
+        """
+        Test a request over a connection closed by the server is retried over a new one
+        """
+        self.server.dropConnections = True
+        for num in range(3):
+            response = self.session.request('%s/doc%s' % (self.baseUrl, num))
+            self.assertEqual(response.body, ('{"num": %s}' % num).encode('utf-8'))
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(self.server.requests, ['/doc0', '/doc1', '/doc2'])
+
+    def testReconnectPool(self):
+        """
+        Test a request is retried over a new connection, not another idle one, when the
+        server has dropped all the idle connections of the pool
+        """
+        opened = [self.session.open('%s/doc%s' % (self.baseUrl, num)) for num in range(3)]
+        for response, release in opened:
+            response.read()
+            release()
+        self.assertEqual(self.server.connections, 3)
+        self.server.dropIdleConnections()
+        response = self.session.request(self.baseUrl + '/doc4')
+        self.assertEqual(response.body, b'{"num": 4}')
+        self.assertEqual(self.server.connections, 4)
+        # The new connection is kept, the dropped ones are gone
+        for num in range(3):
+            self.session.request('%s/doc%s' % (self.baseUrl, num))
+        self.assertEqual(self.server.connections, 4)
+
+    def testErrors(self):
+        """
+        Test error replies raise an HTTPError and leave the connection usable
+        """
+        with self.assertRaises(httpsClient.HTTPError) as context:
+            self.session.request(self.baseUrl + '/missing')
+        self.assertEqual(context.exception.code, 404)
+        with self.assertRaises(httpsClient.HTTPError):
+            list(self.session.iterChunks(self.baseUrl + '/missing'))
+        self.assertEqual(self.session.request(self.baseUrl + '/doc0').status, 200)
+        self.assertEqual(self.server.connections, 1)
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+        self.session = httpsClient.HTTPSession()
+        self.assertRaises(httpsClient.URLError, self.session.request, self.baseUrl + '/doc0')
+
+
+class ResponseCacheTests(unittest.TestCase):
+    """
+    unittest for the ResponseCache class and the conditional requests of HTTPSession
+    """
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cacheDir)
+        self.server = ThreadingServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%s/doc' % self.server.server_address[1]
+        self.server.docs['/doc'] = (200, b'{"version": 1}')
+        self.server.etags['/doc'] = '"v1"'
+        self.cache = httpsClient.ResponseCache(self.cacheDir)
+        self.session = httpsClient.HTTPSession(cache=self.cache)
+        self.addCleanup(self.session.close)
+
+    def testRevalidation(self):
+        """
+        Test a cached body is revalidated with its ETag and served from the cache on a 304
+        """
+        response = self.session.request(self.url)
+        self.assertEqual((response.status, response.body), (200, b'{"version": 1}'))
+        self.assertNotIn('if-none-match', self.server.requestHeaders[-1])
+        self.assertEqual(self.cache.get(self.url)[1]['etag'], '"v1"')
+
+        response = self.session.request(self.url)
+        self.assertEqual((response.status, response.body), (304, b'{"version": 1}'))
+        self.assertEqual(self.server.requestHeaders[-1]['if-none-match'], '"v1"')
+
+        # A changed document replaces the cached one
+        self.server.docs['/doc'] = (200, b'{"version": 2}')
+        self.server.etags['/doc'] = '"v2"'
+        response = self.session.request(self.url)
+        self.assertEqual((response.status, response.body), (200, b'{"version": 2}'))
+        body, meta = self.cache.get(self.url)
+        self.assertEqual((body, meta['etag']), (b'{"version": 2}', '"v2"'))
+        # The cache persists across sessions
+        session = httpsClient.HTTPSession(cache=httpsClient.ResponseCache(self.cacheDir))
+        self.assertEqual(session.request(self.url).status, 304)
+        session.close()
+        self.assertEqual(len(self.server.requests), 4)
+
+    def testNotCached(self):
+        """
+        Test responses without validators and POST requests are not cached
+        """
+        self.assertEqual(self.session.request(self.url, data='{}').status, 200)
+        self.assertIsNone(self.cache.get(self.url))
+        del self.server.etags['/doc']
+        self.session.request(self.url)
+        self.assertIsNone(self.cache.get(self.url))
+        self.session.request(self.url)
+        self.assertNotIn('if-none-match', self.server.requestHeaders[-1])
+        self.cache.put(self.url, b'{}', {'etag': '"v1"'})
+        # An outdated entry is dropped once the server stops sending an ETag
+        self.session.request(self.url)
+        self.assertIsNone(self.cache.get(self.url))
+        self.assertEqual(os.listdir(self.cacheDir), [])
+
+    def testLastModified(self):
+        """
+        Test a Last-Modified header is stored and sent back as If-Modified-Since
+        """
+        lastModified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        self.cache.put(self.url, b'{"version": 0}', {'last-modified': lastModified})
+        body, meta = self.cache.get(self.url)
+        self.assertEqual((body, meta['lastModified'], meta['etag']), (b'{"version": 0}', lastModified, None))
+        self.assertEqual(self.session.request(self.url).body, b'{"version": 1}')
+        self.assertEqual(self.server.requestHeaders[-1]['if-modified-since'], lastModified)
+
+    def testEviction(self):
+        """
+        Test the least recently used entries are evicted beyond the maximum size
+        """
+        cache = httpsClient.ResponseCache(self.cacheDir, maxSize=100)
+        for num in range(3):
+            cache.put('https://host/doc%s' % num, b'x' * 40, {'etag': '"%s"' % num})
+        # doc0 is evicted to make room for doc2
+        self.assertIsNone(cache.get('https://host/doc0'))
+        self.assertIsNotNone(cache.get('https://host/doc1'))
+        cache.put('https://host/doc3', b'y' * 40, {'etag': '"3"'})
+        # doc1 was used more recently than doc2
+        self.assertIsNone(cache.get('https://host/doc2'))
+        self.assertIsNotNone(cache.get('https://host/doc1'))
+        self.assertIsNotNone(cache.get('https://host/doc3'))
+        # A body larger than the cache is never stored
+        cache.put('https://host/big', b'z' * 101, {'etag': '"big"'})
+        self.assertIsNone(cache.get('https://host/big'))
+        self.assertEqual(len(os.listdir(self.cacheDir)), 4)
+
+    def testCorruptEntries(self):
+        """
+        Test corrupt cache files are dropped and the document fetched again
+        """
+        self.session.request(self.url)
+        key = self.cache._key(self.url)
+        for ext, garbage in (('.meta', '{"url": '), ('.body', '{"vers')):
+            with open(os.path.join(self.cacheDir, key + ext), 'w') as fd:
+                fd.write(garbage)
+            self.assertIsNone(self.cache.get(self.url))
+            self.assertFalse(os.path.exists(os.path.join(self.cacheDir, key + '.body')))
+            response = self.session.request(self.url)
+            self.assertEqual((response.status, response.body), (200, b'{"version": 1}'))
+            self.assertNotIn('if-none-match', self.server.requestHeaders[-1])
+            self.assertEqual(self.cache.get(self.url)[0], b'{"version": 1}')
+
+
+def splitChunks(payload, chunkSize):
+    """
+    Split a payload in bytes chunks of a given size
+    """
+    payload = payload.encode('utf-8')
+    return [payload[idx:idx + chunkSize] for idx in range(0, len(payload), chunkSize)]
+
+
+class IterResultItemsTests(unittest.TestCase):
+    """
+    unittest for the iterResultItems incremental parser
+    """
+
+    def assertParsed(self, payload, maxChunkSize=None):
+        """
+        Check the items parsed from a payload split in chunks of any size are those of json.loads
+        """
+        expected = list(json.loads(payload, object_pairs_hook=OrderedDict)['result'][0].items())
+        for chunkSize in range(1, (maxChunkSize or len(payload.encode('utf-8'))) + 1):
+            self.assertEqual(list(httpsClient.iterResultItems(splitChunks(payload, chunkSize))), expected)
+
+    def testTokens(self):
+        """
+        Test all kinds of json values, split at any position
+        """
+        self.assertParsed(u'{"result": [{"t": true, "f": false, "n": null, "i": -1234567, "x": 1.5e-10, '
+                          u'"z": 0, "l": [1, [2, {}]], "o": {"a": {"b": []}}, "s": ""}]}')
+        self.assertParsed(u'{"result":[{"num":12345678901234567890}]}')
+        self.assertParsed(u'  {\n  "result" : [ {\n "a" : 1 ,\n "b" : 2\n } ]\n}\n')
+
+    def testStrings(self):
+        """
+        Test strings with escaped quotes, braces and brackets
+        """
+        self.assertParsed(u'{"result": [{"a\\"}b": "x}{\\"]\\\\", "c": "\\u00e9\\n}", '
+                          u'"d": ["}", "{", "\\"result\\": [{"]}]}')
+
+    def testMultiByteCharacters(self):
+        """
+        Test multi byte UTF-8 sequences split across chunks
+        """
+        self.assertParsed(u'{"result": [{"caf\u00e9": "\u20ac\U0001f600", "\u00fc": ["\u4e2d\u6587"]}]}')
+
+    def testEmptyResult(self):
+        """
+        Test nothing is yielded for an empty result
+        """
+        for payload in (u'{"result": []}', u'{"result": [{}]}', u'{"result": [ { } ]}', u'{}'):
+            for chunkSize in range(1, len(payload) + 1):
+                self.assertEqual(list(httpsClient.iterResultItems(splitChunks(payload, chunkSize))), [])
+
+    def testTruncated(self):
+        """
+        Test a truncated document raises a ValueError, after the items complete so far
+        """
+        payload = u'{"result": [{"wf1": {"TotalEstimatedJobs": 10}, "wf2": {"TotalEstimatedJobs": 20}}]}'
+        for end in range(len(payload) - 2):
+            for chunkSize in (1, 7, 1000):
+                items = []
+                with self.assertRaises(ValueError):
+                    for item in httpsClient.iterResultItems(splitChunks(payload[:end], chunkSize)):
+                        items.append(item)
+                self.assertLessEqual(len(items), 2)
+        self.assertRaises(ValueError, list, httpsClient.iterResultItems([]))
+
+    def testReqMgrPayload(self):
+        """
+        Test a reqmgr2 shaped payload against json.loads
+        """
+        result = OrderedDict()
+        for num in range(50):
+            reqName = u'pdmvserv_Run2022C_JetMET_ACDC%s_Prompt_v1_%s_%s' % (num, 220920 + num, 1000 + num)
+            result[reqName] = OrderedDict([(u'RequestName', reqName),
+                                           (u'RequestStatus', u'completed'),
+                                           (u'TotalEstimatedJobs', num * 10),
+                                           (u'InitialTaskPath', u'/pdmvserv_task/DataProcessing'),
+                                           (u'OutputDatasets', [u'/JetMET/Run2022C-PromptReco-v1/AOD']),
+                                           (u'Memory', 3000.5),
+                                           (u'Comments', u'caf\u00e9 "ACDC" {round %s}' % num)])
+        payload = json.dumps({u'result': [result]})
+        self.assertParsed(payload, maxChunkSize=64)
+        self.assertEqual(list(httpsClient.iterResultItems(splitChunks(payload, 65536))), list(result.items()))
+
+
+
+class IterCouchRowsTests(unittest.TestCase):
+    """
+    unittest for the iterCouchRows parser
+    """
+
+    def setUp(self):
+        self.rows = [{'id': 'wf%s' % num, 'key': 'wf%s' % num, 'doc': {'num': num}} for num in range(3)]
+        self.rows.append({'key': 'missingWf', 'error': 'not_found'})
+
+    def lines(self):
+        """
+        The lines of an _all_docs response, formatted the way CouchDB does it
+        """
+        return (['{"total_rows":3,"offset":0,"rows":[\r\n'] +
+                [json.dumps(row) + ',\r\n' for row in self.rows[:-1]] +
+                [json.dumps(self.rows[-1]) + '\r\n', ']}\n'])
+
+    def testRowPerLine(self):
+        """
+        Test the rows are parsed line by line, or as a whole if on a single line
+        """
+        self.assertEqual(list(httpsClient.iterCouchRows(self.lines())), self.rows)
+        payload = json.dumps({'total_rows': 3, 'offset': 0, 'rows': self.rows})
+        self.assertEqual(list(httpsClient.iterCouchRows([payload])), self.rows)
+        self.assertEqual(list(httpsClient.iterCouchRows(['{"total_rows":0,"offset":0,"rows":[\r\n', ']}\n'])), [])
+
+    def testUnparsableRows(self):
+        """
+        Test an unparsable line around the rows raises a ValueError, instead of being dropped
+        """
+        for idx in range(1, len(self.lines())):
+            lines = self.lines()
+            lines.insert(idx, '{"id":"wf9","key":"wf9","doc":{"num":\r\n')
+            self.assertRaises(ValueError, list, httpsClient.iterCouchRows(lines))
+        # A truncated response
+        self.assertRaises(ValueError, list, httpsClient.iterCouchRows(self.lines()[:-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()